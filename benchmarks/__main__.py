@@ -0,0 +1,20 @@
+"""Run every benchmark. Run from the repository root: python -m benchmarks"""
+
+import sys
+
+from . import (bench_cookies, bench_duo_config, bench_extract, bench_login,
+               bench_perform, bench_startup)
+
+
+def main():
+    status = 0
+    for benchmark in (bench_extract, bench_duo_config, bench_startup,
+                      bench_cookies, bench_login, bench_perform):
+        print(f"== {benchmark.__name__.rsplit('.', 1)[-1]}")
+        status |= benchmark.main()
+        print()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Measure cookie file load and save times for large cookie files.
+
+Loads are also measured from the binary cache kept next to the file and
+through a CookieBroker, and Cookie headers are added repeatedly, from one
+thread and from several at once.
+
+Run from the repository root with: python -m benchmarks.bench_cookies
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import urllib.request
+
+from src.broker import CookieBroker
+from src.cURLCookieJar import Cookie, cURLCookieJar
+
+from .timing import report, timer
+
+
+def write_cookie_file(filename, domains, cookies_per_domain=4):
+    with open(filename, "w") as f:
+        f.write("# Netscape HTTP Cookie File\n")
+        for i in range(domains):
+            for j in range(cookies_per_domain):
+                f.write(f".service{i}.umich.edu\tTRUE\t/\tTRUE\t4000000000\t"
+                        f"cookie{j}\t{'v' * 40}\n")
+
+
+def _cookie(name):
+    return Cookie(0, name, "value", None, False, ".service0.umich.edu", True,
+                  True, "/", False, True, 4000000000, False, None, None, {})
+
+
+def _add_headers(jar, urls, count):
+    for _ in range(count):
+        for url in urls:
+            jar.add_cookie_header(urllib.request.Request(url))
+
+
+def _add_headers_concurrently(jar, threads, count):
+    workers = [
+        threading.Thread(target=_add_headers, args=(
+            jar, [f"https://service{i}.umich.edu/"], count
+        ))
+        for i in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def main(domains=5000, runs=10, headers=1000, threads=8):
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "cookies.tmp")
+        write_cookie_file(filename, domains)
+        print(f"cookie file with {domains * 4} cookies "
+              f"({os.path.getsize(filename) // 1024} KiB)")
+
+        load, header, save_all, save_merge = [], [], [], []
+        repeated, concurrent = [], []
+        cached_load, publish, shared_load = [], [], []
+        for _ in range(runs):
+            jar = cURLCookieJar(filename)
+            with timer(load):
+                jar.load(ignore_discard=True)
+            request = urllib.request.Request("https://service0.umich.edu/")
+            with timer(header):
+                jar.add_cookie_header(request)
+            with timer(repeated):
+                _add_headers(jar, ["https://service0.umich.edu/"], headers)
+            with timer(concurrent):
+                _add_headers_concurrently(jar, threads, headers)
+            jar.set_cookie(_cookie("changed"))
+            with timer(save_merge):
+                jar.save(ignore_discard=True, merge=True)
+            with timer(save_all):
+                jar.save(ignore_discard=True)
+
+            # The first load after the saves above writes the cache.
+            cURLCookieJar(filename, binary_cache=True).load(
+                ignore_discard=True
+            )
+            cached = cURLCookieJar(filename, binary_cache=True)
+            with timer(cached_load):
+                cached.load(ignore_discard=True)
+
+            broker = CookieBroker(filename)
+            with timer(publish):
+                broker.publish(jar.entries(ignore_discard=True))
+            shared = cURLCookieJar(filename)
+            with timer(shared_load):
+                shared.load_entries(CookieBroker(filename).read()[1])
+
+        report("  load", load)
+        report("  first Cookie header", header)
+        report(f"  {headers} Cookie headers", repeated)
+        report(f"  {headers} Cookie headers x {threads} threads", concurrent)
+        report("  save (merge changes)", save_merge)
+        report("  save (whole jar)", save_all)
+        report("  load (binary cache)", cached_load)
+        report("  publish (CookieBroker)", publish)
+        report("  load (CookieBroker)", shared_load)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""
+Compare duo_config parsing with the regex and ast.literal_eval it replaced.
+
+Each case covers what one login does with the weblogin script: read the
+error message and duo_config, then use the TX and APP signatures (the TX
+signature twice for the Duo auth request, the APP signature once for the
+final weblogin request).
+
+Run from the repository root with: python -m benchmarks.bench_duo_config
+"""
+
+import ast
+import re
+import sys
+import timeit
+
+from src.duoconfig import parse_duo_config
+from src.extract import find_script
+
+from .pages import weblogin_duo_page
+
+JS_REGEX = re.compile(
+    r"[;\s](var|const|let)\s+error\s*=\s*(['\"])(.*?)\2\s*;",
+    re.MULTILINE
+)
+DUO_CONFIG_REGEX = re.compile(
+    r"[;\s](var|const|let)\s+duo_config\s*=\s*({[^}]*})\s*;",
+    re.MULTILINE
+)
+
+
+def _regex_login(script):
+    error = re.search(JS_REGEX, script).group(3)
+    config = ast.literal_eval(re.search(DUO_CONFIG_REGEX, script).group(2))
+    tx = config["sig_request"].split(":APP")[0]
+    tx = config["sig_request"].split(":APP")[0]
+    app = config["sig_request"].split(":APP")[1]
+    return error, config["host"], tx, app
+
+
+def _tokenizer_login(script):
+    error, config = parse_duo_config(script)
+    tx = config.tx_signature
+    tx = config.tx_signature
+    app = config.app_signature
+    return error, config.host, tx, app
+
+
+def main():
+    script = find_script(weblogin_duo_page(), JS_REGEX)
+    assert _regex_login(script) == _tokenizer_login(script)
+
+    number = 2000
+    cases = [
+        ("regex + literal_eval", _regex_login),
+        ("tokenizer", _tokenizer_login),
+    ]
+    times = {}
+    for name, parse in cases:
+        times[name] = min(timeit.repeat(
+            lambda: parse(script), number=number, repeat=5
+        )) / number
+        print(f"{name:<24} {times[name] * 1e6:>8.1f}us per login")
+    baseline = times["regex + literal_eval"]
+    print(f"{'speedup':<24} {baseline / times['tokenizer']:>8.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""
+Compare the targeted extractor with Beautiful Soup on weblogin/Duo pages.
+
+Run from the repository root with: python -m benchmarks.bench_extract
+"""
+
+import re
+import sys
+import timeit
+
+from src.extract import (_parse_duo_prompt_bs4, _soup, find_script,
+                         parse_duo_prompt)
+
+from .pages import duo_prompt_page, weblogin_duo_page
+
+JS_REGEX = re.compile(
+    r"[;\s](var|const|let)\s+error\s*=\s*(['\"])(.*?)\2\s*;",
+    re.MULTILINE
+)
+
+
+def _bs4_find_script(html):
+    return _soup(html).find("script", string=JS_REGEX).string
+
+
+def main():
+    if _soup("") is None:
+        print("Beautiful Soup is not installed.", file=sys.stderr)
+        return 1
+
+    weblogin = weblogin_duo_page()
+    prompt = duo_prompt_page()
+    assert find_script(weblogin, JS_REGEX) == _bs4_find_script(weblogin)
+    assert parse_duo_prompt(prompt) == _parse_duo_prompt_bs4(prompt)
+
+    cases = [
+        ("weblogin script", lambda: find_script(weblogin, JS_REGEX),
+         lambda: _bs4_find_script(weblogin)),
+        ("duo prompt", lambda: parse_duo_prompt(prompt),
+         lambda: _parse_duo_prompt_bs4(prompt)),
+    ]
+    print(f"{'page':<16} {'extractor':>12} {'bs4':>12} {'speedup':>8}")
+    for name, fast, slow in cases:
+        number = 50
+        fast_time = min(timeit.repeat(fast, number=number, repeat=5)) / number
+        slow_time = min(timeit.repeat(slow, number=number, repeat=5)) / number
+        print(f"{name:<16} {fast_time * 1e3:>10.3f}ms "
+              f"{slow_time * 1e3:>10.3f}ms {slow_time / fast_time:>7.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Measure end-to-end login latency against the local mock server.
+
+Each request to the mock server is delayed to simulate network latency, and
+the simulated user answers Duo pushes immediately, so the numbers show the
+overhead of the login flow itself. The user takes typing_time to enter
+their credentials, which pipelined logins overlap with loading the weblogin
+page and connecting to Duo. The last case answers Duo with a passcode from
+a local HOTP token instead of a push.
+
+Run from the repository root with: python -m benchmarks.bench_login
+"""
+
+import os
+import sys
+import tempfile
+
+import requests
+
+from src.hotp import HOTPToken, decode_secret
+from src.library import ShibbolethSession
+
+from .mock_server import MockShibboleth, ScriptedHandler
+from .timing import report, timer
+
+
+def _login_times(mock, directory, logins, typing_time, **session_options):
+    samples = []
+    phases = {}
+    for i in range(logins):
+        cookie_file = os.path.join(directory, f"login-{i}.tmp")
+        session = ShibbolethSession(
+            cookie_file, weblogin_host=mock.url, **session_options
+        )
+        request = requests.Request("GET", session.weblogin_url())
+        with timer(samples):
+            session.perform(request, ScriptedHandler(typing_time=typing_time))
+        for phase, seconds in session.two_factor_timings().items():
+            if phase != "status_polls":
+                phases.setdefault(phase, []).append(seconds)
+        mock.expire_sessions()
+    return samples, phases
+
+
+HOTP_SECRET = "JBSWY3DPEHPK3PXP"
+
+
+def main(logins=20, latency=0.02, typing_time=0.1):
+    delays = {"weblogin": latency, "duo": latency}
+    with MockShibboleth(push_delay=0, delays=delays) as mock, \
+            tempfile.TemporaryDirectory() as directory:
+        token_file = os.path.join(directory, "hotp.json")
+        HOTPToken.create(token_file, HOTP_SECRET, device="phone1")
+        mock.add_hotp_token("uniqname", decode_secret(HOTP_SECRET))
+        print(f"login latency ({latency * 1e3:.0f}ms per request, "
+              f"{typing_time * 1e3:.0f}ms to enter credentials)")
+        for name, options in [
+            ("sequential", {"pipelined": False}),
+            ("pipelined", {"pipelined": True, "duo_host": mock.duo_host}),
+            ("HOTP passcode", {"pipelined": True, "duo_host": mock.duo_host,
+                               "hotp_file": token_file}),
+        ]:
+            samples, phases = _login_times(mock, directory, logins,
+                                           typing_time, **options)
+            report(f"  {name} login", samples)
+        for phase, seconds in phases.items():
+            report(f"    2FA phase: {phase}", seconds)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
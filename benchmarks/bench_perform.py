@@ -0,0 +1,76 @@
+"""
+Measure perform() throughput against the local mock server, and repeated
+fetches of a large resource with and without a ResponseCache.
+
+Run from the repository root with: python -m benchmarks.bench_perform
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import requests
+
+from src.httpcache import ResponseCache
+from src.instrument import Recorder
+from src.library import ShibbolethSession
+
+from .mock_server import MockShibboleth, ScriptedHandler
+
+
+def main(count=200, latency=0.01, fetches=50, body_size=1 << 20):
+    with MockShibboleth(push_delay=0, delays={"sp": latency}) as mock, \
+            tempfile.TemporaryDirectory() as directory:
+        session = ShibbolethSession(
+            os.path.join(directory, "cookies.tmp"), weblogin_host=mock.url
+        )
+        handler = ScriptedHandler()
+        session.perform(requests.Request("GET", f"{mock.url}/sp/"), handler)
+
+        print(f"perform throughput ({latency * 1e3:.0f}ms per request)")
+        requests_to_send = [
+            requests.Request("GET", f"{mock.url}/sp/{i}")
+            for i in range(count)
+        ]
+        start = time.perf_counter()
+        for request in requests_to_send:
+            session.perform(request, handler)
+        elapsed = time.perf_counter() - start
+        print(f"  {'perform':<28} {count / elapsed:>8.1f} requests/s")
+        for workers in (1, 4, 16):
+            start = time.perf_counter()
+            session.perform_many(requests_to_send, handler, workers)
+            elapsed = time.perf_counter() - start
+            print(f"  {f'perform_many ({workers} workers)':<28} "
+                  f"{count / elapsed:>8.1f} requests/s")
+
+    print(f"repeated fetches ({body_size >> 10} KiB body)")
+    with MockShibboleth(push_delay=0, sp_body_size=body_size) as mock, \
+            tempfile.TemporaryDirectory() as directory:
+        handler = ScriptedHandler()
+        cache = ResponseCache(os.path.join(directory, "cache"))
+        for name, response_cache in (("uncached", None),
+                                     ("revalidated (304)", cache)):
+            recorder = Recorder()
+            session = ShibbolethSession(
+                os.path.join(directory, "cookies.tmp"),
+                weblogin_host=mock.url, response_cache=response_cache,
+                instrumentation=recorder
+            )
+            request = requests.Request("GET", f"{mock.url}/sp/file")
+            session.perform(request, handler)
+            received = recorder.stats()["counters"]["http.bytes_received"]
+            start = time.perf_counter()
+            for _ in range(fetches):
+                session.perform(request, handler)
+            elapsed = time.perf_counter() - start
+            received = (recorder.stats()["counters"]["http.bytes_received"] -
+                        received)
+            print(f"  {name:<28} {elapsed / fetches * 1e3:>8.2f} ms/fetch "
+                  f"{received / fetches / 1024:>10.1f} KiB/fetch")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Measure how long ./login takes when the cookies were verified recently.
+
+Runs ./login against a temporary cookie file whose validity record is
+fresh, so no network requests are made, and reports the wall-clock time of
+each run together with the imports reported by python -X importtime.
+
+Run from the repository root with: python -m benchmarks.bench_startup
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from src.validity import ValidityCache
+
+LOGIN = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "login")
+
+
+def _import_times(cookie_file):
+    """Return (cumulative microseconds, module) for each import."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", LOGIN, cookie_file],
+        capture_output=True, text=True, check=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        # Nested imports are indented further than the single leading space.
+        times.append((int(cumulative), module.rstrip()[1:]))
+    return times
+
+
+def main(runs=20):
+    with tempfile.TemporaryDirectory() as directory:
+        cookie_file = os.path.join(directory, "cookies.tmp")
+        with open(cookie_file, "w") as f:
+            f.write("# Netscape HTTP Cookie File\n")
+        ValidityCache(cookie_file).record()
+
+        wall_times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, LOGIN, cookie_file], check=True)
+            wall_times.append(time.perf_counter() - start)
+        baseline = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", "pass"], check=True)
+            baseline.append(time.perf_counter() - start)
+
+        imports = _import_times(cookie_file)
+
+    top_level = [(t, m) for t, m in imports if not m.startswith(" ")]
+    print(f"./login (cookies still valid): "
+          f"{statistics.median(wall_times) * 1e3:.1f}ms median over "
+          f"{runs} runs")
+    print(f"python -c pass:                "
+          f"{statistics.median(baseline) * 1e3:.1f}ms median over "
+          f"{runs} runs")
+    requests_imported = any(m.strip() == "requests" for _, m in imports)
+    print(f"modules imported: {len(imports)}; "
+          f"requests imported: {requests_imported}")
+    print("slowest top-level imports:")
+    for cumulative, module in sorted(top_level, reverse=True)[:10]:
+        print(f"  {cumulative / 1e3:>8.2f}ms  {module.strip()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
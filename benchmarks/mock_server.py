@@ -0,0 +1,515 @@
+"""
+A local stand-in for weblogin, Duo and a Shibboleth-protected service.
+
+One HTTP server plays every part, on 127.0.0.1:
+
+    GET  /                         weblogin; redirects to /services/ when the
+                                   weblogin session cookie is valid
+    POST /                         checks the uniqname and password (returning
+                                   the duo_config script), or the Duo response
+                                   (setting the weblogin session cookie)
+    POST /frame/web/v1/auth        redirects to /frame/prompt?sid=...
+    GET  /frame/prompt             the device and factor choices
+    POST /frame/prompt             starts a push, call, SMS or passcode check
+                                   (passcodes may come from HOTP tokens)
+    POST /frame/status             "pushed" until the simulated user answers
+    POST /frame/status/<txid>      the signed Duo response cookie
+    GET  /sp/...                   a protected resource; redirects through
+                                   /idp/sso (and to weblogin, when logged out)
+                                   like a Shibboleth service provider, and
+                                   answers If-None-Match with a 304
+
+Latency can be added to each part, failures can be injected and the push
+answer time is configurable. Run it on its own with:
+
+    python -m benchmarks.mock_server --port 8000
+
+and point the library at it with --weblogin-host http://127.0.0.1:8000.
+"""
+
+import argparse
+import json
+import secrets
+import sys
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+from src.hotp import hotp
+
+from .pages import DEVICES, duo_prompt_page, weblogin_duo_page
+
+# How many passcodes ahead of the last one used an HOTP token may be, like
+#  Duo's look-ahead window.
+HOTP_WINDOW = 10
+
+WEBLOGIN_COOKIE = "cosign"
+SP_COOKIE = "_shibsession"
+SP_ETAG = "\"sp-body\""
+
+
+class MockShibboleth:
+    def __init__(self, users=None, port=0, push_delay=0.5, deny_push=False,
+                 long_poll=False, session_lifetime=3600, sp_body_size=1024,
+                 sp_cache_control="private, no-cache", delays=None):
+        """
+        Create a mock server for users (a dict of uniqname to password).
+
+        Pushes and calls are approved (or denied, if deny_push) push_delay
+        seconds after they are sent. With long_poll, status requests are held
+        open until then instead of returning "pushed". Weblogin sessions last
+        session_lifetime seconds. Protected resources are sent with
+        sp_cache_control as their Cache-Control header. delays maps
+        "weblogin", "duo" and "sp" to the seconds of latency added to each
+        request of that kind.
+        """
+        self.users = users or {"uniqname": "password"}
+        self.push_delay = push_delay
+        self.deny_push = deny_push
+        self.long_poll = long_poll
+        self.session_lifetime = session_lifetime
+        # Not a repeated byte, so that misplaced ranges are noticed.
+        self.sp_body = (bytes(range(256)) * (sp_body_size // 256 + 1))[
+            :sp_body_size
+        ]
+        self.sp_cache_control = sp_cache_control
+        self.delays = delays or {}
+        # Valid Duo passcodes, per uniqname.
+        self.passcodes = {}
+        # HOTP tokens whose passcodes are valid, per uniqname (see
+        #  add_hotp_token).
+        self._hotp_tokens = {}
+        # Requests received, by kind ("weblogin", "duo" or "sp"), and the
+        #  304s sent for protected resources ("sp_not_modified").
+        self.counts = {}
+
+        self._port = port
+        self._server = None
+        self._lock = threading.Lock()
+        self._failures = []
+        self._cuts = []
+        self._duo_sessions = {}
+        self._transactions = {}
+        self._duo_cookies = {}
+        self._weblogin_sessions = {}
+        self._sp_sessions = {}
+
+    @property
+    def url(self):
+        """The weblogin host to pass to ShibbolethSession."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def duo_host(self):
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        """Start serving in a background thread."""
+        self._server = ThreadingHTTPServer(("127.0.0.1", self._port),
+                                           _MockHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def fail(self, path_prefix, status=503, count=1):
+        """Answer the next count requests under path_prefix with status."""
+        with self._lock:
+            self._failures.append([path_prefix, status, count])
+
+    def cut(self, path_prefix, after, count=1):
+        """
+        Drop the connection of the next count service provider responses
+        under path_prefix after sending after bytes of their body.
+        """
+        with self._lock:
+            self._cuts.append([path_prefix, after, count])
+
+    def add_hotp_token(self, uniqname, key, counter=0):
+        """Accept passcodes from an HOTP token with key for uniqname."""
+        with self._lock:
+            self._hotp_tokens[uniqname] = [key, counter]
+
+    def expire_sessions(self):
+        """End every weblogin and service provider session."""
+        with self._lock:
+            self._weblogin_sessions.clear()
+            self._sp_sessions.clear()
+
+    def _take_failure(self, path):
+        with self._lock:
+            for failure in self._failures:
+                if path.startswith(failure[0]) and failure[2] > 0:
+                    failure[2] -= 1
+                    return failure[1]
+        return None
+
+    def _take_cut(self, path):
+        with self._lock:
+            for cut in self._cuts:
+                if path.startswith(cut[0]) and cut[2] > 0:
+                    cut[2] -= 1
+                    return cut[1]
+        return None
+
+    def _count(self, kind):
+        with self._lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+        delay = self.delays.get(kind)
+        if delay:
+            time.sleep(delay)
+
+    def _valid(self, sessions, token):
+        with self._lock:
+            expires = sessions.get(token)
+        return expires is not None and time.time() < expires
+
+    def _new_token(self, sessions=None, lifetime=None):
+        token = secrets.token_hex(16)
+        if sessions is not None:
+            with self._lock:
+                sessions[token] = time.time() + lifetime
+        return token
+
+    def _check_passcode(self, uniqname, passcode):
+        """Return whether passcode is valid, using it up if from a token."""
+        if passcode in self.passcodes.get(uniqname, set()):
+            return True
+        with self._lock:
+            token = self._hotp_tokens.get(uniqname)
+            if token is None or passcode is None:
+                return False
+            key, counter = token
+            for ahead in range(HOTP_WINDOW):
+                if hotp(key, counter + ahead, len(passcode)) == passcode:
+                    token[1] = counter + ahead + 1
+                    return True
+        return False
+
+    def _status(self, txid):
+        with self._lock:
+            transaction = self._transactions.get(txid)
+        if transaction is None:
+            return "deny"
+        if transaction["factor"] == "Passcode":
+            return "allow" if transaction["passcode_valid"] else "deny"
+        remaining = transaction["answered"] - time.time()
+        if remaining > 0 and self.long_poll:
+            time.sleep(remaining)
+            remaining = 0
+        if remaining > 0:
+            return "pushed"
+        return "deny" if self.deny_push else "allow"
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send each response in one write, so that delayed ACKs on the client do
+    #  not add latency to every request.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_HEAD(self):
+        self._dispatch("HEAD")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        self.form = {
+            key: values[0]
+            for key, values in parse_qs(body.decode()).items()
+        }
+        self.query = {
+            key: values[0] for key, values in parse_qs(url.query).items()
+        }
+        cookies = SimpleCookie(self.headers.get("Cookie", ""))
+        self.cookies = {key: morsel.value for key, morsel in cookies.items()}
+
+        if url.path.startswith("/frame/"):
+            kind = "duo"
+        elif url.path.startswith(("/sp/", "/idp/")):
+            kind = "sp"
+        else:
+            kind = "weblogin"
+        self.mock._count(kind)
+
+        status = self.mock._take_failure(url.path)
+        if status is not None:
+            self._send(status, b"Injected failure")
+            return
+
+        if method == "HEAD":
+            self._send(200, b"")
+        elif url.path == "/" and method == "GET":
+            self._weblogin_get()
+        elif url.path == "/" and method == "POST":
+            self._weblogin_post()
+        elif url.path == "/services/":
+            self._send(200, b"Logged in to weblogin.")
+        elif url.path == "/frame/web/v1/auth" and method == "POST":
+            self._duo_auth()
+        elif url.path == "/frame/prompt" and method == "GET":
+            self._send(200, duo_prompt_page().encode(), "text/html")
+        elif url.path == "/frame/prompt" and method == "POST":
+            self._duo_prompt()
+        elif url.path == "/frame/status" and method == "POST":
+            self._json({"stat": "OK", "response": {
+                "status_code": self.mock._status(self.form.get("txid")),
+            }})
+        elif url.path.startswith("/frame/status/") and method == "POST":
+            self._duo_cookie(url.path[len("/frame/status/"):])
+        elif url.path == "/idp/sso":
+            self._idp_sso()
+        elif url.path.startswith("/sp/"):
+            self._service_provider(method)
+        else:
+            self._send(404, b"Not found")
+
+    def _logged_in(self):
+        return self.mock._valid(self.mock._weblogin_sessions,
+                                self.cookies.get(WEBLOGIN_COOKIE))
+
+    def _weblogin_get(self):
+        if self._logged_in():
+            self._redirect("/services/")
+        else:
+            self._send(200, b"<html><form method=post></form></html>",
+                       "text/html")
+
+    def _weblogin_post(self):
+        duo_response = self.form.get("duo_response")
+        if duo_response is not None:
+            token = duo_response.split(":APP")[0]
+            with self.mock._lock:
+                uniqname = self.mock._duo_cookies.pop(token, None)
+            if uniqname is None:
+                page = weblogin_duo_page(error="Duo authentication failed.")
+                self._send(200, page.encode(), "text/html")
+                return
+            session = self.mock._new_token(self.mock._weblogin_sessions,
+                                           self.mock.session_lifetime)
+            self._redirect(
+                "/services/",
+                cookie=f"{WEBLOGIN_COOKIE}={session}; Path=/"
+            )
+            return
+
+        if self._logged_in():
+            self._redirect("/services/")
+            return
+        uniqname = self.form.get("login")
+        if self.mock.users.get(uniqname) != self.form.get("password"):
+            page = weblogin_duo_page(error="Password is incorrect.")
+            self._send(200, page.encode(), "text/html")
+            return
+        sig_request = (f"TX|{uniqname}|{secrets.token_hex(8)}"
+                       f":APP|{uniqname}|{secrets.token_hex(8)}")
+        page = weblogin_duo_page(duo_host=self.mock.duo_host,
+                                 sig_request=sig_request)
+        self._send(200, page.encode(), "text/html")
+
+    def _duo_auth(self):
+        uniqname = self.query.get("tx", "").split("|")[1:2]
+        if not uniqname:
+            self._send(400, b"Missing tx")
+            return
+        sid = self.mock._new_token()
+        with self.mock._lock:
+            self.mock._duo_sessions[sid] = uniqname[0]
+        self._redirect(f"/frame/prompt?sid={quote(sid)}")
+
+    def _duo_prompt(self):
+        with self.mock._lock:
+            uniqname = self.mock._duo_sessions.get(self.form.get("sid"))
+        if uniqname is None:
+            self._json({"stat": "FAIL", "message": "Unknown session."})
+            return
+        if self.form.get("device") not in dict(DEVICES):
+            self._json({"stat": "FAIL", "message": "Unknown device."})
+            return
+        txid = self.mock._new_token()
+        passcode_valid = (
+            self.form.get("factor") == "Passcode" and
+            self.mock._check_passcode(uniqname, self.form.get("passcode"))
+        )
+        with self.mock._lock:
+            self.mock._transactions[txid] = {
+                "uniqname": uniqname,
+                "factor": self.form.get("factor"),
+                "passcode_valid": passcode_valid,
+                "answered": time.time() + self.mock.push_delay,
+            }
+        self._json({"stat": "OK", "response": {"txid": txid}})
+
+    def _duo_cookie(self, txid):
+        with self.mock._lock:
+            transaction = self.mock._transactions.pop(txid, None)
+        if transaction is None:
+            self._json({"stat": "FAIL", "message": "Unknown transaction."})
+            return
+        token = f"AUTH|{transaction['uniqname']}|{self.mock._new_token()}"
+        with self.mock._lock:
+            self.mock._duo_cookies[token] = transaction["uniqname"]
+        self._json({"stat": "OK", "response": {"cookie": token}})
+
+    def _idp_sso(self):
+        target = self.query.get("target", "/sp/")
+        if not self._logged_in():
+            self._redirect("/")
+            return
+        session = self.mock._new_token(self.mock._sp_sessions,
+                                       self.mock.session_lifetime)
+        self._redirect(target, cookie=f"{SP_COOKIE}={session}; Path=/sp/")
+
+    def _service_provider(self, method):
+        if not self.mock._valid(self.mock._sp_sessions,
+                                self.cookies.get(SP_COOKIE)):
+            self._redirect(f"/idp/sso?target={quote(self.path)}")
+            return
+        body = self.mock.sp_body
+        status = 200
+        headers = {"ETag": SP_ETAG, "Accept-Ranges": "bytes"}
+        if self.mock.sp_cache_control:
+            headers["Cache-Control"] = self.mock.sp_cache_control
+        if self.headers.get("If-None-Match") == SP_ETAG:
+            self.mock._count("sp_not_modified")
+            self._send(304, b"", headers=headers)
+            return
+        ranges = self.headers.get("Range", "")
+        if (ranges.startswith("bytes=") and
+                self.headers.get("If-Range", SP_ETAG) == SP_ETAG):
+            start = int(ranges[len("bytes="):].split("-")[0])
+            if start >= len(body):
+                self._send(416, b"", headers={
+                    "Content-Range": f"bytes */{len(body)}",
+                })
+                return
+            status = 206
+            headers["Content-Range"] = (
+                f"bytes {start}-{len(body) - 1}/{len(body)}"
+            )
+            body = body[start:]
+        cut = self.mock._take_cut(urlparse(self.path).path)
+        if cut is None or method == "HEAD":
+            self._send(status, body, "application/octet-stream", headers)
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body[:cut])
+        self.wfile.flush()
+        self.close_connection = True
+
+    def _redirect(self, location, cookie=None):
+        self.send_response(302)
+        self.send_header("Location", location)
+        if cookie is not None:
+            self.send_header("Set-Cookie", cookie)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _json(self, value):
+        self._send(200, json.dumps(value).encode(), "application/json")
+
+    def _send(self, status, body, content_type="text/plain", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+class ScriptedHandler:
+    """
+    A login handler that answers without user interaction.
+
+    typing_time is how many seconds it takes to give its credentials, to
+    simulate a user entering them.
+    """
+
+    def __init__(self, uniqname="uniqname", password="password",
+                 factor="Duo Push", passcode=None, typing_time=0.0):
+        self.credentials = {"uniqname": uniqname, "password": password}
+        self.factor = factor
+        self.passcode = passcode
+        self.typing_time = typing_time
+
+    def get_credentials(self):
+        if self.typing_time:
+            time.sleep(self.typing_time)
+        return self.credentials
+
+    def show_credentials_error(self, error):
+        raise error
+
+    def on_two_factor_start(self, credentials):
+        pass
+
+    def on_two_factor_fail(self):
+        raise RuntimeError("Two-factor authentication failed.")
+
+    def choose_duo(self, duo_choices):
+        choice = next(c for c in duo_choices if c["factor"] == self.factor)
+        return {"choice": choice, "passcode": self.passcode}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a local mock weblogin/Duo server."
+    )
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--push-delay", type=float, default=2.0)
+    parser.add_argument("--user", default="uniqname:password",
+                        metavar="UNIQNAME:PASSWORD")
+    args = parser.parse_args()
+    uniqname, password = args.user.split(":", 1)
+    mock = MockShibboleth(
+        users={uniqname: password},
+        port=args.port,
+        push_delay=args.push_delay,
+    ).start()
+    print(f"Mock weblogin listening on {mock.url}", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        mock.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Synthetic weblogin and Duo pages shaped like the real ones."""
+
+DUO_HOST = "api-00000000.duosecurity.com"
+
+SIG_REQUEST = (
+    "TX|dW5pcW5hbWV8REkwMDAwMDAwMDAwMDAwMDAwMDAwfDE2MDAwMDAwMDA=|"
+    "0000000000000000000000000000000000000000"
+    ":APP|dW5pcW5hbWV8REkwMDAwMDAwMDAwMDAwMDAwMDAwfDE2MDAwMDAwMDA=|"
+    "1111111111111111111111111111111111111111"
+)
+
+DEVICES = (
+    ("phone1", "Android (XXX-XXX-1234)"),
+    ("phone2", "iOS (XXX-XXX-5678)"),
+)
+
+# Padding that stands in for the navigation, help text and styles that make
+#  up most of the real pages.
+_FILLER = "\n".join(
+    f'<div class="row"><p class="help-{i}">Need help signing in? '
+    f'<a href="/help/{i}">Read the guide</a> or contact the '
+    f'<span>ITS Service Center</span>.</p></div>'
+    for i in range(200)
+)
+
+
+def weblogin_duo_page(error="Additional authentication is required.",
+                      duo_host=DUO_HOST, sig_request=SIG_REQUEST):
+    """Return the weblogin response to a correct uniqname and password."""
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+<title>U-M Weblogin</title>
+<script src="/js/jquery.min.js"></script>
+<script>
+  window.dataLayer = window.dataLayer || [];
+</script>
+</head>
+<body>
+{_FILLER}
+<form id="duo_form" method="post" action="/">
+<input type="hidden" name="ref" value="">
+</form>
+<iframe id="duo_iframe" title="Two-Factor Authentication"></iframe>
+<script type="text/javascript">
+  var error = "{error}";
+  var duo_config = {{
+      'host': '{duo_host}',
+      'sig_request': '{sig_request}',
+      'post_action': '/',
+      'post_argument': 'duo_response'
+  }};
+</script>
+</body>
+</html>
+"""
+
+
+def duo_prompt_page(devices=DEVICES):
+    """Return the Duo /frame/prompt page listing devices."""
+    options = "\n".join(
+        f'<option value="{device}">{description}</option>'
+        for device, description in devices
+    )
+    fieldsets = "\n".join(
+        f"""<fieldset data-device-index="{device}" class="hidden">
+  <h2 class="medium-or-larger auth-method-header">Choose an authentication method</h2>
+  <div class="row-label push-label">
+    <input type="hidden" name="factor" value="Duo Push">
+    <span class="label factor-label">Duo Push</span>
+  </div>
+  <div class="row-label phone-label">
+    <input type="hidden" name="factor" value="Phone Call">
+    <span class="label factor-label">Call Me</span>
+  </div>
+  <div class="row-label passcode-label">
+    <input type="hidden" name="factor" value="Passcode">
+    <input type="hidden" name="next-passcode" value="1">
+    <span class="label factor-label">Passcode</span>
+  </div>
+  <input type="hidden" name="phone-smsable" value="True">
+</fieldset>"""
+        for device, _ in devices
+    )
+    return f"""<!DOCTYPE html>
+<html>
+<head><title>Duo Security</title></head>
+<body>
+{_FILLER}
+<form action="/frame/prompt" method="post" id="login-form">
+<select name="device" class="device-selector-list">
+{options}
+</select>
+{fieldsets}
+</form>
+</body>
+</html>
+"""
@@ -0,0 +1,25 @@
+"""Helpers for reporting benchmark timings."""
+
+import statistics
+import time
+from contextlib import contextmanager
+
+
+@contextmanager
+def timer(samples):
+    """Append the seconds spent in the block to samples."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        samples.append(time.perf_counter() - start)
+
+
+def report(name, samples, unit="ms"):
+    """Print the median, 90th percentile and best of samples (in seconds)."""
+    scale = {"ms": 1e3, "s": 1.0}[unit]
+    ordered = sorted(samples)
+    p90 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+    print(f"{name:<36} median {statistics.median(ordered) * scale:>9.2f}{unit}"
+          f"  p90 {p90 * scale:>9.2f}{unit}"
+          f"  best {ordered[0] * scale:>9.2f}{unit}  (n={len(ordered)})")
@@ -1,3 +1,13 @@
 from .__main__ import run as __main__
-from .cli import CLI
-from .library import ShibbolethError, ShibbolethSession
+
+
+def __getattr__(name):
+    # The library is imported on first use, so that running the command line
+    #  interface with cookies that are still valid stays fast.
+    if name == "CLI":
+        from .cli import CLI
+        return CLI
+    if name in ("ShibbolethError", "ShibbolethSession"):
+        from . import library
+        return getattr(library, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,11 +1,9 @@
 #!/usr/bin/env python3
 
 import argparse
-import requests
 import sys
 
-from .cli import CLI
-from .library import ShibbolethError
+from .validity import ValidityCache
 
 def run():
     """Authenticate via U-M Shibboleth from the command line."""
@@ -19,13 +17,226 @@ def run():
         nargs="?",
         help="a Netscape-style cookie file (e.g. one generated by cURL)"
     )
+    parser.add_argument(
+        "--duo-timeout",
+        type=float,
+        default=120.0,
+        metavar="SECONDS",
+        help="how long to wait for a Duo response (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--duo-long-poll",
+        action="store_true",
+        help="send Duo status requests back to back instead of sleeping"
+    )
+    parser.add_argument(
+        "--duo-host",
+        metavar="HOST",
+        help="Duo API host to connect to while the password is checked"
+    )
+    parser.add_argument(
+        "--no-pipeline",
+        action="store_true",
+        help="fetch Duo options only after the password has been checked"
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        type=float,
+        default=10.0,
+        metavar="SECONDS",
+        help="timeout for opening a connection (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--read-timeout",
+        type=float,
+        default=30.0,
+        metavar="SECONDS",
+        help="timeout for reading a response (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=2,
+        help="retries for failed idempotent requests (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=16,
+        help="connections to keep open per host (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--weblogin-host",
+        default="https://weblogin.umich.edu",
+        metavar="URL",
+        help="weblogin server to use, e.g. a local mock (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--agent",
+        metavar="SOCKET",
+        help=("instead of logging in, run an agent that keeps sessions warm "
+              "and serves them over the Unix domain socket SOCKET")
+    )
+    parser.add_argument(
+        "--agent-refresh",
+        type=float,
+        default=300.0,
+        metavar="SECONDS",
+        help="how often the agent checks its sessions (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--remember-duo",
+        action="store_true",
+        help="remember the Duo device and factor chosen for each uniqname "
+             "and use them for later logins without asking"
+    )
+    parser.add_argument(
+        "--hotp",
+        metavar="FILE",
+        help="answer Duo with passcodes generated from the HOTP token "
+             "stored in FILE, without asking"
+    )
+    parser.add_argument(
+        "--share-cookies",
+        action="store_true",
+        help="share the logged-in cookies with other processes using the "
+             "same cookie file through shared memory, so that only one of "
+             "them logs in"
+    )
+    parser.add_argument(
+        "--no-binary-cache",
+        action="store_true",
+        help="do not keep a binary copy of the cookie file in "
+             "<cookie file>.bin, which loads faster than the file itself"
+    )
+    parser.add_argument(
+        "--warm",
+        action="append",
+        default=[],
+        metavar="URL",
+        help="after logging in, visit URL so that the cookie file also "
+             "holds a session for that service (may be repeated)"
+    )
+    parser.add_argument(
+        "--warm-list",
+        metavar="FILE",
+        help="like --warm, for each URL listed in FILE (one per line)"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="keep the responses the agent fetches in DIR and revalidate "
+             "them instead of downloading them again"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=256,
+        metavar="MB",
+        help="how large --cache-dir may grow (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="write a JSON trace of every request and login phase to FILE "
+             "('-' for standard output)"
+    )
+    parser.add_argument(
+        "--stats",
+        metavar="FILE",
+        help="write JSON counters and per-phase totals to FILE "
+             "('-' for standard output)"
+    )
+    parser.add_argument(
+        "--validity-ttl",
+        type=float,
+        default=300.0,
+        metavar="SECONDS",
+        help=("skip checking with weblogin if the cookies were verified this "
+              "recently; 0 always checks (default: %(default)s)")
+    )
     args = parser.parse_args()
     cookie_file = args.cookie_file
+    try:
+        warm_urls = args.warm + _read_url_list(args.warm_list)
+    except OSError as err:
+        parser.error(f"cannot read --warm-list: {err}")
+
+    recorder = None
+    if args.trace is not None or args.stats is not None:
+        from .instrument import Recorder
+        recorder = Recorder()
+
+    # Most runs end here, so nothing else (requests in particular) is
+    #  imported until the cookies are known to need checking.
+    if args.agent is None and args.validity_ttl:
+        if recorder is None:
+            fresh = ValidityCache(cookie_file, args.validity_ttl).fresh()
+        else:
+            with recorder.span("validity") as span:
+                fresh = ValidityCache(cookie_file, args.validity_ttl).fresh()
+                span.set(fresh=fresh)
+        if fresh:
+            _write_recording(args, recorder)
+            return 0
+
+    import requests
+
+    from .cli import CLI
+    from .library import ShibbolethError
+    from .polling import PollSchedule
+    from .transport import Transport
+
+    poll_schedule = PollSchedule(
+        deadline=args.duo_timeout,
+        long_poll=args.duo_long_poll,
+    )
+    transport = Transport(
+        pool_maxsize=args.pool_size,
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout,
+        retries=args.retries,
+    )
+
+    session_options = {
+        "instrumentation": recorder,
+        "poll_schedule": poll_schedule,
+        "transport": transport,
+        "pipelined": not args.no_pipeline,
+        "duo_host": args.duo_host,
+        "weblogin_host": args.weblogin_host,
+        "remember_duo": args.remember_duo,
+        "share_cookies": args.share_cookies,
+        "binary_cache": not args.no_binary_cache,
+        "warm_urls": warm_urls,
+        "hotp_file": args.hotp,
+    }
+    if args.cache_dir is not None:
+        from .httpcache import ResponseCache
+        session_options["response_cache"] = ResponseCache(
+            args.cache_dir, args.cache_size << 20
+        )
+
+    if args.agent is not None:
+        from .agent import Agent
+
+        agent = Agent(args.agent, args.agent_refresh, **session_options)
+        try:
+            agent.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            _write_recording(args, recorder)
+        return 0
 
     # Perform authentication
     try:
-        cli = CLI(cookie_file)
-        request = requests.Request("GET", "https://weblogin.umich.edu/")
+        cli = CLI(
+            cookie_file,
+            validity_ttl=args.validity_ttl or None,
+            **session_options
+        )
+        request = requests.Request("GET", cli.weblogin_url())
         result = cli.perform(request)
         return 0
     except requests.exceptions.ConnectionError as e:
@@ -42,6 +253,34 @@ def run():
         return 4
     except KeyboardInterrupt:
         return 130
+    finally:
+        _write_recording(args, recorder)
+
+def _read_url_list(path):
+    """Return the URLs listed in path, skipping blank lines and comments."""
+    if path is None:
+        return []
+    with open(path) as f:
+        return [
+            line.strip() for line in f
+            if line.strip() and not line.lstrip().startswith("#")
+        ]
+
+def _write_recording(args, recorder):
+    """Write the --trace and --stats files, if they were asked for."""
+    if recorder is None:
+        return
+    _write_json(args.trace, recorder.dump)
+    _write_json(args.stats, lambda f: recorder.dump(f, stats=True))
+
+def _write_json(path, dump):
+    if path is None:
+        return
+    if path == "-":
+        dump(sys.stdout)
+    else:
+        with open(path, "w") as f:
+            dump(f)
 
 if __name__ == "__main__":
     sys.exit(run())
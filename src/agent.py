@@ -0,0 +1,308 @@
+"""
+A long-running agent that keeps Shibboleth sessions warm.
+
+The agent listens on a Unix domain socket and speaks HTTP over it, so it can
+be used from curl (with --unix-socket) as well as through AgentClient:
+
+    GET  /cookies?file=PATH   the cookies of the session for the cookie file
+                              PATH, in the Netscape cookie file format
+    POST /perform?file=PATH   perform a request with that session (see
+                              AgentClient.perform for the JSON format)
+    GET  /status              the state of every session, as JSON
+
+Sessions are created on first use from their cookie file and are checked
+against weblogin every refresh_interval seconds, which keeps them from
+expiring while idle. The agent cannot log in interactively, so a session
+that has expired anyway must be renewed by running ./login against the same
+cookie file; the agent picks up the new cookies on its next refresh.
+"""
+
+import base64
+import http.client
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import requests
+
+from .library import ShibbolethError, ShibbolethSession
+
+logger = logging.getLogger(__name__)
+
+
+class Agent:
+    def __init__(self, socket_path, refresh_interval=300.0,
+                 **session_options):
+        """
+        Create an agent that will listen on socket_path.
+
+        session_options are passed to every ShibbolethSession it creates.
+        """
+        self._socket_path = socket_path
+        self._refresh_interval = refresh_interval
+        self._session_options = session_options
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        self._server = None
+        self._stopped = threading.Event()
+
+    def session(self, cookie_file):
+        """Return the session for cookie_file, creating it if needed."""
+        key = os.path.realpath(cookie_file)
+        with self._sessions_lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                entry = _AgentSession(
+                    ShibbolethSession(key, **self._session_options)
+                )
+                self._sessions[key] = entry
+            return entry.session
+
+    def status(self):
+        """Return the state of every session, keyed by cookie file."""
+        with self._sessions_lock:
+            entries = dict(self._sessions)
+        return {
+            cookie_file: {
+                "authenticated": entry.authenticated,
+                "last_refresh": entry.last_refresh,
+            }
+            for cookie_file, entry in entries.items()
+        }
+
+    def refresh(self):
+        """Check every session against weblogin and save its cookies."""
+        with self._sessions_lock:
+            entries = list(self._sessions.items())
+        for cookie_file, entry in entries:
+            try:
+                session = entry.session
+                entry.authenticated = session.check_already_authenticated()
+                if not entry.authenticated:
+                    # The cookie file may have been renewed by ./login since
+                    #  the session was created.
+                    session = ShibbolethSession(
+                        cookie_file, **self._session_options
+                    )
+                    if session.check_already_authenticated():
+                        entry.session = session
+                        entry.authenticated = True
+                entry.session.save_cookies()
+                entry.last_refresh = time.time()
+            except (requests.exceptions.RequestException, OSError):
+                entry.authenticated = False
+            except Exception:
+                # One broken session must not stop the others, or later
+                #  refreshes, from running.
+                logger.exception("Refreshing %s failed.", cookie_file)
+                entry.authenticated = False
+
+    def serve_forever(self):
+        """Serve requests until shutdown() is called."""
+        if os.path.exists(self._socket_path):
+            os.remove(self._socket_path)
+        # The socket hands out authentication cookies, so only the owner may
+        #  connect to it. It is created that way, since changing it after
+        #  binding would leave a window in which anyone could connect.
+        umask = os.umask(0o077)
+        try:
+            self._server = _AgentServer(self._socket_path,
+                                        _AgentRequestHandler)
+        finally:
+            os.umask(umask)
+        self._server.agent = self
+
+        refresher = threading.Thread(target=self._refresh_loop, daemon=True)
+        refresher.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._stopped.set()
+            self._server.server_close()
+            try:
+                os.remove(self._socket_path)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        """Stop serving requests. Safe to call from any thread."""
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+
+    def _refresh_loop(self):
+        while not self._stopped.wait(self._refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Refreshing sessions failed.")
+
+
+class _AgentSession:
+    def __init__(self, session):
+        self.session = session
+        self.authenticated = None
+        self.last_refresh = None
+
+
+class _AgentHandler:
+    """A login handler for sessions that cannot log in interactively."""
+
+    def get_credentials(self):
+        raise ShibbolethError(
+            "The session is not logged in. Run ./login with its cookie file."
+        )
+
+
+class _AgentServer(socketserver.ThreadingMixIn,
+                   socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _AgentRequestHandler(BaseHTTPRequestHandler):
+    def address_string(self):
+        # Unix domain socket clients have no address.
+        return "local"
+
+    def log_message(self, format, *args):
+        # Not to stderr, which the agent's users see.
+        logger.debug("%s - " + format, self.address_string(), *args)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/status":
+            self._send_json(200, self.server.agent.status())
+        elif url.path == "/cookies":
+            session = self._session(url)
+            if session is not None:
+                self._send(200, "text/plain",
+                           session.dump_cookies().encode())
+        else:
+            self._send_json(404, {"error": "Not found."})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/perform":
+            self._send_json(404, {"error": "Not found."})
+            return
+        session = self._session(url)
+        if session is None:
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length))
+            request = requests.Request(
+                body["method"],
+                body["url"],
+                headers=body.get("headers"),
+                data=base64.b64decode(body.get("body", "")),
+            )
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {"error": "Invalid perform request."})
+            return
+
+        try:
+            response = session.perform(request, _AgentHandler())
+        except ShibbolethError as err:
+            self._send_json(401, {"error": str(err)})
+            return
+        except requests.exceptions.RequestException as err:
+            self._send_json(502, {"error": str(err)})
+            return
+        self._send_json(200, {
+            "status": response.status_code,
+            "url": response.url,
+            "headers": dict(response.headers),
+            "body": base64.b64encode(response.content).decode(),
+        })
+
+    def _session(self, url):
+        files = parse_qs(url.query).get("file")
+        if not files:
+            self._send_json(400, {"error": "Missing cookie file."})
+            return None
+        return self.server.agent.session(files[0])
+
+    def _send_json(self, status, value):
+        self._send(status, "application/json", json.dumps(value).encode())
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self._socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self._socket_path)
+
+
+class AgentClient:
+    """Talks to an Agent over its Unix domain socket."""
+
+    def __init__(self, socket_path, timeout=None):
+        self._socket_path = socket_path
+        self._timeout = timeout
+
+    def cookies(self, cookie_file):
+        """Return the agent's cookies for cookie_file, in Netscape format."""
+        query = urlencode({"file": os.path.realpath(cookie_file)})
+        return self._request("GET", f"/cookies?{query}").decode()
+
+    def perform(self, cookie_file, method, url, headers=None, body=b""):
+        """
+        Perform a request using the agent's session for cookie_file.
+
+        Returns a dict with the "status", final "url", "headers" and "body"
+        (as bytes) of the response.
+        """
+        query = urlencode({"file": os.path.realpath(cookie_file)})
+        request_body = json.dumps({
+            "method": method,
+            "url": url,
+            "headers": headers or {},
+            "body": base64.b64encode(body).decode(),
+        }).encode()
+        result = json.loads(
+            self._request("POST", f"/perform?{query}", request_body)
+        )
+        result["body"] = base64.b64decode(result["body"])
+        return result
+
+    def status(self):
+        """Return the state of every session held by the agent."""
+        return json.loads(self._request("GET", "/status"))
+
+    def _request(self, method, path, body=None):
+        connection = _UnixHTTPConnection(self._socket_path, self._timeout)
+        try:
+            headers = {}
+            if body is not None:
+                headers["Content-Type"] = "application/json"
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        finally:
+            connection.close()
+        if response.status != 200:
+            try:
+                message = json.loads(data)["error"]
+            except (ValueError, KeyError, TypeError):
+                message = f"Agent returned HTTP {response.status}."
+            raise ShibbolethError(message)
+        return data
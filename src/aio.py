@@ -0,0 +1,495 @@
+"""
+An asyncio counterpart of ShibbolethSession, built on httpx.
+
+AsyncShibbolethSession follows the same login steps as ShibbolethSession
+and shares its parsing, Duo and cookie jar code; only the I/O differs.
+Waiting for Duo does not block the event loop, and concurrent perform()
+calls that are bounced to weblogin share a single login, so many protected
+fetches can run on one loop.
+
+httpx is an optional dependency, only needed to use this module.
+"""
+
+import asyncio
+import inspect
+from http.cookiejar import CookieJar
+from time import monotonic
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from .library import ShibbolethError, _SessionBase
+from .transport import Transport
+
+
+class AsyncShibbolethSession(_SessionBase):
+    def __init__(self, cookie_file_name, poll_schedule=None, transport=None,
+                 validity_ttl=None, pipelined=True, duo_host=None,
+                 weblogin_host="https://weblogin.umich.edu",
+                 instrumentation=None, binary_cache=True):
+        """
+        Create an asyncio authentication session using the given cookie file.
+
+        The options are the same as for ShibbolethSession. Sessions created
+        with the same Transport share its connection pool.
+        """
+        if httpx is None:
+            raise ImportError(
+                "AsyncShibbolethSession requires httpx (pip3 install httpx)."
+            )
+        super().__init__(cookie_file_name, poll_schedule, validity_ttl,
+                         duo_host, weblogin_host, instrumentation,
+                         binary_cache=binary_cache)
+        self._owns_transport = transport is None
+        self._transport = transport or Transport()
+        self._client = httpx.AsyncClient(
+            transport=self._transport.async_transport(),
+            timeout=httpx.Timeout(
+                self._transport.read_timeout,
+                connect=self._transport.connect_timeout,
+            ),
+            cookies=_ResponseCookies(self._cookies),
+            headers=self._headers,
+            event_hooks={
+                "request": [self._start_request],
+                "response": [self._record_response],
+            },
+        )
+        # Adds the Cookie header of each request (see _start_request).
+        self._cookie_header = httpx.Cookies(self._cookies)
+        self._pipelined = pipelined
+        self._background = set()
+        # Created lazily, so that the session can be created outside of a
+        #  running event loop.
+        self._login_lock = None
+
+    async def aclose(self):
+        """Close the connections of the session's own transport."""
+        if self._owns_transport:
+            await self._client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def check_already_authenticated(self):
+        """Check if the user is already authenticated."""
+        if self.recently_verified():
+            return True
+        generation = self._login_generation
+        get_res = await self._client.get(self._weblogin_url)
+        if get_res.is_redirect:
+            self._authenticated = True
+            self._two_factor_authenticated = True
+            self._mark_verified()
+            return True
+        # Unless another task logged in while this was checked.
+        if generation == self._login_generation:
+            self._session_ended()
+        return False
+
+    async def ensure_authenticated(self, handler):
+        """
+        Log in using handler unless the session is already authenticated.
+
+        Returns whether a login was performed.
+        """
+        generation = self._login_generation
+        if await self.check_already_authenticated():
+            return False
+        await self._login_once(handler, generation)
+        return True
+
+    async def authenticate(self, uniqname, password):
+        """
+        Attempt to authenticate the user to Shibboleth.
+
+        Does not perform 2FA, but determines what 2FA methods are available.
+        Returns these choices, or None if authentication was not successful.
+        """
+        return await (await self._start_authenticate(uniqname, password))
+
+    async def _start_authenticate(self, uniqname, password, login_page=None):
+        """
+        Like authenticate(), but return a task for the Duo choices.
+
+        Errors from weblogin (such as a wrong password) are still raised
+        directly. login_page is a task for the weblogin page if it is
+        already being loaded (see _prefetch_login_page).
+        """
+        if login_page is None:
+            if self._pipelined and self._duo_host is not None:
+                self._spawn(self._warm_connection(self._duo_host))
+
+        with self._instrumentation.span("login.password"):
+            if login_page is None:
+                await self._client.get(self._weblogin_url)
+            else:
+                await login_page
+
+            post_res = await self._client.post(
+                self._weblogin_url,
+                data=self._password_form(uniqname, password),
+            )
+        if post_res.is_redirect:
+            self._skip_two_factor()
+            return _completed(None)
+
+        self._read_weblogin_page(post_res.text)
+
+        if self._pipelined:
+            return asyncio.ensure_future(self._fetch_duo_choices())
+        return _completed(await self._fetch_duo_choices())
+
+    def _prefetch_login_page(self):
+        """
+        Start loading the weblogin page, and opening a connection to Duo,
+        in the background. Returns a task for the page.
+        """
+        if self._duo_host is not None:
+            self._spawn(self._warm_connection(self._duo_host))
+        return asyncio.ensure_future(self._client.get(self._weblogin_url))
+
+    async def _fetch_duo_choices(self):
+        self._duo_choices = await self.get_duo_choices()
+
+        self._authenticated = True
+
+        return self._duo_choices
+
+    def _spawn(self, coroutine):
+        # The event loop only keeps weak references to tasks.
+        task = asyncio.ensure_future(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _warm_connection(self, host):
+        """Open a pooled connection to host so later requests can reuse it."""
+        try:
+            await self._client.head(f"{self._duo_scheme}://{host}/")
+        except httpx.HTTPError:
+            pass
+
+    async def get_duo_choices(self):
+        """Attempt to get possible choices for a Duo 2FA request."""
+        instrumentation = self._instrumentation
+        with instrumentation.span("duo.auth"):
+            await self._post_duo_auth()
+        prompt_url, params = self._duo_prompt_page_request()
+        with instrumentation.span("duo.prompt_page"):
+            res = await self._client.get(prompt_url, params=params)
+        return self._read_duo_prompt_page(res.text)
+
+    async def _post_duo_auth(self):
+        auth_url, post_params, post_headers, post_data = (
+            self._duo_auth_request()
+        )
+        post_res = await self._client.post(
+            auth_url,
+            params=post_params,
+            headers=post_headers,
+            data=post_data,
+        )
+        self._read_duo_auth_location(post_res.headers["Location"])
+
+    async def two_factor_authenticate(self, choice, passcode=None):
+        """
+        Attempt to perform 2FA using the given method.
+
+        Requires that the session is authenticated().
+        """
+        self._check_two_factor_ready()
+        self._poll_schedule.reset()
+
+        timings = {}
+        self._two_factor_timings = timings
+        phase_start = monotonic()
+
+        prompt_url, prompt_headers, prompt_data = self._duo_prompt_request(
+            choice, passcode
+        )
+        prompt_res = await self._client.post(
+            prompt_url,
+            headers=prompt_headers,
+            data=prompt_data,
+        )
+        self._end_phase(timings, "prompt", phase_start)
+
+        # SMS is not a real 2FA factor. The user will definitely not be
+        #  authenticated after this, since it just texts codes to their phone.
+        if choice["factor"] == "sms":
+            return False
+
+        status_url, status_headers, status_data = self._duo_status_request(
+            prompt_res.json()
+        )
+        schedule = self._poll_schedule
+        schedule.start()
+        phase_start = monotonic()
+        timings["status_polls"] = 0
+        # Duo checks a passcode as soon as it is sent, so its status can be
+        #  asked for straight away.
+        wait = passcode is None
+        while True:
+            delay = schedule.next_delay() if wait else 0.0
+            wait = True
+            if delay is not None:
+                await asyncio.sleep(delay)
+            if delay is None or schedule.cancelled() or schedule.expired():
+                self._raise_poll_stopped(timings, phase_start)
+            timeout = schedule.request_timeout(
+                self._transport.connect_timeout
+            )
+            try:
+                status_res = await self._client.post(
+                    status_url,
+                    headers=status_headers,
+                    data=status_data,
+                    timeout=(
+                        httpx.USE_CLIENT_DEFAULT if timeout is None
+                        else httpx.Timeout(timeout[1], connect=timeout[0])
+                    ),
+                )
+            except httpx.TimeoutException:
+                if not schedule.expired():
+                    raise
+                self._raise_poll_stopped(timings, phase_start)
+            status_dict = status_res.json()
+            self._count_status_poll(timings)
+            if status_dict["response"]["status_code"] == "allow":
+                break
+            elif status_dict["response"]["status_code"] == "deny":
+                self._end_phase(timings, "status", phase_start)
+                return False
+        self._end_phase(timings, "status", phase_start)
+
+        phase_start = monotonic()
+        cookie_url, cookie_headers, cookie_data = self._duo_cookie_request(
+            status_url, status_headers
+        )
+        cookie_res = await self._client.post(
+            cookie_url,
+            headers=cookie_headers,
+            data=cookie_data,
+        )
+        self._end_phase(timings, "cookie", phase_start)
+
+        phase_start = monotonic()
+        weblogin_url, weblogin_headers, weblogin_data = (
+            self._duo_weblogin_request(cookie_res.json())
+        )
+        await self._client.post(
+            weblogin_url,
+            headers=weblogin_headers,
+            data=weblogin_data,
+        )
+        self._end_phase(timings, "weblogin", phase_start)
+        self._two_factor_authenticated = True
+        return True
+
+    async def perform(self, method, url, handler, **kwargs):
+        """
+        Perform a request, using handler to get credentials if needed.
+
+        kwargs are passed to httpx.AsyncClient.build_request. A redirect to
+        weblogin is not followed: the session logs in and the request is
+        built and sent again instead, so its body must not be a one-shot
+        stream.
+        """
+        with self._instrumentation.span("perform") as span:
+            generation = self._login_generation
+            request = self._client.build_request(method, url, **kwargs)
+            response, bounced = await self._follow(request)
+            if bounced:
+                span.set(relogin=True)
+                await self._login_once(handler, generation)
+                request = self._client.build_request(method, url, **kwargs)
+                response, _ = await self._follow(request,
+                                                 stop_at_weblogin=False)
+            elif self._is_weblogin_url(str(request.url)):
+                # weblogin only redirects away from itself once logged in.
+                self._mark_verified()
+            span.set(status=response.status_code)
+            return response
+
+    async def _follow(self, request, stop_at_weblogin=True):
+        """
+        Send request and follow its redirects.
+
+        Returns the last response and whether it was bounced to weblogin.
+        With stop_at_weblogin, a redirect to weblogin is returned instead of
+        followed, so weblogin's page is never downloaded.
+        """
+        client = self._client
+        history = []
+        response = await client.send(request)
+        while response.next_request is not None:
+            next_request = response.next_request
+            if (stop_at_weblogin and
+                    self._is_weblogin_url(str(next_request.url))):
+                response.history = history
+                return response, True
+            if len(history) >= client.max_redirects:
+                raise httpx.TooManyRedirects(
+                    "Exceeded maximum allowed redirects.",
+                    request=next_request
+                )
+            history.append(response)
+            response = await client.send(next_request)
+        response.history = history
+        return response, self._is_weblogin_url(str(response.url))
+
+    async def _start_request(self, request):
+        """
+        Add the cookies for a request and note when it was sent (a request
+        hook). Redirects are sent through the hooks too.
+        """
+        self._cookie_header.set_cookie_header(request)
+        request.extensions["shibboleth.started"] = monotonic()
+
+    async def _record_response(self, response):
+        """Report an HTTP request to the instrumentation (a response hook)."""
+        request = response.request
+        started = request.extensions.get("shibboleth.started", monotonic())
+        response.stream = _CountedStream(response.stream,
+                                         self._instrumentation)
+        self._record_http(
+            request.method,
+            str(request.url),
+            response.status_code,
+            _content_length(request.headers),
+            _content_length(response.headers),
+            monotonic() - started,
+        )
+
+    async def _login_once(self, handler, generation):
+        """
+        Log in using handler unless a login finished after generation.
+        """
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        async with self._login_lock:
+            if generation != self._login_generation:
+                # Another request already logged in while this one was in
+                #  flight, so the caller only needs to retry.
+                return
+            # Only now, so that a request bounced with the old cookies
+            #  cannot end the session another task just logged in to.
+            self._session_ended()
+            self._start_login()
+            with self._instrumentation.span("login"):
+                await self.login_with_handler(handler)
+            self._end_login()
+
+    async def login_with_handler(self, handler):
+        """
+        Performs regular and two-factor authentication using handler.
+
+        The handler's methods may be coroutine functions or plain functions.
+        """
+        duo_choices = None
+        credentials = None
+        while not self.authenticated():
+            login_page = None
+            if self._pipelined:
+                # Load the page while the user enters their credentials.
+                login_page = self._prefetch_login_page()
+            try:
+                credentials = await _call(handler.get_credentials)
+            except BaseException:
+                if login_page is not None:
+                    login_page.cancel()
+                raise
+            try:
+                duo_choices = await self._start_authenticate(
+                    credentials["uniqname"],
+                    credentials["password"],
+                    login_page=login_page,
+                )
+            except ShibbolethError as err:
+                await _call(handler.show_credentials_error, err)
+                continue
+            self._principal = credentials["uniqname"]
+            # The Duo choices may still be loading in the background.
+            try:
+                await _call(handler.on_two_factor_start, credentials)
+            except BaseException:
+                duo_choices.cancel()
+                raise
+            duo_choices = await duo_choices
+
+        while not self.two_factor_authenticated():
+            duo_data = await _call(handler.choose_duo, duo_choices)
+            if not await self.two_factor_authenticate(
+                duo_data["choice"],
+                duo_data["passcode"]
+            ):
+                await _call(handler.on_two_factor_fail)
+
+
+class _ResponseCookies(CookieJar):
+    """
+    Passes the cookies httpx extracts from responses on to another jar.
+
+    It looks empty to httpx, which otherwise copies every cookie of the
+    client's jar into each request it builds. The Cookie header is added by
+    a request hook instead, from only the cookies of the request's host.
+    """
+
+    def __init__(self, jar):
+        super().__init__()
+        self._jar = jar
+
+    def extract_cookies(self, response, request):
+        self._jar.extract_cookies(response, request)
+
+    def set_cookie(self, cookie):
+        self._jar.set_cookie(cookie)
+
+    def __iter__(self):
+        return iter(())
+
+    def __len__(self):
+        return 0
+
+
+if httpx is not None:
+    class _CountedStream(httpx.AsyncByteStream):
+        """Counts the bytes of a response body as they are read."""
+
+        def __init__(self, stream, instrumentation):
+            self._stream = stream
+            self._instrumentation = instrumentation
+
+        async def __aiter__(self):
+            async for chunk in self._stream:
+                self._instrumentation.count("http.bytes_received",
+                                            len(chunk))
+                yield chunk
+
+        async def aclose(self):
+            await self._stream.aclose()
+
+
+async def _call(fn, *args):
+    result = fn(*args)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+def _completed(result):
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(result)
+    return future
+
+
+def _content_length(headers):
+    try:
+        return int(headers.get("Content-Length", 0))
+    except ValueError:
+        return 0
@@ -0,0 +1,208 @@
+"""
+Sharing a logged-in cookie jar between processes.
+
+Worker processes that each create a ShibbolethSession for the same cookie
+file would otherwise each parse the cookie file, and each log in (with its
+own Duo prompt) when the session expires. With a CookieBroker, the process
+that logs in publishes its jar once, and the others load it from shared
+memory and pick up later logins and renewals as soon as they are published.
+
+The jar is kept in <cookie file>.shm, which every process maps into memory.
+It starts with a fixed header:
+
+    magic       4 bytes   b"SHCB"
+    version     uint32
+    sequence    uint64    odd while a publish is in progress
+    generation  uint64    bumped by every publish
+    length      uint64    size of the payload
+    file stamp  3 uint64  version of the cookie file the jar matches
+
+followed by the payload: the fields of every cookie, packed with
+cookiepack.pack_entries. All integers are little endian.
+
+Publishers take a file lock, but readers never do. They read the sequence
+number before and after copying the payload, and try again if it was odd or
+changed meanwhile (a seqlock), so a publish in progress is never seen half
+written. Checking whether anything was published since a given generation
+only reads 8 bytes from the mapping, without any system call.
+
+The file stamp (see cookiepack.file_stamp) is that of the cookie file when
+the jar was published, or once the publisher has saved it. Processes that
+do not share cookies still write the cookie file, so a jar whose stamp is
+not the cookie file's current one is out of date.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+from .cookiepack import file_stamp, pack_entries, unpack_entries
+from .filelock import locked
+
+_header = struct.Struct("<4sIQQQQQQ")
+_sequence = struct.Struct("<Q")
+_sequence_offset = 8
+_generation_offset = 16
+_stamp = struct.Struct("<QQQ")
+_stamp_offset = 32
+_magic = b"SHCB"
+_version = 3
+# The magic and version, as they start the file.
+_signature = struct.pack("<4sI", _magic, _version)
+# The file is grown to at least this size, and to twice the payload size
+#  when it does not fit, so that it is rarely remapped.
+_minimum_size = 1 << 16
+# How long readers wait for a publish in progress before giving up, in case
+#  the publisher died halfway through.
+_read_attempts = 1000
+_read_retry_delay = 0.001
+
+
+class CookieBroker:
+    """
+    Publishes a cookie jar to every process using the same cookie file.
+    """
+
+    def __init__(self, cookie_file_name):
+        self._cookie_file_name = cookie_file_name
+        self._path = f"{cookie_file_name}.shm"
+        self._map = None
+        self._map_lock = threading.Lock()
+
+    def generation(self):
+        """Return the generation of the published jar, or 0 if none was."""
+        mapping = self._mapping()
+        if mapping is None or mapping[:8] != _signature:
+            return 0
+        return _sequence.unpack_from(mapping, _generation_offset)[0]
+
+    def file_stamp(self):
+        """Return the stamp of the cookie file, or zeros if it is missing."""
+        try:
+            return file_stamp(os.stat(self._cookie_file_name))
+        except OSError:
+            return (0, 0, 0)
+
+    def read(self):
+        """
+        Return the generation, the entries and the cookie file stamp of the
+        published jar.
+
+        Returns (0, None, None) if nothing was published, or if a publish
+        has been in progress for too long.
+        """
+        for _ in range(_read_attempts):
+            mapping = self._mapping()
+            if mapping is None:
+                return 0, None, None
+            magic, version, sequence, generation, length, *stamp = (
+                _header.unpack_from(mapping)
+            )
+            if magic != _magic or version != _version:
+                return 0, None, None
+            if sequence & 1:
+                time.sleep(_read_retry_delay)
+                continue
+            end = _header.size + length
+            if end > len(mapping):
+                # The file was grown by a publish since it was mapped.
+                self._mapping(end)
+                continue
+            payload = mapping[_header.size:end]
+            if _sequence.unpack_from(mapping, _sequence_offset) != (sequence,):
+                continue
+            try:
+                return generation, unpack_entries(payload), tuple(stamp)
+            except ValueError:
+                return 0, None, None
+        return 0, None, None
+
+    def publish(self, entries):
+        """
+        Publish cookie entries (see cURLCookieJar.entries), along with the
+        current stamp of the cookie file.
+
+        Returns the generation of the published jar.
+        """
+        payload = pack_entries(entries)
+        end = _header.size + len(payload)
+        with locked(self._path):
+            fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                size = os.fstat(fd).st_size
+                if size < end:
+                    os.ftruncate(fd, max(2 * end, _minimum_size))
+            finally:
+                os.close(fd)
+            mapping = self._mapping(end)
+
+            magic, version, sequence, generation, *_ = (
+                _header.unpack_from(mapping)
+            )
+            if magic != _magic or version != _version:
+                sequence = generation = 0
+            # Odd while the payload is written. A publisher that died
+            #  halfway left it odd already.
+            sequence += 1 if sequence % 2 == 0 else 2
+            generation += 1
+            _sequence.pack_into(mapping, _sequence_offset, sequence)
+            mapping[_header.size:end] = payload
+            _header.pack_into(mapping, 0, _magic, _version, sequence,
+                              generation, len(payload), *self.file_stamp())
+            _sequence.pack_into(mapping, _sequence_offset, sequence + 1)
+        return generation
+
+    def restamp(self, generation):
+        """
+        Record that the jar published as generation was just saved to the
+        cookie file, unless something else was published since.
+        """
+        with locked(self._path):
+            mapping = self._mapping()
+            if mapping is None or mapping[:8] != _signature:
+                return
+            sequence, published = struct.unpack_from("<QQ", mapping,
+                                                      _sequence_offset)
+            if published != generation or sequence & 1:
+                return
+            _sequence.pack_into(mapping, _sequence_offset, sequence + 1)
+            _stamp.pack_into(mapping, _stamp_offset, *self.file_stamp())
+            _sequence.pack_into(mapping, _sequence_offset, sequence + 2)
+
+    def login_lock(self):
+        """
+        Return a lock held while logging in with the published cookies.
+
+        Processes that find the session expired at the same time take turns,
+        so that the later ones can use the cookies the first one published
+        instead of logging in again.
+        """
+        return locked(f"{self._path}.login")
+
+    def _mapping(self, size=0):
+        """
+        Return the file mapped into memory, or None if it does not exist.
+
+        The file is mapped again if the current mapping is shorter than size.
+        """
+        mapping = self._map
+        if mapping is not None and len(mapping) >= size:
+            return mapping
+        with self._map_lock:
+            if self._map is not None and len(self._map) >= size:
+                return self._map
+            try:
+                fd = os.open(self._path, os.O_RDWR)
+            except FileNotFoundError:
+                return None
+            try:
+                if os.fstat(fd).st_size < _header.size:
+                    return None
+                # The old mapping is left for the garbage collector, since
+                #  other threads may still be reading it.
+                self._map = mmap.mmap(fd, 0)
+            finally:
+                os.close(fd)
+            return self._map
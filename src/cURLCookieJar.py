@@ -8,7 +8,8 @@ Foundation; All Rights Reserved.
 Changes made: This is the same as MozillaCookieJar, except it is modified so
 that session cookies are compatible with cURL. If PR #11799 (#11792 on GitHub)
 is ever merged to CPython, MozillaCookieJar should be used instead of this
-class.
+class. Cookies are also loaded lazily, one domain at a time (see the class
+docstring).
 
 See https://github.com/python/cpython/blob/master/LICENSE for the full CPython
 license, including but not limited to limitations of liability, agreement
@@ -28,12 +29,25 @@ cURLCookieJar
 
 __all__ = ['Cookie', 'cURLCookieJar', 'LoadError']
 
+import io
+import os
 import re
 import time
 import http.client  # only for the default HTTP port
 from calendar import timegm
+from urllib.parse import urlsplit
 
-from http.cookiejar import Cookie, FileCookieJar, LoadError
+from http.cookiejar import (Cookie, DefaultCookiePolicy, FileCookieJar,
+                            LoadError, deepvalues, domain_match,
+                            eff_request_host, request_path,
+                            _warn_unhandled_exception)
+
+from .cookiepack import file_stamp, read_cache, write_cache
+from .filelock import atomic_write, locked
+
+# How many hosts to keep the cookies of (see
+#  cURLCookieJar._cache_host_cookies).
+_host_cache_size = 1024
 
 HTTPONLY_ATTR = "HTTPOnly"
 HTTPONLY_PREFIX = "#HttpOnly_"
@@ -69,73 +83,76 @@ class cURLCookieJar(FileCookieJar):
     Note that though Mozilla and Netscape use the same format, they use
     slightly different headers.  The class saves cookies using the Netscape
     header by default (Mozilla can cope with that).
+    Loading a file only splits each line into its fields and files them by
+    domain. Cookie objects for a domain are created the first time a request
+    could use them, or a cookie is set for that domain. Domains that were
+    never used are written back to the file without being parsed further.
+    Files are saved by atomically replacing them while holding a lock, so
+    several processes can share one cookie file. save(merge=True) only
+    writes the cookies that were set or cleared since the last save, on top
+    of whatever the file contains at that point.
+    With binary_cache, a packed copy of the file is kept in <filename>.bin
+    and loaded instead of the file for as long as the file is unchanged
+    (see cookiepack).
+    The cookies a request could get are found by looking up the suffixes of
+    its host, rather than by checking every domain in the jar. With the
+    default policy, the cookies each host gets and their Cookie attributes
+    are also kept until the jar changes or one of them expires, so adding a
+    Cookie header only checks their paths, without taking the jar's lock.
     """
 
+    def __init__(self, filename=None, delayload=False, policy=None,
+                 binary_cache=False):
+        super().__init__(filename, delayload, policy)
+        # Whether to keep a binary copy of the file, <filename>.bin, that
+        #  loads without parsing (see cookiepack).
+        self.binary_cache = binary_cache
+        # Fields of cookies read from a file that have not been turned into
+        #  Cookie objects yet, by domain.
+        self._pending = {}
+        # Cookies set (or cleared, as None) since the last save, by
+        #  (domain, path, name).
+        self._changed = {}
+        # The cookies each host gets, by _host_key (see _cache_host_cookies).
+        #  Replaced by an empty dict whenever the jar changes, so that it
+        #  can be read without the lock.
+        self._host_cache = {}
+
     def _really_load(self, f, filename, ignore_discard, ignore_expires):
         now = time.time()
+        stamp = file_stamp(os.fstat(f.fileno()))
+        if self.binary_cache:
+            cached = read_cache(_cache_name(filename), stamp)
+            if cached is not None:
+                entries, earliest_expiry = cached
+                if earliest_expiry > now:
+                    # Nothing has expired, so there is nothing to check.
+                    ignore_expires = True
+                self.load_entries(_kept_entries(entries, now, ignore_discard,
+                                                ignore_expires))
+                return
+
+        entries = self._read_entries(f, filename)
+        if self.binary_cache:
+            _write_cache(filename, entries, stamp)
+        self.load_entries(_kept_entries(entries, now, ignore_discard,
+                                        ignore_expires))
 
+    def _read_entries(self, f, filename):
+        """Return the fields of every cookie in f, by domain."""
         if not NETSCAPE_MAGIC_RGX.match(f.readline()):
             raise LoadError(
                 "%r does not look like a Netscape format cookies file" %
                 filename)
 
+        entries = {}
         try:
             while 1:
                 line = f.readline()
-                rest = {}
-
                 if line == "": break
-
-                # httponly is a cookie flag as defined in rfc6265
-                # when encoded in a netscape cookie file,
-                # the line is prepended with "#HttpOnly_"
-                if line.startswith(HTTPONLY_PREFIX):
-                    rest[HTTPONLY_ATTR] = ""
-                    line = line[len(HTTPONLY_PREFIX):]
-
-                # last field may be absent, so keep any trailing tab
-                if line.endswith("\n"): line = line[:-1]
-
-                # skip comments and blank lines XXX what is $ for?
-                if (line.strip().startswith(("#", "$")) or
-                    line.strip() == ""):
-                    continue
-
-                domain, domain_specified, path, secure, expires, name, value = \
-                        line.split("\t")
-                secure = (secure == "TRUE")
-                domain_specified = (domain_specified == "TRUE")
-                if name == "":
-                    # cookies.txt regards 'Set-Cookie: foo' as a cookie
-                    # with no name, whereas http.cookiejar regards it as a
-                    # cookie with no value.
-                    name = value
-                    value = None
-
-                initial_dot = domain.startswith(".")
-                assert domain_specified == initial_dot
-
-                discard = False
-                if expires == "0" or expires == "":
-                    expires = None
-                    discard = True
-
-                # assume path_specified is false
-                c = Cookie(0, name, value,
-                           None, False,
-                           domain, domain_specified, initial_dot,
-                           path, False,
-                           secure,
-                           expires,
-                           discard,
-                           None,
-                           None,
-                           rest)
-                if not ignore_discard and c.discard:
-                    continue
-                if not ignore_expires and c.is_expired(now):
-                    continue
-                self.set_cookie(c)
+                fields = _fields_from_line(line)
+                if fields is not None:
+                    entries.setdefault(fields[0], []).append(fields)
 
         except OSError:
             raise
@@ -143,41 +160,615 @@ class cURLCookieJar(FileCookieJar):
             _warn_unhandled_exception()
             raise LoadError("invalid Netscape format cookies file %r: %r" %
                             (filename, line))
+        return entries
+
+    def _materialize(self, domain):
+        """Create the Cookie objects for a domain if it is still pending."""
+        entries = self._pending.pop(domain, None)
+        if entries is None:
+            return
+        for fields in entries:
+            FileCookieJar.set_cookie(self, _cookie_from_fields(fields))
+
+    def _materialize_all(self):
+        self._cookies_lock.acquire()
+        try:
+            for domain in list(self._pending):
+                self._materialize(domain)
+        finally:
+            self._cookies_lock.release()
+
+    def _candidate_domains(self, request):
+        """Return the domains whose cookies request could get."""
+        if type(self._policy) is not DefaultCookiePolicy:
+            # Another policy may return cookies for any domain.
+            return list(self._pending) + list(self._cookies)
+        return _domain_suffixes(*eff_request_host(request))
+
+    def _cookies_for_request(self, request):
+        cookies = []
+        for domain in self._candidate_domains(request):
+            if (domain in self._pending and
+                    self._policy.domain_return_ok(domain, request)):
+                self._materialize(domain)
+            if domain in self._cookies:
+                cookies.extend(self._cookies_for_domain(domain, request))
+        return cookies
+
+    def add_cookie_header(self, request):
+        policy = self._policy
+        key = _host_key(request)
+        if (type(policy) is not DefaultCookiePolicy or policy.rfc2965 or
+                key is None):
+            super().add_cookie_header(request)
+            return
+        host_cookies = self._host_cache.get(key)
+        if host_cookies is None or host_cookies[0] <= time.time():
+            if host_cookies is not None:
+                self.clear_expired_cookies()
+            host_cookies = self._cache_host_cookies(request, key)
+            if host_cookies is None:
+                super().add_cookie_header(request)
+                return
+        if request.has_header("Cookie"):
+            return
+        path = request_path(request)
+        attrs = [
+            attr
+            for cookie_path, attr in host_cookies[1]
+            if _path_return_ok(cookie_path, path)
+        ]
+        if attrs:
+            request.add_unredirected_header("Cookie", "; ".join(attrs))
+
+    def _cache_host_cookies(self, request, key):
+        """
+        Return the earliest expiry time and the (path, attribute) of every
+        cookie the host of request gets, most specific path first, and keep
+        them for later requests to the host.
+
+        Returns None if any of them is not a Netscape cookie, since those
+        have attributes that depend on the other cookies sent.
+        """
+        self._cookies_lock.acquire()
+        try:
+            policy = self._policy
+            policy._now = self._now = int(time.time())
+            cookies = []
+            for domain in self._candidate_domains(request):
+                if domain in self._pending:
+                    self._materialize(domain)
+                cookies_by_path = self._cookies.get(domain)
+                if (cookies_by_path is None or
+                        not policy.domain_return_ok(domain, request)):
+                    continue
+                for cookies_by_name in cookies_by_path.values():
+                    for cookie in cookies_by_name.values():
+                        if cookie.version > 0:
+                            return None
+                        if policy.return_ok(cookie, request):
+                            cookies.append(cookie)
+            cookies.sort(key=lambda cookie: len(cookie.path), reverse=True)
+            host_cookies = (
+                min((cookie.expires for cookie in cookies
+                     if cookie.expires is not None), default=float("inf")),
+                tuple(
+                    (cookie.path, self._cookie_attrs([cookie])[0])
+                    for cookie in cookies
+                ),
+            )
+            if len(self._host_cache) >= _host_cache_size:
+                self._host_cache = {}
+            self._host_cache[key] = host_cookies
+            return host_cookies
+        finally:
+            self._cookies_lock.release()
+
+    def host_cookies(self, host):
+        """Return the cookies whose domain matches host (see domain_match)."""
+        host = host.lower()
+        self._cookies_lock.acquire()
+        try:
+            cookies = []
+            for domain in _domain_suffixes(host):
+                self._materialize(domain)
+                if domain_match(host, domain):
+                    cookies.extend(deepvalues(self._cookies.get(domain, {})))
+            return cookies
+        finally:
+            self._cookies_lock.release()
+
+    def set_cookie(self, cookie):
+        self._cookies_lock.acquire()
+        try:
+            self._materialize(cookie.domain)
+            super().set_cookie(cookie)
+            self._changed[(cookie.domain, cookie.path, cookie.name)] = cookie
+            self._host_cache = {}
+        finally:
+            self._cookies_lock.release()
 
-    def save(self, filename=None, ignore_discard=False, ignore_expires=False):
+    def update(self, other):
+        """Set every cookie in other (used by requests to merge jars)."""
+        if other is self:
+            return
+        for cookie in other:
+            self.set_cookie(cookie)
+
+    def clear(self, domain=None, path=None, name=None):
+        self._cookies_lock.acquire()
+        try:
+            if domain is None:
+                self._materialize_all()
+            else:
+                self._materialize(domain)
+            if name is not None:
+                cleared = [(domain, path, name)]
+            else:
+                cleared = [
+                    (cookie.domain, cookie.path, cookie.name)
+                    for cookie in deepvalues(self._cookies)
+                    if domain is None or (cookie.domain == domain and
+                                          path in (None, cookie.path))
+                ]
+            super().clear(domain, path, name)
+            for key in cleared:
+                self._changed[key] = None
+            self._host_cache = {}
+        finally:
+            self._cookies_lock.release()
+
+    def clear_session_cookies(self):
+        self._materialize_all()
+        super().clear_session_cookies()
+
+    def clear_expired_cookies(self):
+        # Pending cookies are never sent without being materialized first, so
+        #  only the materialized ones need to be checked here. This runs after
+        #  requests that do not use the host cache, and when a cached cookie
+        #  expires, so it must not materialize everything.
+        self._cookies_lock.acquire()
+        try:
+            now = time.time()
+            for cookie in deepvalues(self._cookies):
+                if cookie.is_expired(now):
+                    self.clear(cookie.domain, cookie.path, cookie.name)
+        finally:
+            self._cookies_lock.release()
+
+    def __iter__(self):
+        self._materialize_all()
+        return super().__iter__()
+
+    def revert(self, filename=None, ignore_discard=False,
+               ignore_expires=False):
+        self._cookies_lock.acquire()
+        try:
+            old_state = (self._pending, self._changed)
+            self._pending = {}
+            self._changed = {}
+            try:
+                super().revert(filename, ignore_discard, ignore_expires)
+            except OSError:
+                self._pending, self._changed = old_state
+                raise
+        finally:
+            self._cookies_lock.release()
+
+    def save(self, filename=None, ignore_discard=False, ignore_expires=False,
+             merge=False):
         if filename is None:
             if self.filename is not None: filename = self.filename
             else: raise ValueError(MISSING_FILENAME_TEXT)
 
-        with open(filename, "w") as f:
+        self._cookies_lock.acquire()
+        try:
+            changed = self._changed
+            self._changed = {}
+            if not merge:
+                pending = list(self._pending.values())
+                cookies = list(deepvalues(self._cookies))
+        finally:
+            self._cookies_lock.release()
+
+        stamp = None
+        try:
+            with locked(filename):
+                if merge:
+                    written = self._save_merged(filename, changed,
+                                                ignore_discard,
+                                                ignore_expires,
+                                                self.binary_cache)
+                else:
+                    written = self._save_all(filename, pending, cookies,
+                                             ignore_discard, ignore_expires)
+                if self.binary_cache and written is not None:
+                    try:
+                        stamp = file_stamp(os.stat(filename))
+                    except OSError:
+                        pass
+        except BaseException:
+            # Keep the changes so that they are written by the next save.
+            self._cookies_lock.acquire()
+            try:
+                changed.update(self._changed)
+                self._changed = changed
+            finally:
+                self._cookies_lock.release()
+            raise
+        # Written from the cookies just saved rather than by reading the
+        #  file again, and after the lock is released. The stamp keeps it
+        #  from being used if the file has changed since.
+        if stamp is not None:
+            _write_cache(filename, written, stamp)
+
+    def _save_merged(self, filename, changed, ignore_discard,
+                     ignore_expires, fields=False):
+        """
+        Write changed on top of the cookies in filename. If fields, return
+        the fields of every cookie written by domain, or None if some line
+        of the file could not be read; otherwise return None.
+
+        Only lines for the domains in changed are parsed. The rest are
+        copied as they are.
+        """
+        try:
+            with open(filename) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            lines = []
+        if lines and NETSCAPE_MAGIC_RGX.match(lines[0]):
+            # Written again below.
+            del lines[0]
+
+        changed_domains = {key[0] for key in changed}
+        written = {} if fields else None
+        with atomic_write(filename) as f:
             f.write(NETSCAPE_HEADER_TEXT)
             now = time.time()
-            for cookie in self:
-                domain = cookie.domain
-                if not ignore_discard and cookie.discard:
+            for line in lines:
+                httponly = line.startswith(HTTPONLY_PREFIX)
+                if line.startswith("#") and not httponly:
                     continue
-                if not ignore_expires and cookie.is_expired(now):
+                if changed_domains:
+                    start = len(HTTPONLY_PREFIX) if httponly else 0
+                    domain = line[start:line.find("\t", start)]
+                    if (domain in changed_domains and
+                            _line_key(line) in changed):
+                        continue
+                if not line.endswith("\n"): line += "\n"
+                f.write(line)
+                if written is not None:
+                    try:
+                        line_fields = _fields_from_line(line)
+                    except (ValueError, AssertionError):
+                        written = None
+                        continue
+                    if line_fields is not None:
+                        written.setdefault(line_fields[0], []).append(
+                            line_fields
+                        )
+            for cookie in changed.values():
+                if cookie is None or not _keep_cookie(
+                        cookie, now, ignore_discard, ignore_expires):
                     continue
-                if cookie.secure: secure = "TRUE"
-                else: secure = "FALSE"
-                if domain.startswith("."): initial_dot = "TRUE"
-                else: initial_dot = "FALSE"
-                if cookie.expires is not None:
-                    expires = str(cookie.expires)
-                else:
-                    expires = "0"
-                if cookie.value is None:
-                    # cookies.txt regards 'Set-Cookie: foo' as a cookie
-                    # with no name, whereas http.cookiejar regards it as a
-                    # cookie with no value.
-                    name = ""
-                    value = cookie.name
+                cookie_fields = _fields_from_cookie(cookie)
+                f.write(_line_from_fields(cookie_fields))
+                if written is not None:
+                    written.setdefault(cookie_fields[0], []).append(
+                        cookie_fields
+                    )
+        return written
+
+    def _save_all(self, filename, pending, cookies, ignore_discard,
+                  ignore_expires):
+        with atomic_write(filename) as f:
+            return self._write_all(f, pending, cookies, ignore_discard,
+                                   ignore_expires)
+
+    def _write_all(self, f, pending, cookies, ignore_discard, ignore_expires):
+        """Write every cookie to f, and return their fields by domain."""
+        f.write(NETSCAPE_HEADER_TEXT)
+        now = time.time()
+        written = {}
+        for entries in pending:
+            for fields in entries:
+                if not _keep_fields(fields, now, ignore_discard,
+                                    ignore_expires):
+                    continue
+                f.write(_line_from_fields(fields))
+                written.setdefault(fields[0], []).append(fields)
+        for cookie in cookies:
+            if not _keep_cookie(cookie, now, ignore_discard, ignore_expires):
+                continue
+            fields = _fields_from_cookie(cookie)
+            f.write(_line_from_fields(fields))
+            written.setdefault(fields[0], []).append(fields)
+        return written
+
+    def entries(self, ignore_discard=False, ignore_expires=False):
+        """
+        Return the fields of every cookie, as lists of tuples by domain.
+
+        Each tuple holds the seven fields of the cookie's line in a cookie
+        file, and whether it is HttpOnly. Pending cookies are returned as
+        they were read, without creating Cookie objects for them. See
+        load_entries().
+        """
+        self._cookies_lock.acquire()
+        try:
+            pending = dict(self._pending)
+            cookies = list(deepvalues(self._cookies))
+        finally:
+            self._cookies_lock.release()
+        now = time.time()
+        entries = _kept_entries(pending, now, ignore_discard, ignore_expires)
+        for cookie in cookies:
+            if not ignore_discard and cookie.discard:
+                continue
+            if not ignore_expires and cookie.is_expired(now):
+                continue
+            entries.setdefault(cookie.domain, []).append(
+                _fields_from_cookie(cookie)
+            )
+        return entries
+
+    def load_entries(self, entries, replace=False):
+        """
+        Set the cookies returned by entries(), possibly of another jar.
+
+        Like cookies loaded from a file, they are only turned into Cookie
+        objects once a request could use them, and are not written by
+        save(merge=True) unless they are changed later. They replace any
+        cookie with the same domain, path and name.
+
+        With replace, every other cookie is dropped, except those set since
+        the last save, so that the jar holds what another jar published.
+        """
+        self._cookies_lock.acquire()
+        try:
+            if replace:
+                self._cookies = {}
+                self._pending = {}
+            for domain, domain_entries in entries.items():
+                if domain in self._cookies:
+                    for fields in domain_entries:
+                        FileCookieJar.set_cookie(
+                            self, _cookie_from_fields(fields)
+                        )
+                elif domain in self._pending:
+                    self._pending[domain] = _unique_entries(
+                        self._pending[domain] + list(domain_entries)
+                    )
                 else:
-                    name = cookie.name
-                    value = cookie.value
-                if cookie.has_nonstandard_attr(HTTPONLY_ATTR):
-                    domain = HTTPONLY_PREFIX + domain
-                f.write(
-                    "\t".join([domain, initial_dot, cookie.path,
-                               secure, expires, name, value])+
-                    "\n")
+                    self._pending[domain] = _unique_entries(domain_entries)
+            if replace:
+                for key, cookie in self._changed.items():
+                    if cookie is None or any(
+                        _fields_key(fields) == key
+                        for fields in entries.get(cookie.domain, ())
+                    ):
+                        continue
+                    # Not published yet, so still only in this jar.
+                    self._materialize(cookie.domain)
+                    FileCookieJar.set_cookie(self, cookie)
+            self._host_cache = {}
+        finally:
+            self._cookies_lock.release()
+
+    def dumps(self, ignore_discard=False, ignore_expires=False):
+        """Return the contents save() would write, as a string."""
+        self._cookies_lock.acquire()
+        try:
+            pending = list(self._pending.values())
+            cookies = list(deepvalues(self._cookies))
+        finally:
+            self._cookies_lock.release()
+        f = io.StringIO()
+        self._write_all(f, pending, cookies, ignore_discard, ignore_expires)
+        return f.getvalue()
+
+
+def _domain_suffixes(*hosts):
+    """
+    Return every domain a cookie could be set for and sent to the hosts:
+    each of their suffixes that starts a label, with and without a leading
+    dot, most specific first, and the empty domain.
+    """
+    domains = {}
+    for host in hosts:
+        if not host.startswith("."):
+            host = "." + host
+        start = 0
+        while start != -1:
+            domains[host[start:]] = None
+            domains[host[start + 1:]] = None
+            start = host.find(".", start + 1)
+    domains[""] = None
+    return list(domains)
+
+
+def _host_key(request):
+    """
+    Return what the cookies a request gets depend on, other than its path
+    and the time, or None if its host is not in its URL.
+    """
+    scheme, netloc = urlsplit(request.get_full_url())[:2]
+    if not netloc:
+        return None
+    return (scheme, netloc.lower(), request.unverifiable,
+            request.origin_req_host)
+
+
+def _path_return_ok(cookie_path, path):
+    """Like DefaultCookiePolicy.path_return_ok, for an escaped path."""
+    if not path.startswith(cookie_path):
+        return False
+    return (len(path) == len(cookie_path) or cookie_path.endswith("/") or
+            path[len(cookie_path)] == "/")
+
+
+def _cookie_from_fields(fields):
+    domain, domain_specified, path, secure, expires, name, value, httponly = \
+            fields
+    rest = {}
+    if httponly:
+        rest[HTTPONLY_ATTR] = ""
+    secure = (secure == "TRUE")
+    domain_specified = (domain_specified == "TRUE")
+    if name == "":
+        # cookies.txt regards 'Set-Cookie: foo' as a cookie
+        # with no name, whereas http.cookiejar regards it as a
+        # cookie with no value.
+        name = value
+        value = None
+
+    initial_dot = domain.startswith(".")
+
+    discard = False
+    if expires == "0":
+        expires = None
+        discard = True
+
+    # assume path_specified is false
+    return Cookie(0, name, value,
+                  None, False,
+                  domain, domain_specified, initial_dot,
+                  path, False,
+                  secure,
+                  expires,
+                  discard,
+                  None,
+                  None,
+                  rest)
+
+
+def _fields_from_cookie(cookie):
+    """Return the fields _cookie_from_fields would turn into cookie."""
+    if cookie.value is None:
+        name = ""
+        value = cookie.name
+    else:
+        name = cookie.name
+        value = cookie.value
+    if cookie.expires is not None:
+        expires = str(cookie.expires)
+    else:
+        expires = "0"
+    return (cookie.domain,
+            "TRUE" if cookie.domain.startswith(".") else "FALSE",
+            cookie.path,
+            "TRUE" if cookie.secure else "FALSE",
+            expires, name, value,
+            cookie.has_nonstandard_attr(HTTPONLY_ATTR))
+
+
+def _fields_from_line(line):
+    """Return the fields of a cookie file line, or None if it has none."""
+    # httponly is a cookie flag as defined in rfc6265
+    # when encoded in a netscape cookie file,
+    # the line is prepended with "#HttpOnly_"
+    httponly = line.startswith(HTTPONLY_PREFIX)
+    if httponly:
+        line = line[len(HTTPONLY_PREFIX):]
+
+    # last field may be absent, so keep any trailing tab
+    if line.endswith("\n"): line = line[:-1]
+
+    # skip comments and blank lines XXX what is $ for?
+    if (line.strip().startswith(("#", "$")) or
+        line.strip() == ""):
+        return None
+
+    fields = line.split("\t")
+    domain, domain_specified, path, secure, expires, name, value = \
+            fields
+    initial_dot = domain.startswith(".")
+    assert (domain_specified == "TRUE") == initial_dot
+
+    if expires == "":
+        fields[4] = "0"
+    fields.append(httponly)
+    return tuple(fields)
+
+
+def _fields_key(fields):
+    """Return the (domain, path, name) of the cookie with these fields."""
+    return (fields[0], fields[2], fields[5] or fields[6])
+
+
+def _unique_entries(domain_entries):
+    """Return domain_entries with only the last of each cookie."""
+    unique = {_fields_key(fields): fields for fields in domain_entries}
+    if len(unique) == len(domain_entries):
+        return list(domain_entries)
+    return list(unique.values())
+
+
+def _kept_entries(entries, now, ignore_discard, ignore_expires):
+    """Return the entries that should be loaded or saved, by domain."""
+    if ignore_discard and ignore_expires:
+        return entries
+    kept = {}
+    for domain, domain_entries in entries.items():
+        domain_entries = [
+            fields for fields in domain_entries
+            if _keep_fields(fields, now, ignore_discard, ignore_expires)
+        ]
+        if domain_entries:
+            kept[domain] = domain_entries
+    return kept
+
+
+def _cache_name(filename):
+    return f"{filename}.bin"
+
+
+def _write_cache(filename, entries, stamp):
+    # The cache only saves time, so failing to write it is not an error.
+    try:
+        write_cache(_cache_name(filename), entries, stamp)
+    except OSError:
+        pass
+
+
+def _keep_fields(fields, now, ignore_discard, ignore_expires):
+    """Return whether the cookie with these fields should be saved."""
+    expires = fields[4]
+    if not ignore_discard and expires == "0":
+        return False
+    if (not ignore_expires and expires != "0" and
+        int(float(expires)) <= now):
+        return False
+    return True
+
+
+def _line_key(line):
+    """Return the (domain, path, name) of a cookie file line, or None."""
+    if line.startswith(HTTPONLY_PREFIX):
+        line = line[len(HTTPONLY_PREFIX):]
+    if line.endswith("\n"): line = line[:-1]
+    fields = line.split("\t")
+    if len(fields) != 7 or line.startswith(("#", "$")):
+        return None
+    domain, _, path, _, _, name, value = fields
+    if name == "":
+        name = value
+    return (domain, path, name)
+
+
+def _keep_cookie(cookie, now, ignore_discard, ignore_expires):
+    """Return whether cookie should be saved."""
+    if not ignore_discard and cookie.discard:
+        return False
+    if not ignore_expires and cookie.is_expired(now):
+        return False
+    return True
+
+
+def _line_from_fields(fields):
+    """Return the cookie file line for the cookie with these fields."""
+    line = "\t".join(fields[:7]) + "\n"
+    if fields[7]:
+        line = HTTPONLY_PREFIX + line
+    return line
@@ -1,17 +1,56 @@
+from contextlib import contextmanager
 from getpass import getpass
 
 from .library import ShibbolethSession
 
 
 class CLI:
-    def __init__(self, cookie_file):
-        self._session = ShibbolethSession(cookie_file)
+    def __init__(self, cookie_file, **session_options):
+        self._session = ShibbolethSession(cookie_file, **session_options)
+        self._batch_depth = 0
 
-    def perform(self, request):
-        result = self._session.perform(request, self)
-        self._session.save_cookies()
+    def weblogin_url(self):
+        return self._session.weblogin_url()
+
+    def recently_verified(self):
+        return self._session.recently_verified()
+
+    @contextmanager
+    def batch(self):
+        """Save the cookies once at the end of the block, not every call."""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            self._save_cookies()
+
+    def perform(self, request, stream=False):
+        result = self._session.perform(request, self, stream)
+        self._save_cookies()
+        return result
+
+    def perform_many(self, requests, max_workers=8):
+        results = self._session.perform_many(requests, self, max_workers)
+        self._save_cookies()
+        return results
+
+    def download(self, request, destination, **kwargs):
+        result = self._session.download(request, self, destination, **kwargs)
+        self._save_cookies()
         return result
 
+    def download_many(self, downloads, max_workers=4, **kwargs):
+        results = self._session.download_many(
+            downloads, self, max_workers, **kwargs
+        )
+        self._save_cookies()
+        return results
+
+    def _save_cookies(self):
+        if self._batch_depth == 0:
+            self._session.save_cookies()
+
     def get_credentials(self):
         uniqname = input("uniqname: ")
         password = getpass("password: ")
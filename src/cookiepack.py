@@ -0,0 +1,153 @@
+"""
+A compact binary form of cookie jar entries.
+
+cURLCookieJar keeps the cookies it has not turned into Cookie objects yet as
+tuples of fields, grouped by domain (see cURLCookieJar.entries). They are
+packed as:
+
+    domains     uint32    number of domains
+    cookies     uint32    number of cookies
+    sizes       uint32 x domains    cookies per domain, in order
+    httponly    uint8 x cookies     the HttpOnly flag of each cookie
+    fields      UTF-8, the 7 string fields of every cookie, in order,
+                separated by newlines
+
+Fields never contain newlines, since the Netscape format could not store
+them either, so unpacking is a single split rather than a parse per
+cookie. All integers are little endian.
+
+read_cache and write_cache keep such a payload in a file next to a cookie
+file, with a versioned header holding a CRC-32 of the payload and the size,
+modification time and inode the cookie file had when the cache was written.
+A cache that does not match the cookie file is not used, so the text file
+stays authoritative and can still be changed by curl or by hand.
+"""
+
+import math
+import struct
+import sys
+import zlib
+from array import array
+
+from .filelock import atomic_write
+
+_counts = struct.Struct("<II")
+# magic, version, CRC-32 of the payload, the cookie file's size,
+#  modification time (ns) and inode, and the earliest expiry time of any
+#  cookie.
+_cache_header = struct.Struct("<4sHxxIQqQd")
+_cache_magic = b"CJAR"
+_cache_version = 1
+
+
+def pack_entries(entries):
+    """Return entries, a dict of domain to field tuples, as bytes."""
+    sizes = array("I")
+    httponly = bytearray()
+    strings = []
+    for domain_entries in entries.values():
+        if not domain_entries:
+            continue
+        sizes.append(len(domain_entries))
+        for fields in domain_entries:
+            strings.extend(fields[:7])
+            httponly.append(1 if fields[7] else 0)
+    if sys.byteorder == "big":
+        sizes.byteswap()
+    return b"".join([
+        _counts.pack(len(sizes), len(httponly)),
+        sizes.tobytes(),
+        bytes(httponly),
+        "\n".join(strings).encode("utf-8"),
+    ])
+
+
+def unpack_entries(data):
+    """
+    Return the entries packed in data, as a dict of domain to field tuples.
+
+    Raises ValueError if data is malformed.
+    """
+    try:
+        domains, count = _counts.unpack_from(data)
+    except struct.error as err:
+        raise ValueError("Truncated cookie entries.") from err
+    offset = _counts.size
+    sizes = array("I")
+    sizes.frombytes(data[offset:offset + 4 * domains])
+    if sys.byteorder == "big":
+        sizes.byteswap()
+    offset += 4 * domains
+    httponly = data[offset:offset + count]
+    offset += count
+    if len(sizes) != domains or len(httponly) != count:
+        raise ValueError("Truncated cookie entries.")
+
+    strings = []
+    if count:
+        strings = bytes(data[offset:]).decode("utf-8").split("\n")
+    if len(strings) != 7 * count or sum(sizes) != count:
+        raise ValueError("Cookie entries do not match their counts.")
+    fields = iter(strings)
+    cookies = list(zip(fields, fields, fields, fields, fields, fields, fields,
+                       map(bool, httponly)))
+    entries = {}
+    start = 0
+    for size in sizes:
+        entries[cookies[start][0]] = cookies[start:start + size]
+        start += size
+    return entries
+
+
+def file_stamp(stat_result):
+    """Return what identifies a version of a file, from its os.stat()."""
+    return (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+
+
+def read_cache(path, stamp):
+    """
+    Return the entries cached in path and their earliest expiry time.
+
+    Returns None if there is no usable cache for the cookie file version
+    stamp (see file_stamp).
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    try:
+        (magic, version, checksum, size, mtime_ns, inode,
+         earliest_expiry) = _cache_header.unpack_from(data)
+    except struct.error:
+        return None
+    if (magic != _cache_magic or version != _cache_version or
+            (size, mtime_ns, inode) != stamp):
+        return None
+    payload = memoryview(data)[_cache_header.size:]
+    if zlib.crc32(payload) != checksum:
+        return None
+    try:
+        return unpack_entries(payload), earliest_expiry
+    except ValueError:
+        return None
+
+
+def write_cache(path, entries, stamp):
+    """Cache entries for the cookie file version stamp in path."""
+    payload = pack_entries(entries)
+    earliest_expiry = min(
+        (
+            float(fields[4])
+            for domain_entries in entries.values()
+            for fields in domain_entries
+            if fields[4] != "0"
+        ),
+        default=math.inf
+    )
+    header = _cache_header.pack(_cache_magic, _cache_version,
+                                zlib.crc32(payload), *stamp,
+                                earliest_expiry)
+    with atomic_write(path, "wb") as f:
+        f.write(header)
+        f.write(payload)
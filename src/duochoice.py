@@ -0,0 +1,68 @@
+import json
+
+from .filelock import atomic_write, locked
+
+
+class DuoChoiceCache:
+    """
+    Remembers the Duo device and factor each uniqname last logged in with.
+
+    The choices are kept next to the cookie file, in <cookie file>.duo, as
+    JSON mapping each uniqname to its device and factor. Passcodes and SMS
+    are never remembered, since they need input from the user.
+    """
+
+    _unremembered_factors = ("Passcode", "sms")
+
+    def __init__(self, cookie_file_name):
+        self._path = f"{cookie_file_name}.duo"
+
+    def get(self, uniqname):
+        """Return the remembered choice for uniqname, or None."""
+        choice = self._load().get(uniqname)
+        if (not isinstance(choice, dict) or
+                not isinstance(choice.get("device"), str) or
+                not isinstance(choice.get("factor"), str)):
+            return None
+        return {
+            "device": choice["device"],
+            "factor": choice["factor"],
+            "description": choice.get("description", choice["factor"]),
+        }
+
+    def remember(self, uniqname, choice):
+        """Remember choice for uniqname, if it can be used without input."""
+        if choice["factor"] in self._unremembered_factors:
+            return
+        self._update(uniqname, {
+            "device": choice["device"],
+            "factor": choice["factor"],
+            "description": choice.get("description"),
+        })
+
+    def forget(self, uniqname):
+        """Forget the choice remembered for uniqname."""
+        self._update(uniqname, None)
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                choices = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return choices if isinstance(choices, dict) else {}
+
+    def _update(self, uniqname, choice):
+        try:
+            with locked(self._path):
+                choices = self._load()
+                if choices.get(uniqname) == choice:
+                    return
+                if choice is None:
+                    choices.pop(uniqname, None)
+                else:
+                    choices[uniqname] = choice
+                with atomic_write(self._path) as f:
+                    json.dump(choices, f)
+        except OSError:
+            pass
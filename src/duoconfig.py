@@ -0,0 +1,321 @@
+"""
+Parsing of the inline weblogin script that configures Duo.
+
+The script declares the weblogin error message and a duo_config object:
+
+    var error = "Additional authentication is required.";
+    var duo_config = {
+        'host': 'api-XXXXXXXX.duosecurity.com',
+        'sig_request': 'TX|...:APP|...',
+        'post_action': '/',
+        'post_argument': 'duo_response'
+    };
+
+parse_script reads every such declaration in one pass over the script with
+a compiled tokenizer, and parses literal values (strings, numbers, nested
+objects and arrays) directly, so nested braces and quotes inside strings
+are handled without a separate regex and ast.literal_eval per value.
+"""
+
+import re
+
+
+# Every token in one scan: strings, punctuation, and runs of other
+#  characters (names, numbers and operators). Whitespace and comments before
+#  each token are matched outside of the group, so findall leaves them out.
+_token_regex = re.compile(
+    r"(?:\s|//[^\n]*|/\*.*?\*/)*("
+    r"'[^'\\\n]*(?:\\.[^'\\\n]*)*'"
+    r'|"[^"\\\n]*(?:\\.[^"\\\n]*)*"'
+    r"|[{}\[\]:,;=]"
+    r"|[^\s{}\[\]:,;='\"/]+|/"
+    r")",
+    re.DOTALL
+)
+# Whitespace and comments, which the tokenizer skips.
+_space_regex = re.compile(r"(?:\s|//[^\n]*|/\*.*?\*/)*", re.DOTALL)
+# A regular expression literal, which may contain quotes and slashes that
+#  _token_regex would take for the start of a string or a division.
+_regex_literal_regex = re.compile(
+    r"/(?![*/])(?:[^/\\\[\n]|\\.|\[(?:[^\]\\\n]|\\.)*\])+/[A-Za-z]*"
+)
+# A / starts a regular expression literal rather than a division after a
+#  token ending in one of these characters, or after one of these words.
+_regex_after_chars = frozenset("(,=:[!&|?{};+-*%<>~^")
+_regex_after_words = {
+    "return", "typeof", "case", "do", "else", "in", "of", "new", "delete",
+    "void", "throw", "instanceof", "yield", "await",
+}
+_number_regex = re.compile(r"-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?\Z")
+_escape_regex = re.compile(r"\\(u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|.)", re.DOTALL)
+_escapes = {
+    "n": "\n", "r": "\r", "t": "\t", "b": "\b", "f": "\f", "v": "\v",
+    "0": "\0",
+}
+_constants = {"true": True, "false": False, "null": None}
+_declarations = {"var", "const", "let"}
+_punctuation = {"{", "}", "[", "]", ":", ",", ";", "="}
+_value_ends = {";", ",", "}", "]", "var", "const", "let"}
+# Marks a value that is not a literal, such as a function call.
+_NOT_LITERAL = object()
+
+
+class DuoConfig:
+    """
+    The duo_config object of a weblogin page.
+
+    sig_request is made of a TX signature, which is sent to Duo, and an APP
+    signature, which is appended to the cookie Duo returns. Both are split
+    out once, when the config is created.
+    """
+
+    __slots__ = ("host", "sig_request", "post_action", "post_argument",
+                 "tx_signature", "app_signature")
+
+    def __init__(self, host, sig_request, post_action, post_argument):
+        tx_signature, separator, app_signature = sig_request.partition(
+            ":APP"
+        )
+        if not separator:
+            raise ValueError("sig_request has no APP signature.")
+        self.host = host
+        self.sig_request = sig_request
+        self.post_action = post_action
+        self.post_argument = post_argument
+        self.tx_signature = tx_signature
+        self.app_signature = app_signature
+
+    @classmethod
+    def from_dict(cls, values):
+        """Create a DuoConfig from the parsed duo_config object literal."""
+        try:
+            fields = [
+                values[name]
+                for name in ("host", "sig_request", "post_action",
+                             "post_argument")
+            ]
+        except (KeyError, TypeError):
+            raise ValueError("duo_config is missing fields.") from None
+        if not all(isinstance(field, str) for field in fields):
+            raise ValueError("duo_config fields must be strings.")
+        return cls(*fields)
+
+    def __repr__(self):
+        return (f"DuoConfig(host={self.host!r}, "
+                f"post_action={self.post_action!r})")
+
+
+def parse_script(script):
+    """
+    Return the variables declared with literal values in script.
+
+    Maps each name declared with var, const or let to its value as a Python
+    string, number, bool, None, dict or list. Declarations whose value is
+    not a literal, or is malformed, are left out.
+    """
+    tokens = _tokenize(script)
+    variables = {}
+    i = 0
+    while tokens[i] is not None:
+        token = tokens[i]
+        i += 1
+        if token not in _declarations:
+            continue
+        name = tokens[i]
+        if name is None or not name.isidentifier() or tokens[i + 1] != "=":
+            continue
+        try:
+            value, i = _parse_value(tokens, i + 2)
+        except ValueError as err:
+            value, i = _NOT_LITERAL, err.args[1]
+        if value is _NOT_LITERAL:
+            i = _skip_statement(tokens, i)
+        else:
+            variables[name] = value
+    return variables
+
+
+def parse_duo_config(script):
+    """
+    Return the weblogin error and the DuoConfig declared in script.
+
+    Either may be None if it is not declared (or cannot be parsed). Raises
+    ValueError if duo_config lacks any of the fields that are needed.
+    """
+    variables = parse_script(script)
+    error = variables.get("error")
+    config = variables.get("duo_config")
+    if config is not None:
+        config = DuoConfig.from_dict(config)
+    return error, config
+
+
+def _tokenize(text):
+    """Return the tokens of text, followed by None."""
+    tokens = _token_regex.findall(text)
+    if "/" in tokens:
+        # Either a division or a regular expression literal, which only the
+        #  tokens before it tell apart.
+        tokens = _tokenize_slashes(text)
+    tokens.append(None)
+    return tokens
+
+
+def _tokenize_slashes(text):
+    """
+    Return the tokens of text like _tokenize, but with each regular
+    expression literal as a single token.
+    """
+    tokens = []
+    pos = 0
+    while True:
+        pos = _space_regex.match(text, pos).end()
+        if text.startswith("/", pos) and _regex_allowed(
+                tokens[-1] if tokens else None):
+            match = _regex_literal_regex.match(text, pos)
+            if match is not None:
+                tokens.append(match.group())
+                pos = match.end()
+                continue
+        if pos == len(text):
+            return tokens
+        match = _token_regex.match(text, pos)
+        if match is None:
+            # Skipped, as findall does, such as the quote of an unterminated
+            #  string.
+            pos += 1
+            continue
+        tokens.append(match.group(1))
+        pos = match.end()
+
+
+def _regex_allowed(previous):
+    """Return whether a / after the token previous starts a literal."""
+    return (previous is None or previous[-1] in _regex_after_chars or
+            previous in _regex_after_words)
+
+
+# The parse functions take the token list and the index of the next token,
+#  and return a value and the index after it. A malformed literal raises
+#  ValueError(message, index).
+
+def _parse_value(tokens, i):
+    """
+    Parse the literal starting at tokens[i].
+
+    Returns _NOT_LITERAL, with the index of the token that showed it, if the
+    value is not a literal.
+    """
+    token = tokens[i]
+    if token is None:
+        return _NOT_LITERAL, i
+    first = token[0]
+    if first == "'" or first == '"':
+        value = _unquote(token)
+        i += 1
+    elif first == "{":
+        value, i = _parse_object(tokens, i + 1)
+    elif first == "[":
+        value, i = _parse_array(tokens, i + 1)
+    elif token in _constants:
+        value = _constants[token]
+        i += 1
+    elif _number_regex.match(token):
+        value = float(token) if any(c in token for c in ".eE") else int(token)
+        i += 1
+    else:
+        return _NOT_LITERAL, i
+
+    # Anything but the end of the statement means the value was only the
+    #  start of an expression.
+    token = tokens[i]
+    if token is not None and token not in _value_ends:
+        return _NOT_LITERAL, i
+    return value, i
+
+
+def _parse_object(tokens, i):
+    result = {}
+    if tokens[i] == "}":
+        return result, i + 1
+    while True:
+        token = tokens[i]
+        if token is None or token in _punctuation:
+            raise ValueError(f"Unexpected {token!r} in object literal.", i)
+        key = _unquote(token) if token[0] in "'\"" else token
+        if tokens[i + 1] != ":":
+            raise ValueError(f"Expected ':' after {key!r}.", i + 1)
+        value, i = _parse_value(tokens, i + 2)
+        if value is _NOT_LITERAL:
+            raise ValueError(f"Value of {key!r} is not a literal.", i)
+        result[key] = value
+        token = tokens[i]
+        if token is None:
+            raise ValueError("Unterminated object literal.", i)
+        i += 1
+        if token == "}":
+            return result, i
+        if token != ",":
+            raise ValueError(f"Unexpected {token!r} in object literal.", i)
+        if tokens[i] == "}":
+            # A trailing comma.
+            return result, i + 1
+
+
+def _parse_array(tokens, i):
+    result = []
+    if tokens[i] == "]":
+        return result, i + 1
+    while True:
+        value, i = _parse_value(tokens, i)
+        if value is _NOT_LITERAL:
+            raise ValueError("Array element is not a literal.", i)
+        result.append(value)
+        token = tokens[i]
+        if token is None:
+            raise ValueError("Unterminated array literal.", i)
+        i += 1
+        if token == "]":
+            return result, i
+        if token != ",":
+            raise ValueError(f"Unexpected {token!r} in array literal.", i)
+        if tokens[i] == "]":
+            # A trailing comma.
+            return result, i + 1
+
+
+def _skip_statement(tokens, i):
+    """
+    Return the index after the end of the statement at tokens[i].
+
+    Statements need not end with a semicolon, so one also ends before the
+    next declaration outside of any braces or brackets.
+    """
+    depth = 0
+    while True:
+        token = tokens[i]
+        if token is None:
+            return i
+        if token in _declarations and depth <= 0:
+            return i
+        i += 1
+        if token == "{" or token == "[":
+            depth += 1
+        elif token == "}" or token == "]":
+            depth -= 1
+        elif token == ";" and depth <= 0:
+            return i
+
+
+def _unquote(text):
+    body = text[1:-1]
+    if "\\" not in body:
+        return body
+    return _escape_regex.sub(_unescape, body)
+
+
+def _unescape(match):
+    escape = match.group(1)
+    if escape[0] in "ux" and len(escape) > 1:
+        return chr(int(escape[1:], 16))
+    return _escapes.get(escape, escape)
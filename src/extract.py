@@ -0,0 +1,156 @@
+"""
+Targeted extraction of the few values needed from weblogin and Duo pages.
+
+Script elements are found with a compiled regex, and the relevant part of
+Duo prompts is scanned once with html.parser.HTMLParser, keeping only the
+elements that are needed instead of building a full document tree. If a
+page does not have the expected structure, Beautiful Soup is used instead
+when it is installed.
+"""
+
+import re
+from html.parser import HTMLParser
+
+
+# Script contents cannot contain "</script", so no HTML parsing is needed to
+#  find where each one ends.
+_script_regex = re.compile(
+    r"<script\b[^>]*>(.*?)</script\s*>",
+    re.IGNORECASE | re.DOTALL
+)
+# Everything before the device list or the first device's fieldset can be
+#  skipped when parsing Duo prompts.
+_duo_prompt_start_regex = re.compile(
+    r"<(select|fieldset)\b[^>]*\b(name=['\"]?device\b|data-device-index=)",
+    re.IGNORECASE
+)
+
+
+class _DuoPromptParser(HTMLParser):
+    """
+    Collects the device options and per-device inputs of a Duo prompt.
+
+    devices is a list of (device, description) pairs from the options of
+    <select name="device">. fieldsets maps each data-device-index to the
+    list of (name, value) pairs of the <input> elements inside it.
+    """
+
+    _input_names = ("factor", "next-passcode", "phone-smsable")
+
+    def __init__(self):
+        super().__init__()
+        self.found_select = False
+        self.devices = []
+        self.fieldsets = {}
+        self._in_select = False
+        self._option = None
+        self._fieldset_stack = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "select" and attrs.get("name") == "device":
+            self.found_select = True
+            self._in_select = True
+        elif tag == "option" and self._in_select:
+            self._end_option()
+            self._option = (attrs.get("value"), [])
+        elif tag == "fieldset":
+            index = attrs.get("data-device-index")
+            if index is not None:
+                self.fieldsets.setdefault(index, [])
+            self._fieldset_stack.append(index)
+        elif tag == "input" and attrs.get("name") in self._input_names:
+            for index in reversed(self._fieldset_stack):
+                if index is not None:
+                    self.fieldsets[index].append(
+                        (attrs["name"], attrs.get("value"))
+                    )
+                    break
+
+    def handle_startendtag(self, tag, attrs):
+        if tag != "fieldset":
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag == "option":
+            self._end_option()
+        elif tag == "select" and self._in_select:
+            self._end_option()
+            self._in_select = False
+        elif tag == "fieldset" and self._fieldset_stack:
+            self._fieldset_stack.pop()
+
+    def handle_data(self, data):
+        if self._option is not None:
+            self._option[1].append(data)
+
+    def _end_option(self):
+        if self._option is not None:
+            value, text = self._option
+            self.devices.append((value, "".join(text)))
+            self._option = None
+
+
+def find_script(html, regex):
+    """
+    Return the text of the first <script> in html that regex matches.
+
+    Returns None if there is no such script.
+    """
+    for match in _script_regex.finditer(html):
+        script = match.group(1)
+        if regex.search(script):
+            return script
+
+    soup = _soup(html)
+    if soup is None:
+        return None
+    script = soup.find("script", string=regex)
+    return script.string if script is not None else None
+
+
+def parse_duo_prompt(html):
+    """
+    Return the devices and their 2FA inputs from a Duo prompt page.
+
+    Returns a list with one (device, description, inputs) tuple per device,
+    where inputs is a list of the (name, value) pairs of the factor,
+    next-passcode and phone-smsable inputs in that device's fieldset.
+    """
+    start = _duo_prompt_start_regex.search(html)
+    if start is None:
+        return _parse_duo_prompt_bs4(html)
+    parser = _DuoPromptParser()
+    parser.feed(html[start.start():])
+    parser.close()
+    if not parser.found_select:
+        return _parse_duo_prompt_bs4(html)
+    return [
+        (device, description, parser.fieldsets.get(device, []))
+        for device, description in parser.devices
+    ]
+
+
+def _parse_duo_prompt_bs4(html):
+    soup = _soup(html)
+    if soup is None:
+        return []
+    devices = []
+    for device_el in soup.select("select[name=device] > option"):
+        device = device_el["value"]
+        fieldset = soup.select_one(f"fieldset[data-device-index={device}]")
+        inputs = []
+        if fieldset is not None:
+            for name in _DuoPromptParser._input_names:
+                for input_el in fieldset.select(f"input[name={name}]"):
+                    inputs.append((name, input_el.get("value")))
+        devices.append((device, device_el.get_text(), inputs))
+    return devices
+
+
+def _soup(html):
+    try:
+        from bs4 import BeautifulSoup
+    except ImportError:
+        return None
+    return BeautifulSoup(html, "html.parser")
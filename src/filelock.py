@@ -0,0 +1,55 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; files are then replaced atomically but not
+    #  locked against other processes.
+    fcntl = None
+
+
+@contextmanager
+def locked(path):
+    """
+    Hold an exclusive lock associated with path.
+
+    The lock is taken on a separate <path>.lock file, so that path itself
+    can be replaced while the lock is held. The lock is advisory: it only
+    excludes other processes that use this function.
+    """
+    with open(f"{path}.lock", "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def atomic_write(path, mode="w"):
+    """
+    Open a temporary file that replaces path once the block completes.
+
+    Readers see either the old or the new contents of path, never a partial
+    write. If the block raises, path is left untouched.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(
+        prefix=f".{os.path.basename(path)}.", dir=directory
+    )
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,116 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import struct
+
+from .filelock import atomic_write, locked
+
+
+def hotp(key, counter, digits=6):
+    """Return the HOTP (RFC 4226) passcode for key and counter."""
+    mac = hmac.new(key, struct.pack(">Q", counter), hashlib.sha1).digest()
+    offset = mac[-1] & 0x0F
+    code = struct.unpack_from(">I", mac, offset)[0] & 0x7FFFFFFF
+    return str(code % 10 ** digits).zfill(digits)
+
+
+def decode_secret(secret):
+    """Return the key of a base32 secret, as shown when enrolling a token."""
+    secret = secret.replace(" ", "").upper()
+    secret += "=" * (-len(secret) % 8)
+    try:
+        return base64.b32decode(secret)
+    except binascii.Error as err:
+        raise ValueError("The HOTP secret is not valid base32.") from err
+
+
+class HOTPToken:
+    """
+    A Duo passcode generator for unattended logins.
+
+    Duo accepts passcodes from HOTP tokens, which are generated from a
+    secret and a counter that goes up with every passcode. The token is kept
+    in a JSON file:
+
+        {"secret": "<base32>", "counter": 0, "digits": 6, "device": null}
+
+    device is the Duo device to send passcodes for; if it is null, the first
+    device that accepts passcodes is used. The file must only be accessible
+    by its owner. Each passcode is generated while holding a lock on the
+    file, and the counter is advanced (by atomically replacing the file)
+    before the passcode is used, so concurrent processes never send the
+    same passcode twice.
+    """
+
+    def __init__(self, path):
+        """
+        Use the token stored in path.
+
+        Raises OSError if it cannot be read, or ValueError if it is not a
+        valid token file.
+        """
+        self._path = path
+        self.device = self._read()["device"]
+
+    @classmethod
+    def create(cls, path, secret, counter=0, digits=6, device=None):
+        """Store a new token in path and return it."""
+        decode_secret(secret)
+        state = {
+            "secret": secret,
+            "counter": counter,
+            "digits": digits,
+            "device": device,
+        }
+        with locked(path):
+            with atomic_write(path) as f:
+                json.dump(state, f)
+        return cls(path)
+
+    def next_passcode(self):
+        """Return the next passcode, advancing the stored counter."""
+        with locked(self._path):
+            state = self._read()
+            passcode = hotp(
+                decode_secret(state["secret"]), state["counter"],
+                state["digits"]
+            )
+            state["counter"] += 1
+            with atomic_write(self._path) as f:
+                json.dump(state, f)
+        return passcode
+
+    def _read(self):
+        with open(self._path) as f:
+            if os.name != "nt" and os.fstat(f.fileno()).st_mode & 0o077:
+                raise ValueError(
+                    f"{self._path} must only be accessible by its owner."
+                )
+            try:
+                state = json.load(f)
+            except ValueError:
+                raise ValueError(f"{self._path} is not valid JSON.") from None
+        if not isinstance(state, dict):
+            raise ValueError(f"{self._path} is not an HOTP token file.")
+        secret = state.get("secret")
+        counter = state.get("counter", 0)
+        digits = state.get("digits", 6)
+        device = state.get("device")
+        if not isinstance(secret, str):
+            raise ValueError(f"{self._path} has no HOTP secret.")
+        decode_secret(secret)
+        if not isinstance(counter, int) or counter < 0:
+            raise ValueError(f"{self._path} has an invalid counter.")
+        if digits not in (6, 7, 8):
+            raise ValueError(f"{self._path} has an invalid number of digits.")
+        if device is not None and not isinstance(device, str):
+            raise ValueError(f"{self._path} has an invalid device.")
+        return {
+            "secret": secret,
+            "counter": counter,
+            "digits": digits,
+            "device": device,
+        }
@@ -0,0 +1,374 @@
+"""
+An on-disk cache of the responses to ShibbolethSession.perform().
+
+Only GET requests are cached, and only for the identity (the uniqname logged
+in) that fetched them: the cache key is a hash of the identity and the URL,
+and the identity is stored with each entry and checked again when it is
+read, so one user's authenticated content is never given to another.
+Requests with their own Authorization, Range or conditional headers are not
+cached.
+
+Each entry is kept as two files in the cache directory, <key>.body with the
+(decoded) body and <key>.json with the status, headers and freshness of the
+response, which are only used together if they were stored together.
+
+Cache-Control is honoured: no-store responses are never kept, max-age and
+Expires give how long an entry can be used without asking the server, and
+no-cache (in the response or the request) means it is always revalidated.
+Stale entries are revalidated with If-None-Match and If-Modified-Since, and
+a 304 only costs the headers.
+
+The directory is bounded by max_size bytes. When it grows past that, the
+entries used least recently (by the modification time of their .json file,
+which is touched on every use) are removed.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from time import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from .filelock import atomic_write
+
+# Headers that describe how a response was sent rather than what it is. The
+#  body is stored decoded, and cookies are already in the jar.
+_unstored_headers = {
+    "connection", "keep-alive", "transfer-encoding", "content-encoding",
+    "content-length", "set-cookie",
+}
+# Request headers that make a response specific to something other than the
+#  identity, or only part of the resource.
+_uncached_request_headers = (
+    "Authorization", "Range", "If-None-Match", "If-Modified-Since",
+    "If-Match", "If-Unmodified-Since", "If-Range",
+)
+# Bodies start with a random tag, also stored in their .json file, so that a
+#  body and headers written by concurrent stores are never mixed up.
+_tag_size = 16
+
+
+class ResponseCache:
+    """
+    Keeps GET responses on disk, so that repeated fetches are revalidated
+    instead of downloaded again. Safe to share between sessions (and
+    threads), since entries are kept per identity.
+    """
+
+    def __init__(self, directory, max_size=256 << 20):
+        self.max_size = max_size
+        self._directory = directory
+        self._lock = threading.Lock()
+        # Size of every entry, least recently used first. Read from the
+        #  directory when first needed.
+        self._index = None
+        self._size = 0
+
+    def accepts(self, prepped):
+        """Return whether the response to prepped may be cached."""
+        if prepped.method != "GET":
+            return False
+        headers = prepped.headers
+        if any(name in headers for name in _uncached_request_headers):
+            return False
+        return "no-store" not in _directives(headers.get("Cache-Control"))
+
+    def lookup(self, identity, prepped):
+        """Return the entry cached for prepped and identity, or None."""
+        key = _key(identity, prepped.url)
+        meta = self._read_meta(key)
+        if (meta is None or meta.get("identity") != identity or
+                meta.get("request_url") != prepped.url):
+            return None
+        vary = meta.get("vary")
+        if not isinstance(vary, dict) or any(
+            prepped.headers.get(name) != value for name, value in vary.items()
+        ):
+            return None
+        body = self._read_body(key, meta.get("tag"))
+        if body is None:
+            return None
+        self._touch(key)
+        directives = _directives(prepped.headers.get("Cache-Control"))
+        return CachedResponse(key, meta, body, directives)
+
+    def store(self, identity, prepped, response):
+        """
+        Cache response to prepped for identity, if it may be cached.
+
+        Otherwise, any entry already cached for prepped is removed.
+        """
+        key = _key(identity, prepped.url)
+        directives = _directives(response.headers.get("Cache-Control"))
+        vary = [
+            name.strip()
+            for name in response.headers.get("Vary", "").split(",")
+            if name.strip()
+        ]
+        lifetime = _lifetime(response.headers, directives)
+        body = response.content
+        if (response.status_code != 200 or "no-store" in directives or
+                "*" in vary or len(body) > self.max_size or
+                not (lifetime or "ETag" in response.headers or
+                     "Last-Modified" in response.headers)):
+            self._remove(key)
+            return
+        meta = {
+            "identity": identity,
+            "request_url": prepped.url,
+            "url": response.url,
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": _stored_headers(response.headers),
+            "vary": {name: prepped.headers.get(name) for name in vary},
+            "date": time() - _seconds(response.headers.get("Age")),
+            "lifetime": lifetime,
+            "tag": os.urandom(_tag_size // 2).hex(),
+        }
+        try:
+            self._ensure_directory()
+            with atomic_write(self._path(key, "body"), "wb") as f:
+                f.write(meta["tag"].encode())
+                f.write(body)
+            size = self._write_meta(key, meta) + _tag_size + len(body)
+        except OSError:
+            return
+        self._add(key, size)
+
+    def refresh(self, entry, prepped, response):
+        """
+        Return the cached response for entry, revalidated by response (a
+        304), with its headers and freshness updated.
+        """
+        meta = entry.meta
+        headers = CaseInsensitiveDict(meta["headers"])
+        headers.update(_stored_headers(response.headers))
+        directives = _directives(headers.get("Cache-Control"))
+        lifetime = _lifetime(headers, directives)
+        # Entries that are always revalidated only need writing again if
+        #  their headers changed.
+        changed = lifetime or meta["lifetime"] or headers != meta["headers"]
+        meta["headers"] = dict(headers)
+        meta["date"] = time() - _seconds(response.headers.get("Age"))
+        meta["lifetime"] = lifetime
+        if "no-store" in directives:
+            self._remove(entry.key)
+        elif changed:
+            try:
+                self._write_meta(entry.key, meta)
+            except OSError:
+                pass
+        cached = entry.response(prepped)
+        cached.history = response.history
+        return cached
+
+    def forget(self, identity):
+        """Remove every entry cached for identity."""
+        try:
+            with os.scandir(self._directory) as items:
+                keys = [
+                    item.name[:-len(".json")]
+                    for item in items
+                    if item.name.endswith(".json")
+                ]
+        except OSError:
+            return
+        for key in keys:
+            meta = self._read_meta(key)
+            if meta is not None and meta.get("identity") == identity:
+                self._remove(key)
+
+    def _path(self, key, suffix):
+        return os.path.join(self._directory, f"{key}.{suffix}")
+
+    def _ensure_directory(self):
+        os.makedirs(self._directory, mode=0o700, exist_ok=True)
+
+    def _read_meta(self, key):
+        try:
+            with open(self._path(key, "json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if isinstance(meta, dict) else None
+
+    def _write_meta(self, key, meta):
+        """Write meta for key, and return the size of the file."""
+        data = json.dumps(meta)
+        with atomic_write(self._path(key, "json")) as f:
+            f.write(data)
+        return len(data)
+
+    def _read_body(self, key, tag):
+        """Return the body of key, if it was stored with meta tagged tag."""
+        if not isinstance(tag, str):
+            return None
+        try:
+            with open(self._path(key, "body"), "rb") as f:
+                if f.read(_tag_size) != tag.encode():
+                    return None
+                return f.read()
+        except OSError:
+            return None
+
+    def _load_index(self):
+        """Read the entries in the directory. Called with the lock held."""
+        if self._index is not None:
+            return
+        sizes = {}
+        used = {}
+        try:
+            with os.scandir(self._directory) as items:
+                for item in items:
+                    key, _, suffix = item.name.partition(".")
+                    if not key or suffix not in ("json", "body"):
+                        continue
+                    try:
+                        stat = item.stat()
+                    except OSError:
+                        continue
+                    sizes[key] = sizes.get(key, 0) + stat.st_size
+                    if suffix == "json":
+                        used[key] = stat.st_mtime
+        except OSError:
+            pass
+        self._index = OrderedDict(
+            (key, sizes[key])
+            for key in sorted(sizes, key=lambda key: used.get(key, 0))
+        )
+        self._size = sum(sizes.values())
+
+    def _touch(self, key):
+        try:
+            os.utime(self._path(key, "json"))
+        except OSError:
+            pass
+        with self._lock:
+            if self._index is not None and key in self._index:
+                self._index.move_to_end(key)
+
+    def _add(self, key, size):
+        with self._lock:
+            self._load_index()
+            self._size += size - self._index.pop(key, 0)
+            self._index[key] = size
+            evicted = []
+            while self._size > self.max_size and len(self._index) > 1:
+                old_key, old_size = self._index.popitem(last=False)
+                self._size -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            self._delete_files(old_key)
+
+    def _remove(self, key):
+        with self._lock:
+            if self._index is not None:
+                self._size -= self._index.pop(key, 0)
+        self._delete_files(key)
+
+    def _delete_files(self, key):
+        for suffix in ("json", "body"):
+            try:
+                os.remove(self._path(key, suffix))
+            except OSError:
+                pass
+
+
+class CachedResponse:
+    """An entry of a ResponseCache."""
+
+    def __init__(self, key, meta, body, request_directives):
+        self.key = key
+        self.meta = meta
+        self.body = body
+        self._request_directives = request_directives
+
+    def fresh(self):
+        """Return whether the entry can be used without revalidating it."""
+        if "no-cache" in self._request_directives:
+            return False
+        lifetime = self.meta["lifetime"]
+        if "max-age" in self._request_directives:
+            lifetime = min(lifetime,
+                           _seconds(self._request_directives["max-age"]))
+        return time() - self.meta["date"] < lifetime
+
+    def add_validators(self, prepped):
+        """Make prepped conditional on the entry having changed."""
+        headers = self.meta["headers"]
+        if "ETag" in headers:
+            prepped.headers["If-None-Match"] = headers["ETag"]
+        if "Last-Modified" in headers:
+            prepped.headers["If-Modified-Since"] = headers["Last-Modified"]
+
+    def response(self, prepped):
+        """Return the cached response, as a response to prepped."""
+        body = self.body
+        response = requests.Response()
+        response.request = prepped
+        response.url = self.meta["url"]
+        response.status_code = self.meta["status"]
+        response.reason = self.meta["reason"]
+        response.headers = CaseInsensitiveDict(self.meta["headers"])
+        response.headers["Content-Length"] = str(len(body))
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = body
+        return response
+
+
+def _key(identity, url):
+    return hashlib.sha256(f"{identity}\n{url}".encode()).hexdigest()
+
+
+def _stored_headers(headers):
+    return {
+        name: value
+        for name, value in headers.items()
+        if name.lower() not in _unstored_headers
+    }
+
+
+def _directives(value):
+    """Return the directives of a Cache-Control header, by lowercase name."""
+    directives = {}
+    for part in (value or "").split(","):
+        name, _, argument = part.partition("=")
+        name = name.strip().lower()
+        if name:
+            directives[name] = argument.strip().strip('"')
+    return directives
+
+
+def _lifetime(headers, directives):
+    """Return how many seconds a response stays fresh."""
+    if "no-cache" in directives:
+        return 0.0
+    if "max-age" in directives:
+        return _seconds(directives["max-age"])
+    expires = _http_date(headers.get("Expires"))
+    if expires is None:
+        return 0.0
+    date = _http_date(headers.get("Date"))
+    return max(expires - (time() if date is None else date), 0.0)
+
+
+def _seconds(value):
+    try:
+        return max(float(int(value)), 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _http_date(value):
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
@@ -0,0 +1,113 @@
+import json
+import threading
+import time
+
+
+class Instrumentation:
+    """
+    Receives timed spans and counters from a ShibbolethSession.
+
+    This base class discards everything. Subclass it to forward spans and
+    counters to a monitoring system, or use Recorder to collect them.
+    """
+
+    def span(self, name, **attributes):
+        """Return a context manager that times the work done inside it."""
+        return _NullSpan()
+
+    def count(self, name, value=1):
+        """Add value to the counter called name."""
+
+    def record(self, name, start, duration, **attributes):
+        """Record a span that has already finished."""
+
+
+class Recorder(Instrumentation):
+    """Collects spans and counters in memory. Safe to use from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = []
+        self._counters = {}
+
+    def span(self, name, **attributes):
+        return _Span(self, name, attributes)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def record(self, name, start, duration, **attributes):
+        """Record a span that has already finished."""
+        with self._lock:
+            self._spans.append({
+                "name": name,
+                "start": start,
+                "duration": duration,
+                "attributes": attributes,
+            })
+
+    def trace(self):
+        """Return every span and counter recorded so far."""
+        with self._lock:
+            return {
+                "spans": list(self._spans),
+                "counters": dict(self._counters),
+            }
+
+    def stats(self):
+        """Return the counters and the number and total time of each span."""
+        with self._lock:
+            spans = {}
+            for span in self._spans:
+                summary = spans.setdefault(
+                    span["name"], {"count": 0, "total": 0.0}
+                )
+                summary["count"] += 1
+                summary["total"] += span["duration"]
+            return {
+                "spans": spans,
+                "counters": dict(self._counters),
+            }
+
+    def dump(self, f, stats=False):
+        """Write the trace (or only the stats) to f as JSON."""
+        json.dump(self.stats() if stats else self.trace(), f, indent=2)
+        f.write("\n")
+
+
+class _Span:
+    def __init__(self, recorder, name, attributes):
+        self._recorder = recorder
+        self._name = name
+        self._attributes = attributes
+
+    def set(self, **attributes):
+        """Add attributes that are only known once the work is done."""
+        self._attributes.update(attributes)
+
+    def __enter__(self):
+        self._start = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self._attributes["error"] = exc_type.__name__
+        self._recorder.record(
+            self._name,
+            self._start,
+            time.perf_counter() - self._started,
+            **self._attributes
+        )
+
+
+class _NullSpan:
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
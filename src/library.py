@@ -1,32 +1,69 @@
-import ast
-import json
+import copy
+import os
 import re
-from time import sleep
-from urllib.parse import parse_qs, urlencode, urlparse
+import shutil
+import tempfile
+import threading
+from contextlib import nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import monotonic, time
+from urllib.parse import parse_qs, urlparse
 
-from bs4 import BeautifulSoup
 import requests
 
 from .cURLCookieJar import cURLCookieJar, LoadError
+from .filelock import atomic_write
+from .instrument import Instrumentation
+from .lifetime import SessionLifetime
+from .polling import PollSchedule
+from .transport import JarSession, Transport
+from .validity import ValidityCache
+
+# Finds the inline script that declares the weblogin error and duo_config.
+_error_script_regex = re.compile(r"\b(?:var|const|let)\s+error\s*=")
+# Request bodies that have to be copied to be sent again are kept in memory
+#  up to this size, and in a temporary file beyond it.
+_spool_size = 1 << 20
 
 class ShibbolethError(Exception):
     def init(self, message):
         super().__init__(self, message)
 
 
-class ShibbolethSession:
-    def __init__(self, cookie_file_name):
-        """Create an authentication session using the given cookie file."""
-        self._session = requests.Session()
-        self._session.cookies = cURLCookieJar(cookie_file_name)
-        try:
-            self._session.cookies.load(ignore_discard=True)
-        except (LoadError, OSError):
-            pass
-        self._session.headers.update({
+class _DuoChoiceRejected(ShibbolethError):
+    """Duo refused to start 2FA with the chosen device and factor."""
+
+
+class _SessionBase:
+    """
+    The state of a login and every step of it that does not do I/O.
+
+    ShibbolethSession and AsyncShibbolethSession send the requests described
+    here and pass the responses back, so both share the same parsing, Duo
+    and cookie jar logic.
+    """
+
+    def __init__(self, cookie_file_name, poll_schedule, validity_ttl,
+                 duo_host, weblogin_host, instrumentation,
+                 cookie_broker=None, binary_cache=True):
+        self._instrumentation = instrumentation or Instrumentation()
+
+        # Sessions without a cookie file (used for renewals) are only kept
+        #  in memory. Cookies published by another process (see CookieBroker)
+        #  are used instead of parsing the cookie file.
+        self._cookies = cURLCookieJar(cookie_file_name,
+                                      binary_cache=binary_cache)
+        self._cookie_broker = cookie_broker
+        self._broker_generation = 0
+        if not self._adopt_shared_cookies() and cookie_file_name is not None:
+            try:
+                self._cookies.load(ignore_discard=True)
+            except (LoadError, OSError):
+                pass
+        self._headers = {
             "User-Agent": "Mozilla/5.0",
             "Accept-Language": "en-US,en;q=0.5",
-        })
+        }
 
         self._authenticated = False
         self._two_factor_authenticated = False
@@ -34,18 +71,23 @@ class ShibbolethSession:
         self._duo_choices = None
         self._duo_sid = None
         self._duo_txid = None
+        self._poll_schedule = poll_schedule or PollSchedule()
+        self._two_factor_timings = {}
+        self._validity = None
+        if validity_ttl is not None:
+            self._validity = ValidityCache(cookie_file_name, validity_ttl)
+        self._duo_host = duo_host
+        self._lifetime = SessionLifetime(cookie_file_name)
+        # The uniqname whose password was accepted by the last login.
+        self._principal = None
 
-        self._weblogin_host = "https://weblogin.umich.edu"
+        # The generation is bumped after every login so that requests which
+        #  bounced to weblogin during that login only need to be replayed.
+        self._login_generation = 0
+
+        self._weblogin_host = weblogin_host.rstrip("/")
         self._weblogin_url = f"{self._weblogin_host}/"
-        self._js_regex = re.compile(
-            r"[;\s](var|const|let)\s+error\s*=\s*(['\"])(.*?)\2\s*;",
-            re.MULTILINE
-        )
-        # TODO: This could be improved
-        self._duo_config_regex = re.compile(
-            r"[;\s](var|const|let)\s+duo_config\s*=\s*({[^}]*})\s*;",
-            re.MULTILINE
-        )
+        self._duo_scheme = urlparse(self._weblogin_host).scheme
 
     def authenticated(self):
         """Return whether Shibboleth authentication is complete."""
@@ -55,26 +97,76 @@ class ShibbolethSession:
         """Return whether two-factor authentication is complete."""
         return self._two_factor_authenticated
 
-    def check_already_authenticated(self):
-        """Check if the user is already authenticated."""
-        get_res = self._session.get(self._weblogin_url, allow_redirects=False)
-        if get_res.is_redirect:
-            self._authenticated = True
-            self._two_factor_authenticated = True
-            return True
-        return False
+    def two_factor_timings(self):
+        """
+        Return how long each phase of the last 2FA attempt took.
 
-    def authenticate(self, uniqname, password):
+        Maps phase names ("prompt", "status", "cookie" and "weblogin") to
+        seconds, plus "status_polls" for the number of status requests sent.
         """
-        Attempt to authenticate the user to Shibboleth.
+        return dict(self._two_factor_timings)
 
-        Does not perform 2FA, but determines what 2FA methods are available.
-        Returns these choices, or None if authentication was not successful.
+    def login_count(self):
+        """Return how many logins perform() has completed."""
+        return self._login_generation
+
+    def cancel_two_factor(self):
+        """Stop waiting for a Duo response. Safe to call from any thread."""
+        self._poll_schedule.cancel()
+
+    def recently_verified(self):
         """
-        self._session.get(self._weblogin_url, allow_redirects=False)
+        Return whether the cookies were verified recently enough to trust.
 
-        post_headers = {}
-        post_data = {
+        This never makes a network request. It always returns False unless
+        the session was created with a validity_ttl.
+        """
+        if self._validity is None or not self._validity.fresh():
+            return False
+        self._authenticated = True
+        self._two_factor_authenticated = True
+        return True
+
+    def session_expiry(self, lifetime=None):
+        """
+        Return when the weblogin session is expected to end, or None.
+
+        This is when the first weblogin cookie expires or when the learned
+        session lifetime runs out (see SessionLifetime), whichever is
+        earlier. lifetime is used if no lifetime has been learned yet.
+        """
+        expiry_times = [self._weblogin_cookie_expiry()]
+        started = self._lifetime.started
+        lifetime = self._lifetime.lifetime or lifetime
+        if started is not None and lifetime is not None:
+            expiry_times.append(started + lifetime)
+        return min(
+            (expires for expires in expiry_times if expires is not None),
+            default=None
+        )
+
+    def _weblogin_cookie_expiry(self):
+        weblogin_domain = urlparse(self._weblogin_url).hostname
+        expiry_times = [
+            cookie.expires
+            for cookie in self._cookies.host_cookies(weblogin_domain)
+            if cookie.expires is not None
+        ]
+        return min(expiry_times, default=None)
+
+    def _mark_verified(self):
+        self._lifetime.alive()
+        if self._validity is None:
+            return
+        self._validity.record(self._weblogin_cookie_expiry())
+
+    def _session_ended(self):
+        self._lifetime.ended()
+        if self._validity is not None:
+            self._validity.invalidate()
+
+    def _password_form(self, uniqname, password):
+        return {
             "ref": "",
             "service": "",
             "required": "",
@@ -82,79 +174,107 @@ class ShibbolethSession:
             "loginX": uniqname,
             "password": password,
         }
-        post_res = self._session.post(
-            self._weblogin_url,
-            headers=post_headers,
-            data=post_data,
-            allow_redirects=False,
-        )
-        if post_res.is_redirect:
-            # On a redirect, we assume that the user is already authenticated.
-            self._authenticated = True
-            self._two_factor_authenticated = True
-            return None
 
-        post_response_html = BeautifulSoup(post_res.text, "html.parser")
-        script = post_response_html.find("script", string=self._js_regex)
-        error = re.search(self._js_regex, script.string).group(3)
-        if error != "Additional authentication is required.":
-            raise ShibbolethError(error)
+    def _read_weblogin_page(self, html):
+        """
+        Read the Duo configuration from the page weblogin returned.
 
-        self._duo_config = ast.literal_eval(
-            re.search(self._duo_config_regex, script.string).group(2)
-        )
+        Raises ShibbolethError with weblogin's message if the password was
+        not accepted.
+        """
+        # Only needed once a login is actually required, so these are not
+        #  imported up front.
+        from .duoconfig import parse_duo_config
+        from .extract import find_script
 
-        self._duo_choices = self.get_duo_choices()
+        with self._instrumentation.span("parse.weblogin"):
+            script = find_script(html, _error_script_regex)
+            try:
+                error, config = (
+                    parse_duo_config(script) if script is not None
+                    else (None, None)
+                )
+            except ValueError:
+                error, config = None, None
+            if not isinstance(error, str):
+                raise ShibbolethError("Unexpected response from weblogin.")
+            if error != "Additional authentication is required.":
+                raise ShibbolethError(error)
+            if config is None:
+                raise ShibbolethError("Unexpected response from weblogin.")
 
-        self._authenticated = True
+        self._duo_config = config
+        self._duo_host = config.host
 
-        return self._duo_choices
+    def _skip_two_factor(self):
+        # On a redirect, we assume that the user is already authenticated.
+        self._authenticated = True
+        self._two_factor_authenticated = True
 
-    def get_duo_choices(self):
-        """Attempt to get possible choices for a Duo 2FA request."""
+    def _duo_auth_request(self):
+        """Return the URL, params, headers and data of the Duo auth POST."""
         assert(self._duo_config is not None)
-        self._post_duo_auth()
-        prompt_url = f"https://{self._duo_config['host']}/frame/prompt"
+        auth_url = f"{self._duo_origin()}/frame/web/v1/auth"
+        post_headers = {
+            "Origin": self._duo_origin()
+        }
+        post_data = {
+            "tx": self._duo_config.tx_signature,
+            "parent": self._weblogin_url,
+            "java_version": "",
+            "flash_version": "",
+            "screen_resolution_width": "500",
+            "screen_resolution_height": "1000",
+            "color_depth": "24",
+            "is_cef_browser": "false",
+            "is_ipad_os": "false",
+        }
+        post_params = {
+            "tx": self._duo_config.tx_signature,
+            "parent": self._weblogin_url,
+            "v": "2.6"
+        }
+        return auth_url, post_params, post_headers, post_data
+
+    def _read_duo_auth_location(self, location):
+        query_params = parse_qs(urlparse(location).query)
+        self._duo_sid = query_params["sid"][0]
+
+    def _duo_prompt_page_request(self):
+        """Return the URL and params of the Duo prompt page."""
+        prompt_url = f"{self._duo_origin()}/frame/prompt"
         params = {
             "sid": self._duo_sid,
         }
-        headers = {}
-        res = self._session.get(
-            prompt_url,
-            headers=headers,
-            params=params,
-            allow_redirects=False,
-        )
-        res_html = BeautifulSoup(res.text, "html.parser")
-        device_options = res_html.select("select[name=device] > option")
+        return prompt_url, params
+
+    def _read_duo_prompt_page(self, html):
+        """Return the 2FA choices offered by a Duo prompt page."""
+        from .extract import parse_duo_prompt
+
+        with self._instrumentation.span("parse.duo_prompt"):
+            devices = parse_duo_prompt(html)
         options = []
-        for device_el in device_options:
-            device = device_el["value"]
-            device_desc = device_el.get_text()
-            device_fieldset = res_html.select_one(
-                f"fieldset[data-device-index={device}]"
-            )
-            device_factors = device_fieldset.select("input[name=factor]")
-            for factor_el in device_factors:
-                factor = factor_el["value"]
+        for device, device_desc, inputs in devices:
+            values = {}
+            for name, value in inputs:
+                values.setdefault(name, value)
+            for name, factor in inputs:
+                if name != "factor":
+                    continue
                 desc = f"{factor} to {device_desc}"
                 if factor == "Passcode":
                     desc = f"{factor} from {device_desc}"
-                    next_passcode_el = device_fieldset.select_one(
-                        "input[name=next-passcode]"
-                    )
-                    if next_passcode_el is not None:
-                        passcode = next_passcode_el["value"]
-                        if passcode is not None and passcode != "None":
-                            desc += (" (next SMS passcode starts "
-                                    f"with {passcode})")
+                    passcode = values.get("next-passcode")
+                    if passcode is not None and passcode != "None":
+                        desc += (" (next SMS passcode starts "
+                                f"with {passcode})")
                 options.append({
                     "device": device,
                     "factor": factor,
                     "description": desc,
                 })
-            sms_el = device_fieldset.select_one("input[name=phone-smsable]")
-            smsable = sms_el is not None and sms_el["value"] == "True"
+            smsable = values.get("phone-smsable") == "True"
 
             if smsable:
                 options.append({
@@ -165,50 +285,10 @@ class ShibbolethSession:
 
         return options
 
-    def _post_duo_auth(self):
-        assert(self._duo_config is not None)
-        auth_url = f"https://{self._duo_config['host']}/frame/web/v1/auth"
-        post_headers = {
-            "Origin": f"https://{self._duo_config['host']}"
-        }
-        post_data = {
-            "tx": self._duo_sig(),
-            "parent": self._weblogin_url,
-            "java_version": "",
-            "flash_version": "",
-            "screen_resolution_width": "500",
-            "screen_resolution_height": "1000",
-            "color_depth": "24",
-            "is_cef_browser": "false",
-            "is_ipad_os": "false",
-        }
-        post_params = {
-            "tx": self._duo_sig(),
-            "parent": self._weblogin_url,
-            "v": "2.6"
-        }
-        post_res = self._session.post(
-            auth_url,
-            params=post_params,
-            headers=post_headers,
-            data=post_data,
-            allow_redirects=False,
-        )
-        query_params = parse_qs(urlparse(post_res.headers["Location"]).query)
-        self._duo_sid = query_params["sid"][0]
-
-    def _duo_sig(self):
-        return self._duo_config["sig_request"].split(":APP")[0]
-
-    def _duo_sig_suffix(self):
-        return self._duo_config["sig_request"].split(":APP")[1]
-
-    def two_factor_authenticate(self, choice, passcode=None):
-        """
-        Attempt to perform 2FA using the given method.
+    def _duo_origin(self):
+        return f"{self._duo_scheme}://{self._duo_config.host}"
 
-        Requires that the session is authenticated().
-        """
+    def _check_two_factor_ready(self):
         if not self.authenticated():
             raise ShibbolethError(
                 "User must be authenticated to Shibboleth before attempting "
@@ -217,75 +297,75 @@ class ShibbolethSession:
 
         assert(self._duo_config is not None)
 
-        device = choice["device"]
-        factor = choice["factor"]
-
-        prompt_url = f"https://{self._duo_config['host']}/frame/prompt"
+    def _duo_prompt_request(self, choice, passcode):
+        """Return the URL, headers and data that send the chosen factor."""
+        prompt_url = f"{self._duo_origin()}/frame/prompt"
         prompt_headers = {
             "Accept": "text/plain, */*; q=0.01",
-            "Origin": f"https://{self._duo_config['host']}",
+            "Origin": self._duo_origin(),
             "X-Requested-With": "XMLHttpRequest",
         }
         prompt_data = {
             "sid": self._duo_sid,
-            "device": device,
-            "factor": factor,
+            "device": choice["device"],
+            "factor": choice["factor"],
             "out_of_date": "",
             "days_out_of_date": "",
             "days_to_block": "None",
         }
         if passcode is not None:
             prompt_data["passcode"] = passcode
+        return prompt_url, prompt_headers, prompt_data
 
-        prompt_res = self._session.post(
-            prompt_url,
-            headers=prompt_headers,
-            data=prompt_data,
-            allow_redirects=False
-        )
-
-        # SMS is not a real 2FA factor. The user will definitely not be
-        #  authenticated after this, since it just texts codes to their phone.
-        if factor == "sms":
-            return False
-
-        self._duo_txid = prompt_res.json()["response"]["txid"]
+    def _duo_status_request(self, prompt_response):
+        """Return the URL, headers and data of the Duo status requests."""
+        response = prompt_response.get("response")
+        if (prompt_response.get("stat") != "OK" or
+                not isinstance(response, dict) or "txid" not in response):
+            raise _DuoChoiceRejected(prompt_response.get(
+                "message", "Duo did not accept the two-factor request."
+            ))
+        self._duo_txid = response["txid"]
 
-        status_url = f"https://{self._duo_config['host']}/frame/status"
+        status_url = f"{self._duo_origin()}/frame/status"
         status_headers = {
             "Accept": "text/plain, */*; q=0.01",
-            "Origin": f"https://{self._duo_config['host']}",
+            "Origin": self._duo_origin(),
             "X-Requested-With": "XMLHttpRequest",
         }
         status_data = {
             "sid": self._duo_sid,
             "txid": self._duo_txid,
         }
-        while True:
-            sleep(2)
-            status_dict = self._session.post(
-                status_url,
-                headers=status_headers,
-                data=status_data
-            ).json()
-            if status_dict["response"]["status_code"] == "allow":
-                break
-            elif status_dict["response"]["status_code"] == "deny":
-                return False
+        return status_url, status_headers, status_data
+
+    def _raise_poll_stopped(self, timings, phase_start):
+        """Raise the error for a status poll that gave up waiting."""
+        self._end_phase(timings, "status", phase_start)
+        if self._poll_schedule.cancelled():
+            raise ShibbolethError(
+                "Two-factor authentication was cancelled."
+            )
+        raise ShibbolethError(
+            "Timed out waiting for a response from Duo."
+        )
 
+    def _count_status_poll(self, timings):
+        timings["status_polls"] += 1
+        self._instrumentation.count("duo.status_polls")
+
+    def _duo_cookie_request(self, status_url, status_headers):
+        """Return the URL, headers and data that fetch the Duo cookie."""
         cookie_url = f"{status_url}/{self._duo_txid}"
-        cookie_headers = status_headers
         cookie_data = {
             "sid": self._duo_sid,
         }
-        duo_cookie = self._session.post(
-            cookie_url,
-            headers=cookie_headers,
-            data=cookie_data,
-            allow_redirects=False,
-        ).json()["response"]["cookie"]
-        full_duo_cookie = f"{duo_cookie}:APP{self._duo_sig_suffix()}"
+        return cookie_url, status_headers, cookie_data
 
+    def _duo_weblogin_request(self, cookie_response):
+        """Return the URL, headers and data that pass Duo's cookie back."""
+        duo_cookie = cookie_response["response"]["cookie"]
+        full_duo_cookie = f"{duo_cookie}:APP{self._duo_config.app_signature}"
         weblogin_headers = {
             "Origin": self._weblogin_host,
         }
@@ -294,53 +374,908 @@ class ShibbolethSession:
             "service": "",
             "required": "mtoken",
         }
-        weblogin_data[self._duo_config["post_argument"]] = full_duo_cookie
-        weblogin_url=f"{self._weblogin_host}{self._duo_config['post_action']}"
+        weblogin_data[self._duo_config.post_argument] = full_duo_cookie
+        weblogin_url = f"{self._weblogin_host}{self._duo_config.post_action}"
+        return weblogin_url, weblogin_headers, weblogin_data
+
+    def _end_phase(self, timings, phase, started):
+        duration = monotonic() - started
+        timings[phase] = duration
+        self._instrumentation.record(f"duo.{phase}", time() - duration,
+                                     duration)
+
+    def _start_login(self):
+        self._authenticated = False
+        self._two_factor_authenticated = False
+        self._instrumentation.count("login.count")
+
+    def _end_login(self):
+        self._login_generation += 1
+        self._lifetime.logged_in(self._principal)
+        self._mark_verified()
+        self._publish_cookies()
+
+    def _adopt_shared_cookies(self):
+        """
+        Load the cookies another process published since the last check.
+
+        Returns whether there were any.
+        """
+        broker = self._cookie_broker
+        if broker is None or broker.generation() == self._broker_generation:
+            return False
+        generation, entries, stamp = broker.read()
+        if entries is None or generation == self._broker_generation:
+            return False
+        self._broker_generation = generation
+        if stamp != broker.file_stamp():
+            # The cookie file was written since, by a process that does not
+            #  share its cookies, so it holds the newer ones.
+            return False
+        self._cookies.load_entries(entries, replace=True)
+        # The publisher recorded when its login completed.
+        self._lifetime = SessionLifetime(self._cookies.filename)
+        self._instrumentation.count("cookies.adopted")
+        return True
+
+    def _publish_cookies(self):
+        if self._cookie_broker is None:
+            return
+        with self._instrumentation.span("cookies.publish"):
+            self._broker_generation = self._cookie_broker.publish(
+                self._cookies.entries(ignore_discard=True)
+            )
+
+    def weblogin_url(self):
+        """Return the URL of the weblogin page used by this session."""
+        return self._weblogin_url
+
+    def dump_cookies(self):
+        """Return the cookies in the Netscape cookie file format."""
+        return self._cookies.dumps(ignore_discard=True)
+
+    def save_cookies(self, merge=True):
+        """
+        Save the cookies to the cookie file.
+
+        By default, only the cookies changed by this session are written,
+        leaving changes made to the file by other processes in place.
+        """
+        self._cookies.save(ignore_discard=True, merge=merge)
+        if self._validity is not None:
+            self._validity.saved()
+        if self._cookie_broker is not None:
+            # So that the published cookies are not taken to be older than
+            #  the ones just saved.
+            self._cookie_broker.restamp(self._broker_generation)
+
+    def _record_http(self, method, url, status, sent, received, elapsed,
+                     retry_count=0):
+        """
+        Report an HTTP request to the instrumentation.
+
+        received is the Content-Length of the response, if it had one. The
+        http.bytes_received counter is kept as bodies are read instead, so
+        that it includes chunked and streamed responses.
+        """
+        instrumentation = self._instrumentation
+        instrumentation.count("http.requests")
+        instrumentation.count("http.bytes_sent", sent)
+        if retry_count:
+            instrumentation.count("http.retries", retry_count)
+        url = urlparse(url)
+        instrumentation.record(
+            "http",
+            time() - elapsed,
+            elapsed,
+            method=method,
+            host=url.netloc,
+            path=url.path,
+            status=status,
+            bytes_sent=sent,
+            bytes_received=received,
+            retries=retry_count,
+        )
+
+    def _is_weblogin_url(self, url):
+        if url is None:
+            return False
+        parsed_url = urlparse(url)
+        parsed_weblogin_url = urlparse(self._weblogin_url)
+        return all([
+            parsed_url.scheme == parsed_weblogin_url.scheme,
+            parsed_url.netloc == parsed_weblogin_url.netloc,
+            parsed_url.path == parsed_weblogin_url.path
+        ])
+
+
+class ShibbolethSession(_SessionBase):
+    def __init__(self, cookie_file_name, poll_schedule=None, transport=None,
+                 validity_ttl=None, pipelined=True, duo_host=None,
+                 weblogin_host="https://weblogin.umich.edu",
+                 instrumentation=None, executor=None, remember_duo=False,
+                 share_cookies=False, warm_urls=(), hotp_file=None,
+                 response_cache=None, binary_cache=True):
+        """
+        Create an authentication session using the given cookie file.
+
+        poll_schedule controls how Duo status requests are paced during
+        two-factor authentication (see PollSchedule). transport controls
+        connection pooling, timeouts and retries (see Transport). If
+        validity_ttl is given, a successful check against weblogin is
+        trusted for that many seconds without another network round-trip
+        (see ValidityCache).
+
+        In pipelined mode, the weblogin page is loaded and a connection to
+        the Duo host is opened while the handler asks for credentials, and
+        the Duo prompt is fetched in the background while the handler
+        reports that 2FA is starting. duo_host is
+        the Duo API host to open that connection to before the first login;
+        later logins use the host weblogin pointed to last time.
+
+        weblogin_host can point the session at a different weblogin server,
+        such as a local mock server. Duo is contacted using the same scheme
+        as weblogin.
+
+        instrumentation receives a span for every HTTP request, parse step and
+        login phase, and counters for requests, bytes, retries and Duo status
+        polls (see Instrumentation and Recorder).
+
+        executor runs the background work of pipelined logins. By default
+        each session starts its own small thread pool when first needed;
+        sessions can share one instead (see SessionPool). Its tasks never
+        wait on each other, but they must not queue behind perform() calls.
+
+        With remember_duo, the Duo device and factor chosen at each login are
+        remembered per uniqname (see DuoChoiceCache). Later logins use them
+        without fetching the Duo prompt or asking the handler, unless Duo
+        does not accept them.
+
+        With share_cookies, the cookies are shared with every other process
+        using the same cookie file and this option (see CookieBroker). Each
+        login is published to the others, which use it without parsing the
+        cookie file, and sessions that expire in several processes at once
+        are only logged in again by one of them.
+
+        warm_urls are the URLs of Shibboleth-protected services to visit
+        after every login and renewal (see warm()).
+
+        hotp_file is an HOTP token file (see HOTPToken). Logins then send a
+        passcode generated from it to Duo, without asking the handler, and
+        only ask if Duo does not accept it.
+
+        response_cache is a ResponseCache that perform() answers GET requests
+        from, revalidating them when they are stale. Its entries are kept per
+        uniqname, so it can be shared by sessions for different users; it is
+        only used once the uniqname logged in with the cookie file is known,
+        and a login as a different uniqname forgets the previous one's
+        entries.
+
+        With binary_cache (the default), a packed copy of the cookie file is
+        kept in <cookie file>.bin and loaded instead of parsing the file for
+        as long as the file is unchanged (see cURLCookieJar).
+        """
+        cookie_broker = None
+        if share_cookies and cookie_file_name is not None:
+            from .broker import CookieBroker
+            cookie_broker = CookieBroker(cookie_file_name)
+        super().__init__(cookie_file_name, poll_schedule, validity_ttl,
+                         duo_host, weblogin_host, instrumentation,
+                         cookie_broker, binary_cache)
+        self._session = JarSession()
+        self._transport = transport or Transport()
+        self._transport.mount(self._session)
+        self._session.cookies = self._cookies
+        self._session.headers.update(self._headers)
+        self._session.hooks["response"].append(self._record_response)
+
+        self._pipelined = pipelined
+        self._executor = executor
+        self._warm_urls = list(warm_urls)
+        self._hotp = None
+        if hotp_file is not None:
+            from .hotp import HOTPToken
+            try:
+                self._hotp = HOTPToken(hotp_file)
+            except (OSError, ValueError) as err:
+                raise ShibbolethError(
+                    f"The HOTP token cannot be used: {err}"
+                ) from err
+        self._response_cache = response_cache
+        self._duo_choice_cache = None
+        if remember_duo and cookie_file_name is not None:
+            from .duochoice import DuoChoiceCache
+            self._duo_choice_cache = DuoChoiceCache(cookie_file_name)
+
+        # Serializes logins triggered by concurrent perform() calls.
+        self._login_lock = threading.Lock()
+
+    def _end_login(self):
+        previous = self._lifetime.principal
+        super()._end_login()
+        if (self._response_cache is not None and previous is not None and
+                previous != self._lifetime.principal):
+            # Someone else logged in with this cookie file.
+            self._response_cache.forget(previous)
+
+    def check_already_authenticated(self):
+        """Check if the user is already authenticated."""
+        if self.recently_verified():
+            return True
+        generation = self._login_generation
+        get_res = self._session.get(self._weblogin_url, allow_redirects=False)
+        if get_res.is_redirect:
+            self._authenticated = True
+            self._two_factor_authenticated = True
+            self._mark_verified()
+            return True
+        with self._login_lock:
+            # Unless another thread logged in while this was checked.
+            if generation == self._login_generation:
+                self._session_ended()
+        return False
+
+    def ensure_authenticated(self, handler):
+        """
+        Log in using handler unless the session is already authenticated.
+
+        Returns whether a login was performed.
+        """
+        self._refresh_shared_cookies()
+        generation = self._login_generation
+        if self.check_already_authenticated():
+            return False
+        self._login_once(handler, generation)
+        return True
+
+    def renew(self, handler):
+        """
+        Log in again using handler, without interrupting requests.
+
+        The login runs against a separate cookie jar, and its cookies are
+        only copied into this session once it succeeds, so requests in
+        flight keep using the current session meanwhile. Requests that are
+        bounced to weblogin during the renewal wait for it to finish.
+        """
+        renewal = ShibbolethSession(
+            None,
+            poll_schedule=self._poll_schedule.copy(),
+            transport=self._transport,
+            pipelined=False,
+            duo_host=self._duo_host,
+            weblogin_host=self._weblogin_host,
+            instrumentation=self._instrumentation,
+        )
+        renewal._duo_choice_cache = self._duo_choice_cache
+        renewal._hotp = self._hotp
+        with self._login_lock, self._shared_login():
+            if self._adopt_shared_cookies():
+                # Another process renewed the session already.
+                self._login_generation += 1
+                return
+            self._instrumentation.count("login.renewals")
+            with self._instrumentation.span("login", renewal=True):
+                renewal.login_with_handler(handler)
+            for cookie in renewal._cookies:
+                self._cookies.set_cookie(cookie)
+            self._duo_host = renewal._duo_host
+            self._principal = renewal._principal
+            self._authenticated = True
+            self._two_factor_authenticated = True
+            self.warm()
+            self._end_login()
+
+    def authenticate(self, uniqname, password):
+        """
+        Attempt to authenticate the user to Shibboleth.
+
+        Does not perform 2FA, but determines what 2FA methods are available.
+        Returns these choices, or None if authentication was not successful.
+        """
+        return self._start_authenticate(uniqname, password).result()
+
+    def _start_authenticate(self, uniqname, password, fetch_choices=True,
+                            login_page=None):
+        """
+        Like authenticate(), but return a Future for the Duo choices.
+
+        Errors from weblogin (such as a wrong password) are still raised
+        directly. Without fetch_choices, Duo is only told that a login has
+        started, and the Future's result is None. login_page is a Future for
+        the weblogin page if it is already being loaded (see
+        _prefetch_login_page).
+        """
+        if login_page is None:
+            if self._pipelined and self._duo_host is not None:
+                self._submit(self._warm_connection, self._duo_host)
+
+        with self._instrumentation.span("login.password"):
+            if login_page is None:
+                self._load_login_page()
+            else:
+                login_page.result()
+
+            post_res = self._session.post(
+                self._weblogin_url,
+                data=self._password_form(uniqname, password),
+                allow_redirects=False,
+            )
+        if post_res.is_redirect:
+            self._skip_two_factor()
+            return _completed(None)
+
+        self._read_weblogin_page(post_res.text)
+
+        if self._pipelined:
+            return self._submit(self._fetch_duo_choices, fetch_choices)
+        return _completed(self._fetch_duo_choices(fetch_choices))
+
+    def _prefetch_login_page(self):
+        """
+        Start loading the weblogin page, and opening a connection to Duo,
+        in the background. Returns a Future for the page.
+        """
+        if self._duo_host is not None:
+            self._submit(self._warm_connection, self._duo_host)
+        return self._submit(self._load_login_page)
+
+    def _load_login_page(self):
+        self._session.get(self._weblogin_url, allow_redirects=False)
+
+    def _fetch_duo_choices(self, fetch_choices=True):
+        with self._instrumentation.span("duo.auth"):
+            self._post_duo_auth()
+        self._duo_choices = None
+        if fetch_choices:
+            self._duo_choices = self._get_prompt_choices()
+
+        self._authenticated = True
+
+        return self._duo_choices
+
+    def _submit(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=2,
+                thread_name_prefix="shibboleth",
+            )
+        return self._executor.submit(fn, *args)
+
+    def _warm_connection(self, host):
+        """Open a pooled connection to host so later requests can reuse it."""
+        try:
+            self._session.head(
+                f"{self._duo_scheme}://{host}/",
+                allow_redirects=False,
+            )
+        except requests.exceptions.RequestException:
+            pass
+
+    def get_duo_choices(self):
+        """Attempt to get possible choices for a Duo 2FA request."""
+        with self._instrumentation.span("duo.auth"):
+            self._post_duo_auth()
+        return self._get_prompt_choices()
+
+    def _get_prompt_choices(self):
+        prompt_url, params = self._duo_prompt_page_request()
+        with self._instrumentation.span("duo.prompt_page"):
+            res = self._session.get(
+                prompt_url,
+                params=params,
+                allow_redirects=False,
+            )
+        return self._read_duo_prompt_page(res.text)
+
+    def _post_duo_auth(self):
+        auth_url, post_params, post_headers, post_data = (
+            self._duo_auth_request()
+        )
+        post_res = self._session.post(
+            auth_url,
+            params=post_params,
+            headers=post_headers,
+            data=post_data,
+            allow_redirects=False,
+        )
+        self._read_duo_auth_location(post_res.headers["Location"])
+
+    def two_factor_authenticate(self, choice, passcode=None):
+        """
+        Attempt to perform 2FA using the given method.
+
+        Requires that the session is authenticated().
+        """
+        self._check_two_factor_ready()
+        self._poll_schedule.reset()
+
+        timings = {}
+        self._two_factor_timings = timings
+        phase_start = monotonic()
+
+        prompt_url, prompt_headers, prompt_data = self._duo_prompt_request(
+            choice, passcode
+        )
+        prompt_res = self._session.post(
+            prompt_url,
+            headers=prompt_headers,
+            data=prompt_data,
+            allow_redirects=False
+        )
+        self._end_phase(timings, "prompt", phase_start)
+
+        # SMS is not a real 2FA factor. The user will definitely not be
+        #  authenticated after this, since it just texts codes to their phone.
+        if choice["factor"] == "sms":
+            return False
+
+        status_url, status_headers, status_data = self._duo_status_request(
+            prompt_res.json()
+        )
+        schedule = self._poll_schedule
+        schedule.start()
+        phase_start = monotonic()
+        timings["status_polls"] = 0
+        # Duo checks a passcode as soon as it is sent, so its status can be
+        #  asked for straight away.
+        wait = passcode is None
+        while True:
+            if ((wait and not schedule.wait()) or schedule.cancelled()
+                    or schedule.expired()):
+                self._raise_poll_stopped(timings, phase_start)
+            wait = True
+            try:
+                status_dict = self._session.post(
+                    status_url,
+                    headers=status_headers,
+                    data=status_data,
+                    timeout=schedule.request_timeout(
+                        self._transport.connect_timeout
+                    ),
+                ).json()
+            except requests.exceptions.Timeout:
+                if not schedule.expired():
+                    raise
+                self._raise_poll_stopped(timings, phase_start)
+            self._count_status_poll(timings)
+            if status_dict["response"]["status_code"] == "allow":
+                break
+            elif status_dict["response"]["status_code"] == "deny":
+                self._end_phase(timings, "status", phase_start)
+                return False
+        self._end_phase(timings, "status", phase_start)
+
+        phase_start = monotonic()
+        cookie_url, cookie_headers, cookie_data = self._duo_cookie_request(
+            status_url, status_headers
+        )
+        cookie_res = self._session.post(
+            cookie_url,
+            headers=cookie_headers,
+            data=cookie_data,
+            allow_redirects=False,
+        )
+        self._end_phase(timings, "cookie", phase_start)
+
+        phase_start = monotonic()
+        weblogin_url, weblogin_headers, weblogin_data = (
+            self._duo_weblogin_request(cookie_res.json())
+        )
         response = self._session.post(
             weblogin_url,
             headers=weblogin_headers,
             data=weblogin_data,
             allow_redirects=False
         )
+        self._end_phase(timings, "weblogin", phase_start)
         self._two_factor_authenticated = True
         return True
 
-    def save_cookies(self):
-        """Save the cookies to the cookie file."""
-        self._session.cookies.save(ignore_discard=True)
-
-    def perform(self, request, handler):
-        """Perform the request, using handler to get credentials if needed."""
-        prepped = self._session.prepare_request(request)
-        response = self._session.send(prepped)
-        if response.url is not None:
-            parsed_url = urlparse(response.url)
-            parsed_weblogin_url = urlparse(self._weblogin_url)
-            if all([
-                parsed_url.scheme == parsed_weblogin_url.scheme,
-                parsed_url.netloc == parsed_weblogin_url.netloc,
-                parsed_url.path == parsed_weblogin_url.path
-            ]):
-                self.login_with_handler(handler)
-                prepped = self._session.prepare_request(request)
-                response = self._session.send(prepped)
+    def perform(self, request, handler, stream=False):
+        """
+        Perform the request, using handler to get credentials if needed.
+
+        With stream, the response body is not read until it is accessed
+        (see requests' streaming requests), and the response must be closed.
+
+        Redirects are followed one at a time, and a redirect to weblogin is
+        not followed: the session logs in and sends the request again
+        instead. Its body is kept for that, so a streamed body that cannot
+        be rewound is read into memory (or a temporary file, if large)
+        before it is sent.
+
+        With a response cache, GET requests that are not streamed are
+        answered from it while fresh, and revalidated once stale. A
+        revalidation that is bounced to weblogin is sent again after logging
+        in, like any other request.
+        """
+        self._refresh_shared_cookies()
+        with self._instrumentation.span("perform") as span:
+            generation = self._login_generation
+            prepped = self._session.prepare_request(request)
+            cache = self._response_cache
+            if (cache is not None and not stream and
+                    self._lifetime.principal is not None and
+                    cache.accepts(prepped) and
+                    not self._is_weblogin_url(prepped.url)):
+                response = self._perform_cached(prepped, handler, generation,
+                                                span)
+            else:
+                response, _ = self._send(prepped, handler, stream, generation,
+                                         span)
+            span.set(status=response.status_code)
+            return response
+
+    def _send(self, prepped, handler, stream, generation, span):
+        """
+        Send prepped, logging in and sending it again if it is bounced.
+
+        Returns the response and whether it still ended up at weblogin.
+        """
+        _spool_body(prepped)
+        response, bounced = self._follow(prepped, stream)
+        if bounced:
+            span.set(relogin=True)
+            response.close()
+            self._login_once(handler, generation)
+            replay = self._session.prepare_replay(prepped)
+            return self._follow(replay, stream, stop_at_weblogin=False)
+        if self._is_weblogin_url(prepped.url):
+            # weblogin only redirects away from itself once logged in.
+            self._mark_verified()
+        return response, False
+
+    def _perform_cached(self, prepped, handler, generation, span):
+        cache = self._response_cache
+        # Read before the request, which may log in as someone else.
+        identity = self._lifetime.principal
+        cached = cache.lookup(identity, prepped)
+        if cached is not None:
+            if cached.fresh():
+                self._instrumentation.count("cache.hits")
+                span.set(cache="hit")
+                return cached.response(prepped)
+            cached.add_validators(prepped)
+        response, bounced = self._send(prepped, handler, False, generation,
+                                       span)
+        if bounced:
+            return response
+        if self._lifetime.principal != identity:
+            # Logged in as someone else on the way, whose entry this is not.
+            if cached is None or response.status_code != 304:
+                return response
+            response.close()
+            for name in ("If-None-Match", "If-Modified-Since"):
+                prepped.headers.pop(name, None)
+            response, _ = self._send(self._session.prepare_replay(prepped),
+                                     handler, False, self._login_generation,
+                                     span)
+            return response
+        if cached is not None and response.status_code == 304:
+            self._instrumentation.count("cache.revalidated")
+            span.set(cache="revalidated")
+            return cache.refresh(cached, prepped, response)
+        self._instrumentation.count("cache.misses")
+        span.set(cache="miss")
+        cache.store(identity, prepped, response)
         return response
 
+    def _follow(self, prepped, stream, stop_at_weblogin=True):
+        """
+        Send prepped and follow its redirects.
+
+        Returns the last response and whether it was bounced to weblogin.
+        With stop_at_weblogin, a redirect to weblogin is returned (closed)
+        instead of followed, so weblogin's page is never downloaded.
+        """
+        session = self._session
+        history = []
+        response = session.send(prepped, stream=True, allow_redirects=False)
+        while response.is_redirect:
+            # requests has already read the redirect's body and prepared the
+            #  next request, with the cookies it set.
+            next_request = response.next
+            if stop_at_weblogin and self._is_weblogin_url(next_request.url):
+                response.history = history
+                return response, True
+            if len(history) >= session.max_redirects:
+                raise requests.exceptions.TooManyRedirects(
+                    f"Exceeded {session.max_redirects} redirects.",
+                    response=response
+                )
+            history.append(response)
+            response = session.send(next_request, stream=True,
+                                    allow_redirects=False)
+        response.history = history
+        bounced = self._is_weblogin_url(response.url)
+        if not stream and not (bounced and stop_at_weblogin):
+            response.content
+        return response, bounced
+
+    def perform_many(self, requests, handler, max_workers=8):
+        """
+        Perform the requests concurrently, using handler to get credentials.
+
+        Returns the responses in the same order as requests. If several
+        requests are redirected to weblogin at the same time, only one login
+        is performed and all of them are retried once it completes.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(
+                lambda request: self.perform(request, handler),
+                requests
+            ))
+
+    def warm(self, urls=None, max_workers=8):
+        """
+        Visit services concurrently, so that their sessions are started.
+
+        The first request to a Shibboleth-protected service is redirected to
+        the IdP and back before the service answers. Visiting it right after
+        logging in does that once, up front, and leaves its session cookies
+        in the cookie jar for later requests (and for curl, once saved).
+        This never logs in: a service that leads to weblogin is skipped.
+        Response bodies are not downloaded.
+
+        urls defaults to the warm_urls the session was created with. Returns
+        the final status code for each URL, or None where it failed.
+        """
+        urls = self._warm_urls if urls is None else list(urls)
+        if not urls:
+            return []
+        with self._instrumentation.span("warm", urls=len(urls)):
+            with ThreadPoolExecutor(
+                max_workers=min(max_workers, len(urls))
+            ) as executor:
+                return list(executor.map(self._warm_url, urls))
+
+    def _warm_url(self, url):
+        prepped = self._session.prepare_request(requests.Request("GET", url))
+        try:
+            response, bounced = self._follow(prepped, stream=True)
+        except requests.exceptions.RequestException:
+            self._instrumentation.count("warm.failures")
+            return None
+        response.close()
+        if bounced:
+            self._instrumentation.count("warm.failures")
+            return None
+        return response.status_code
+
+    def download(self, request, handler, destination, chunk_size=1 << 20,
+                 max_resumes=3):
+        """
+        Perform the request and write the response body to destination.
+
+        destination is a file name or a binary file opened for writing. The
+        body is written chunk_size bytes at a time as it arrives, so memory
+        use does not depend on its size. If the connection breaks, the
+        download continues from where it stopped with an HTTP Range request,
+        logging in again first if the session has expired meanwhile, up to
+        max_resumes times.
+
+        A file name is written to <name>.part and renamed once the download
+        is complete. The response's strong validator (ETag or Last-Modified)
+        is kept in <name>.part.validator, and a .part file left behind by an
+        earlier call is only resumed if the resource still matches it.
+
+        Returns the response of the last request, whose body has been
+        consumed. Raises requests.HTTPError for error statuses.
+        """
+        if isinstance(destination, (str, os.PathLike)):
+            part_name = f"{os.fspath(destination)}.part"
+            validator_name = f"{part_name}.validator"
+            validator = _read_validator(validator_name)
+            with open(part_name, "ab") as f:
+                if validator is None:
+                    # Nothing tells whether the part written is still
+                    #  current, so it cannot be resumed.
+                    f.seek(0)
+                    f.truncate()
+                response = self._download_to(
+                    request, handler, f, f.tell(), chunk_size, max_resumes,
+                    validator,
+                    lambda value: _write_validator(validator_name, value)
+                )
+            os.replace(part_name, destination)
+            _write_validator(validator_name, None)
+            return response
+        return self._download_to(
+            request, handler, destination, 0, chunk_size, max_resumes
+        )
+
+    def download_many(self, downloads, handler, max_workers=4, **kwargs):
+        """
+        Perform (request, destination) pairs concurrently with download().
+
+        Returns the responses in the same order. kwargs are passed to
+        download().
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(
+                lambda item: self.download(item[0], handler, item[1],
+                                           **kwargs),
+                downloads
+            ))
+
+    def _download_to(self, request, handler, f, offset, chunk_size,
+                     max_resumes, validator=None, keep_validator=None):
+        """
+        Write the body of request to f, which already holds offset bytes of
+        the version of it that validator identifies.
+
+        keep_validator is called with the validator of each response whose
+        body is written from the start.
+        """
+        # Ranges count bytes as sent, so the body must not be compressed in
+        #  transit.
+        headers = dict(request.headers or {})
+        headers["Accept-Encoding"] = "identity"
+        # If-Range only accepts strong validators.
+        resumes = 0
+        with self._instrumentation.span("download") as span:
+            while True:
+                attempt = copy.copy(request)
+                attempt.headers = dict(headers)
+                if offset:
+                    attempt.headers["Range"] = f"bytes={offset}-"
+                    if validator is not None:
+                        attempt.headers["If-Range"] = validator
+                try:
+                    response = self.perform(attempt, handler, stream=True)
+                except requests.exceptions.ConnectionError:
+                    if resumes >= max_resumes:
+                        raise
+                    resumes += 1
+                    self._instrumentation.count("download.resumes")
+                    continue
+                try:
+                    if offset and response.status_code == 416:
+                        if validator is not None:
+                            # Everything was already written.
+                            span.set(bytes=offset, resumes=resumes)
+                            return response
+                        # The resource may have changed (and shrunk) since
+                        #  the part written, so start over.
+                        _rewind(f, offset)
+                        offset = 0
+                        continue
+                    response.raise_for_status()
+                    if offset and _range_start(response) != offset:
+                        # The server sent the whole body (or a different
+                        #  part of it), so start again from the beginning.
+                        _rewind(f, offset)
+                        offset = 0
+                    etag = response.headers.get("ETag")
+                    if etag is not None and not etag.startswith("W/"):
+                        validator = etag
+                    else:
+                        validator = response.headers.get("Last-Modified")
+                    if not offset and keep_validator is not None:
+                        keep_validator(validator)
+
+                    for chunk in response.iter_content(chunk_size):
+                        f.write(chunk)
+                        offset += len(chunk)
+                    span.set(bytes=offset, resumes=resumes)
+                    return response
+                except (requests.exceptions.ChunkedEncodingError,
+                        requests.exceptions.ConnectionError):
+                    if resumes >= max_resumes:
+                        raise
+                    resumes += 1
+                    self._instrumentation.count("download.resumes")
+                finally:
+                    response.close()
+
+    def _record_response(self, response, *args, **kwargs):
+        """Report an HTTP request to the instrumentation (a response hook)."""
+        request = response.request
+        body = request.body
+        sent = len(body) if isinstance(body, (bytes, str)) else 0
+        try:
+            received = int(response.headers.get("Content-Length", 0))
+        except ValueError:
+            received = 0
+        _count_body(response.raw, self._instrumentation)
+        retries = getattr(response.raw, "retries", None)
+        self._record_http(
+            request.method,
+            request.url,
+            response.status_code,
+            sent,
+            received,
+            response.elapsed.total_seconds(),
+            len(retries.history) if retries is not None else 0,
+        )
+
+    def _login_once(self, handler, generation):
+        """
+        Log in using handler unless a login finished after generation.
+        """
+        with self._login_lock:
+            if generation != self._login_generation:
+                # Another request already logged in while this one was in
+                #  flight, so the caller only needs to retry.
+                return
+            # Only now, so that a request bounced with the old cookies
+            #  cannot end the session another thread just logged in to.
+            self._session_ended()
+            with self._shared_login():
+                if self._adopt_shared_cookies():
+                    # Another process logged in, possibly while this one
+                    #  waited for it to finish.
+                    self._login_generation += 1
+                    return
+                self._start_login()
+                with self._instrumentation.span("login"):
+                    self.login_with_handler(handler)
+                # Before the login is published or saved, so that the
+                #  services' cookies are too.
+                self.warm()
+                self._end_login()
+
+    def _shared_login(self):
+        """Return a lock held while logging in with shared cookies."""
+        if self._cookie_broker is None:
+            return nullcontext()
+        return self._cookie_broker.login_lock()
+
+    def _refresh_shared_cookies(self):
+        """Pick up a login published by another process."""
+        broker = self._cookie_broker
+        if broker is None or broker.generation() == self._broker_generation:
+            return
+        with self._login_lock:
+            # Counts as a login, so that requests sent with the old cookies
+            #  are retried with these instead of logging in again.
+            if self._adopt_shared_cookies():
+                self._login_generation += 1
+
     def login_with_handler(self, handler):
         """Performs regular and two-factor authentication using handler."""
         duo_choices = None
         credentials = None
+        remembered = None
         while not self.authenticated():
+            login_page = None
+            if self._pipelined:
+                # Load the page while the user enters their credentials.
+                login_page = self._prefetch_login_page()
             credentials = handler.get_credentials()
+            remembered = self._remembered_duo_choice(credentials["uniqname"])
+            # The Duo prompt is only needed to find a device to use.
+            fetch_choices = remembered is None and (
+                self._hotp is None or self._hotp.device is None
+            )
             try:
-                duo_choices = self.authenticate(
+                duo_choices = self._start_authenticate(
                     credentials["uniqname"],
-                    credentials["password"]
+                    credentials["password"],
+                    fetch_choices=fetch_choices,
+                    login_page=login_page,
                 )
             except ShibbolethError as err:
                 handler.show_credentials_error(err)
+                continue
+            self._principal = credentials["uniqname"]
+            # The Duo choices may still be loading in the background.
+            handler.on_two_factor_start(credentials)
+            duo_choices = duo_choices.result()
+
+        if self._hotp is not None and not self.two_factor_authenticated():
+            if self._try_hotp(duo_choices):
+                return
+
+        if remembered is not None and not self.two_factor_authenticated():
+            if self._try_remembered_duo_choice(
+                credentials["uniqname"], remembered
+            ):
+                return
+
+        if duo_choices is None and not self.two_factor_authenticated():
+            duo_choices = self._get_prompt_choices()
 
-        handler.on_two_factor_start(credentials)
         while not self.two_factor_authenticated():
             duo_data = handler.choose_duo(duo_choices)
             if not self.two_factor_authenticate(
@@ -348,3 +1283,145 @@ class ShibbolethSession:
                 duo_data["passcode"]
             ):
                 handler.on_two_factor_fail()
+            elif self._duo_choice_cache is not None:
+                self._duo_choice_cache.remember(
+                    credentials["uniqname"], duo_data["choice"]
+                )
+
+    def _try_hotp(self, duo_choices):
+        """
+        Perform 2FA with a passcode from the HOTP token. Returns whether it
+        succeeded.
+        """
+        device = self._hotp.device
+        if device is None:
+            device = next(
+                (choice["device"] for choice in duo_choices or ()
+                 if choice["factor"] == "Passcode"),
+                None
+            )
+            if device is None:
+                return False
+        self._instrumentation.count("duo.hotp")
+        try:
+            passcode = self._hotp.next_passcode()
+        except (OSError, ValueError) as err:
+            raise ShibbolethError(
+                f"The HOTP token cannot be used: {err}"
+            ) from err
+        choice = {
+            "device": device,
+            "factor": "Passcode",
+            "description": "Passcode from the HOTP token",
+        }
+        try:
+            return self.two_factor_authenticate(choice, passcode)
+        except _DuoChoiceRejected:
+            return False
+
+    def _remembered_duo_choice(self, uniqname):
+        if self._duo_choice_cache is None:
+            return None
+        return self._duo_choice_cache.get(uniqname)
+
+    def _try_remembered_duo_choice(self, uniqname, choice):
+        """
+        Perform 2FA with a remembered choice. Returns whether it succeeded.
+        """
+        self._instrumentation.count("duo.remembered_choice")
+        try:
+            return self.two_factor_authenticate(choice)
+        except _DuoChoiceRejected:
+            # The device was probably removed; ask again.
+            self._duo_choice_cache.forget(uniqname)
+            return False
+
+
+def _range_start(response):
+    """Return the first byte position of a 206 response, or 0."""
+    if response.status_code != 206:
+        return 0
+    match = re.match(
+        r"bytes\s+(\d+)-", response.headers.get("Content-Range", "")
+    )
+    return int(match.group(1)) if match else 0
+
+
+def _rewind(f, offset):
+    """Discard the last offset bytes written to f."""
+    try:
+        f.seek(f.tell() - offset)
+        f.truncate()
+    except (AttributeError, OSError) as err:
+        raise ShibbolethError(
+            "The download cannot be resumed and the destination cannot be "
+            "rewound."
+        ) from err
+
+
+def _read_validator(path):
+    """Return the validator kept in path, or None."""
+    try:
+        with open(path) as f:
+            return f.read() or None
+    except OSError:
+        return None
+
+
+def _write_validator(path, validator):
+    """Keep validator in path, or remove path if validator is None."""
+    try:
+        if validator is None:
+            os.remove(path)
+        else:
+            with atomic_write(path) as f:
+                f.write(validator)
+    except FileNotFoundError:
+        pass
+
+
+def _spool_body(prepped):
+    """
+    Make the body of prepped one that can be sent twice.
+
+    Strings, bytes and seekable files already are. Other streams, such as
+    generators and pipes, are copied into a SpooledTemporaryFile.
+    """
+    body = prepped.body
+    if body is None or isinstance(body, (bytes, str)):
+        return
+    if isinstance(prepped._body_position, int):
+        # requests noted where the file started, to rewind it on redirects.
+        return
+    spool = tempfile.SpooledTemporaryFile(max_size=_spool_size)
+    if hasattr(body, "read"):
+        shutil.copyfileobj(body, spool)
+    else:
+        for chunk in body:
+            spool.write(chunk.encode() if isinstance(chunk, str) else chunk)
+    length = spool.tell()
+    spool.seek(0)
+    prepped.body = spool
+    prepped._body_position = 0
+    prepped.headers.pop("Transfer-Encoding", None)
+    prepped.headers["Content-Length"] = str(length)
+
+
+def _count_body(raw, instrumentation):
+    """Count the bytes of the body of raw (a urllib3 response) as read."""
+    stream = getattr(raw, "stream", None)
+    if stream is None:
+        return
+
+    def counted_stream(*args, **kwargs):
+        for data in stream(*args, **kwargs):
+            instrumentation.count("http.bytes_received", len(data))
+            yield data
+
+    raw.stream = counted_stream
+
+
+def _completed(result):
+    future = Future()
+    future.set_result(result)
+    return future
@@ -0,0 +1,125 @@
+import json
+import time
+
+from .filelock import atomic_write
+
+
+class SessionLifetime:
+    """
+    Learns how long weblogin sessions last.
+
+    weblogin's cookies are usually session cookies with no expiry time, so
+    the lifetime is learned instead: each login is timed from when it
+    completed, and a session seen to have ended after t seconds means
+    sessions last at most t seconds, while one still working after t
+    seconds means they last at least that long.
+
+    A session can also end early, for instance when the user logs out
+    elsewhere, so an end seen well before the learned lifetime is only
+    believed once a second session has ended as early, and the lifetime
+    learned never drops below min_lifetime.
+
+    The login time, the uniqname logged in (the principal) and the lifetime
+    learned so far are kept next to the cookie file, in
+    <cookie file>.session, so that they carry over between processes using
+    the same cookies.
+    """
+
+    # The shortest lifetime that is learned, in seconds.
+    min_lifetime = 900.0
+    # Sessions ending before this fraction of the learned lifetime are
+    #  outliers until another one ends as early.
+    outlier_ratio = 0.5
+
+    def __init__(self, cookie_file_name, lifetime=None):
+        """
+        Track the session stored in cookie_file_name.
+
+        lifetime is an initial guess, used until one has been learned. If
+        cookie_file_name is None, nothing is stored.
+        """
+        self._path = None
+        self.started = None
+        self.lifetime = lifetime
+        self.principal = None
+        # The age of the last session that ended early, if the one before
+        #  it did not.
+        self._early_end = None
+        if cookie_file_name is None:
+            return
+        self._path = f"{cookie_file_name}.session"
+        try:
+            with open(self._path) as f:
+                record = json.load(f)
+            started = record.get("started")
+            lifetime = record.get("lifetime")
+            early_end = record.get("early_end")
+            principal = record.get("principal")
+            self.started = float(started) if started is not None else None
+            if lifetime is not None:
+                self.lifetime = max(float(lifetime), self.min_lifetime)
+            if early_end is not None:
+                self._early_end = float(early_end)
+            if isinstance(principal, str):
+                self.principal = principal
+        except (OSError, ValueError, AttributeError, TypeError):
+            pass
+
+    def expiry(self):
+        """Return when the current session is expected to end, if known."""
+        if self.started is None or self.lifetime is None:
+            return None
+        return self.started + self.lifetime
+
+    def logged_in(self, principal=None):
+        """Record that a login (as principal, if known) just completed."""
+        self.started = time.time()
+        if principal is not None:
+            self.principal = principal
+        self._save()
+
+    def alive(self):
+        """Record that the current session was just seen to still work."""
+        if self.started is None:
+            return
+        age = time.time() - self.started
+        if self.lifetime is not None and age > self.lifetime:
+            self.lifetime = age
+            self._early_end = None
+            self._save()
+
+    def ended(self):
+        """Record that the current session was just seen to have ended."""
+        if self.started is None:
+            return
+        age = time.time() - self.started
+        if self.lifetime is None:
+            self.lifetime = max(age, self.min_lifetime)
+        elif age < self.lifetime * self.outlier_ratio:
+            if self._early_end is None:
+                self._early_end = age
+            else:
+                # Ended early twice in a row, so the lifetime really is
+                #  shorter.
+                self.lifetime = max(age, self._early_end, self.min_lifetime)
+                self._early_end = None
+        else:
+            self.lifetime = max(min(age, self.lifetime), self.min_lifetime)
+            self._early_end = None
+        self.started = None
+        self._save()
+
+    def _save(self):
+        if self._path is None:
+            return
+        record = {
+            "started": self.started,
+            "lifetime": self.lifetime,
+            "early_end": self._early_end,
+            "principal": self.principal,
+        }
+        try:
+            with atomic_write(self._path) as f:
+                json.dump(record, f)
+        except OSError:
+            pass
@@ -0,0 +1,119 @@
+import threading
+import time
+
+
+class PollSchedule:
+    """
+    Decides when to send each Duo status request.
+
+    The first request is sent after first_delay seconds. Each later delay is
+    multiplied by backoff, up to max_delay. Polling stops once deadline
+    seconds have passed since start(), or once cancel() is called (possibly
+    from another thread) after the last reset(). In long-poll mode the
+    server is expected to hold each status request open, so requests are
+    sent back to back.
+    """
+
+    # The shortest timeout given to a status request (see request_timeout).
+    min_request_timeout = 1.0
+
+    def __init__(self, first_delay=0.5, backoff=1.5, max_delay=2.0,
+                 deadline=120.0, long_poll=False):
+        self.first_delay = first_delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.long_poll = long_poll
+
+        self._cancelled = threading.Event()
+        self._started = None
+        self._delay = first_delay
+
+    def copy(self):
+        """Return a new schedule with the same settings."""
+        return PollSchedule(
+            first_delay=self.first_delay,
+            backoff=self.backoff,
+            max_delay=self.max_delay,
+            deadline=self.deadline,
+            long_poll=self.long_poll,
+        )
+
+    def reset(self):
+        """
+        Forget a cancel() from an earlier round. Called before a round's
+        prompt is sent, so that a cancel() arriving while it is sent still
+        stops the polling that follows.
+        """
+        self._cancelled.clear()
+
+    def start(self):
+        """Start a new round of polling."""
+        self._started = time.monotonic()
+        self._delay = self.first_delay
+
+    def cancel(self):
+        """Stop the current round of polling as soon as possible."""
+        self._cancelled.set()
+
+    def cancelled(self):
+        """Return whether cancel() was called since the last reset()."""
+        return self._cancelled.is_set()
+
+    def remaining(self):
+        """Return the seconds left before the deadline, or None if unset."""
+        if self.deadline is None:
+            return None
+        if self._started is None:
+            return self.deadline
+        return max(0.0, self.deadline - (time.monotonic() - self._started))
+
+    def expired(self):
+        """Return whether the deadline has passed."""
+        return self.remaining() == 0.0
+
+    def request_timeout(self, connect_timeout):
+        """
+        Return the (connect, read) timeout for the next status request, or
+        None if unset.
+
+        The read timeout is the time left before the deadline, but at least
+        min_request_timeout, so that a request sent just before the
+        deadline can still be answered. The connect timeout is passed
+        through unchanged.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return None
+        return (connect_timeout, max(remaining, self.min_request_timeout))
+
+    def next_delay(self):
+        """
+        Return how many seconds to wait before the next status request.
+
+        Returns None if polling should stop instead, because the deadline
+        has passed or polling was cancelled. Used by callers that cannot
+        block in wait(), such as asyncio code.
+        """
+        if self.cancelled():
+            return None
+        delay = 0.0 if self.long_poll else self._delay
+        remaining = self.remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                return None
+            delay = min(delay, remaining)
+        self._delay = min(self._delay * self.backoff, self.max_delay)
+        return delay
+
+    def wait(self):
+        """
+        Wait until the next status request should be sent.
+
+        Returns False if polling should stop instead, because the deadline
+        has passed or polling was cancelled.
+        """
+        delay = self.next_delay()
+        if delay is None:
+            return False
+        return not self._cancelled.wait(delay)
@@ -0,0 +1,271 @@
+"""
+Many Shibboleth identities served from one process.
+
+A SessionPool holds one ShibbolethSession per identity, each with its own
+cookie file and jar, on top of a single Transport (so every identity uses
+the same keep-alive connections to weblogin, Duo and services) and a single
+thread pool. Sessions are created when an identity is first used and
+dropped again by release(), so memory and sockets grow with the number of
+active identities rather than with the number of registered ones.
+
+Identities are logged in by their own handler, which has the same methods as
+the handlers passed to ShibbolethSession.perform. Service accounts will
+usually want a handler that returns stored credentials and picks a Duo
+factor without prompting.
+"""
+
+import heapq
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+from .library import ShibbolethSession
+from .transport import Transport
+
+logger = logging.getLogger(__name__)
+
+
+class SessionPool:
+    def __init__(self, max_workers=8, check_interval=None, transport=None,
+                 **session_options):
+        """
+        Create an empty pool.
+
+        max_workers is the number of requests (across all identities) that
+        run at once. If check_interval is given, each active identity is
+        checked against weblogin that many seconds after its last check or
+        login, and logged in again if its session has expired; call start()
+        to begin checking. session_options are passed to every
+        ShibbolethSession the pool creates.
+        """
+        self._transport = transport or Transport()
+        self._check_interval = check_interval
+        self._session_options = session_options
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="shibboleth-pool",
+        )
+        # Login pipelining waits on this pool from inside perform(), so it
+        #  must not share workers with the requests themselves.
+        self._background = ThreadPoolExecutor(
+            max_workers=4,
+            thread_name_prefix="shibboleth-login",
+        )
+        self._identities = {}
+        self._lock = threading.Lock()
+        self._schedule = []
+        self._wakeup = threading.Condition(self._lock)
+        self._scheduler = None
+        self._stopped = False
+
+    def add(self, identity, cookie_file, handler):
+        """
+        Register identity, stored in cookie_file and logged in by handler.
+
+        No session is created until the identity is first used.
+        """
+        with self._lock:
+            if identity in self._identities:
+                raise ValueError(f"Identity {identity!r} is already added.")
+            self._identities[identity] = _Identity(cookie_file, handler)
+
+    def remove(self, identity):
+        """Release identity and forget it."""
+        self.release(identity)
+        with self._lock:
+            del self._identities[identity]
+
+    def identities(self):
+        """Return the registered identities."""
+        with self._lock:
+            return list(self._identities)
+
+    def active(self):
+        """Return the identities that currently have a session."""
+        with self._lock:
+            return [
+                identity
+                for identity, entry in self._identities.items()
+                if entry.session is not None
+            ]
+
+    def session(self, identity):
+        """Return the session for identity, creating it if needed."""
+        with self._lock:
+            return self._session(identity)
+
+    def release(self, identity):
+        """
+        Save the cookies of identity and drop its session.
+
+        The session is created again from the cookie file the next time the
+        identity is used.
+        """
+        with self._lock:
+            entry = self._entry(identity)
+            session = entry.session
+            entry.session = None
+        if session is not None:
+            session.save_cookies()
+
+    def perform(self, identity, request):
+        """
+        Perform request as identity, logging it in first if needed.
+
+        Cookies are saved after a login; otherwise they are saved by save(),
+        release() and close().
+        """
+        session, handler = self._session_and_handler(identity)
+        logins = session.login_count()
+        response = session.perform(request, handler)
+        if session.login_count() != logins:
+            session.save_cookies()
+            self._reschedule(identity)
+        return response
+
+    def perform_many(self, requests):
+        """
+        Perform (identity, request) pairs concurrently.
+
+        Returns the responses in the same order. Each identity is logged in
+        at most once, however many of its requests need it.
+        """
+        return list(self._executor.map(
+            lambda item: self.perform(*item),
+            requests
+        ))
+
+    def check(self, identity):
+        """
+        Check identity against weblogin, logging it in again if needed.
+
+        Returns whether a login was performed.
+        """
+        session, handler = self._session_and_handler(identity)
+        logged_in = session.ensure_authenticated(handler)
+        session.save_cookies()
+        self._reschedule(identity)
+        return logged_in
+
+    def save(self):
+        """Save the cookies of every active identity."""
+        with self._lock:
+            sessions = [
+                entry.session
+                for entry in self._identities.values()
+                if entry.session is not None
+            ]
+        for session in sessions:
+            session.save_cookies()
+
+    def start(self):
+        """Start checking active identities every check_interval seconds."""
+        if self._check_interval is None:
+            raise ValueError("The pool was created without a check_interval.")
+        with self._lock:
+            if self._scheduler is not None:
+                return
+            self._scheduler = threading.Thread(
+                target=self._schedule_loop,
+                name="shibboleth-pool-scheduler",
+                daemon=True,
+            )
+        self._scheduler.start()
+
+    def close(self):
+        """Stop checking identities, wait for requests and save cookies."""
+        with self._lock:
+            self._stopped = True
+            self._wakeup.notify_all()
+            scheduler = self._scheduler
+        if scheduler is not None:
+            scheduler.join()
+        self._executor.shutdown()
+        self._background.shutdown()
+        self.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _entry(self, identity):
+        try:
+            return self._identities[identity]
+        except KeyError:
+            raise ValueError(f"Unknown identity {identity!r}.") from None
+
+    def _session_and_handler(self, identity):
+        with self._lock:
+            return self._session(identity), self._entry(identity).handler
+
+    def _session(self, identity):
+        # Must be called with the lock held.
+        entry = self._entry(identity)
+        if entry.session is None:
+            entry.session = ShibbolethSession(
+                entry.cookie_file,
+                transport=self._transport,
+                executor=self._background,
+                **self._session_options
+            )
+            self._push(identity, entry)
+        return entry.session
+
+    def _reschedule(self, identity, unscheduled_only=False):
+        with self._lock:
+            entry = self._identities.get(identity)
+            if entry is None or entry.session is None:
+                return
+            if not unscheduled_only or entry.next_check is None:
+                self._push(identity, entry)
+
+    def _push(self, identity, entry):
+        # Must be called with the lock held. Older schedule entries for the
+        #  identity are skipped when they come due, since their time no
+        #  longer matches the identity's next_check.
+        if self._check_interval is None:
+            return
+        entry.next_check = monotonic() + self._check_interval
+        heapq.heappush(self._schedule, (entry.next_check, identity))
+        self._wakeup.notify()
+
+    def _schedule_loop(self):
+        with self._lock:
+            while not self._stopped:
+                if not self._schedule:
+                    self._wakeup.wait()
+                    continue
+                due, identity = self._schedule[0]
+                delay = due - monotonic()
+                if delay > 0:
+                    self._wakeup.wait(delay)
+                    continue
+                heapq.heappop(self._schedule)
+                entry = self._identities.get(identity)
+                if (entry is None or entry.session is None or
+                        entry.next_check != due):
+                    continue
+                # Not due again until this check reschedules it.
+                entry.next_check = None
+                self._executor.submit(self._scheduled_check, identity)
+
+    def _scheduled_check(self, identity):
+        try:
+            self.check(identity)
+        except Exception:
+            logger.exception("Checking identity %r failed.", identity)
+        finally:
+            # Unless check() got as far as rescheduling it, try again after
+            #  another interval.
+            self._reschedule(identity, unscheduled_only=True)
+
+
+class _Identity:
+    def __init__(self, cookie_file, handler):
+        self.cookie_file = cookie_file
+        self.handler = handler
+        self.session = None
+        self.next_check = None
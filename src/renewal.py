@@ -0,0 +1,170 @@
+"""
+Renewing weblogin sessions before they expire.
+
+Without renewal, a session is only logged in again once a request is
+bounced to weblogin, and that request (and every other one bounced while
+the login runs) waits for the password and Duo steps. A Renewer instead
+logs in again in the background shortly before the session is expected
+to end, using ShibbolethSession.renew so that requests are never held up.
+
+When the session will end is taken from the expiry times of the weblogin
+cookies or, since those are usually session cookies, from the session
+lifetime learned from earlier logins (see SessionLifetime).
+"""
+
+import threading
+import time
+
+
+class CachedCredentials:
+    """
+    A login handler that remembers the answers of another handler.
+
+    The credentials and Duo choice given for the first login are reused for
+    later ones, so that background renewals only need the user to approve
+    a push or answer a call. Passcodes are never reused. Credentials are only
+    kept in memory, and are forgotten when they are rejected.
+    """
+
+    def __init__(self, handler):
+        self._handler = handler
+        self._credentials = None
+        self._duo_choice = None
+
+    def get_credentials(self):
+        if self._credentials is None:
+            self._credentials = self._handler.get_credentials()
+        return self._credentials
+
+    def show_credentials_error(self, error):
+        self._credentials = None
+        self._handler.show_credentials_error(error)
+
+    def on_two_factor_start(self, credentials):
+        self._handler.on_two_factor_start(credentials)
+
+    def on_two_factor_fail(self):
+        self._duo_choice = None
+        self._handler.on_two_factor_fail()
+
+    def choose_duo(self, duo_choices):
+        if self._duo_choice is not None:
+            for choice in duo_choices:
+                if (choice["device"] == self._duo_choice["device"] and
+                        choice["factor"] == self._duo_choice["factor"]):
+                    return {"choice": choice, "passcode": None}
+        duo_data = self._handler.choose_duo(duo_choices)
+        if duo_data["choice"]["factor"] not in ("Passcode", "sms"):
+            self._duo_choice = duo_data["choice"]
+        return duo_data
+
+
+class Renewer:
+    def __init__(self, session, handler, margin=300.0, lifetime=None,
+                 retry_interval=60.0, max_retry_interval=3600.0, save=True):
+        """
+        Renew session using handler, margin seconds before it would expire.
+
+        lifetime is the session lifetime to assume until one has been
+        learned. While neither it nor any cookie expiry time is known, the
+        session is not renewed in advance. Failed renewals are tried again
+        after retry_interval seconds, which is also the shortest time between
+        two renewals. Each renewal in a row that fails, or that leaves the
+        session due for renewal again (so that the user is not asked to
+        approve a push every retry_interval), doubles that wait, up to
+        max_retry_interval seconds. If save is true, the cookies are saved
+        after every renewal.
+        """
+        self._session = session
+        self._handler = handler
+        self._margin = margin
+        self._lifetime = lifetime
+        self._retry_interval = retry_interval
+        self._max_retry_interval = max_retry_interval
+        self._save = save
+        self._stopped = threading.Event()
+        self._thread = None
+        self.renewals = 0
+        self.failures = 0
+        self.last_error = None
+
+    def due(self):
+        """
+        Return the time at which the session should be renewed.
+
+        Returns None if it is not known when the session will expire.
+        """
+        expiry = self._session.session_expiry(self._lifetime)
+        if expiry is None:
+            return None
+        return expiry - self._margin
+
+    def renew(self):
+        """Renew the session now."""
+        self._session.renew(self._handler)
+        if self._save:
+            self._session.save_cookies()
+        self.renewals += 1
+
+    def start(self):
+        """Start renewing the session in a background thread."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="shibboleth-renewer",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop renewing, waiting for a renewal in progress to finish."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _run(self):
+        delay = 0.0
+        while not self._stopped.wait(delay):
+            due = self.due()
+            if due is None:
+                # The expiry may become known once the session is used.
+                delay = self._retry_interval
+                continue
+            delay = due - time.time()
+            if delay > 0:
+                # Wake up at least every retry_interval, in case the session
+                #  was logged in again by a request in the meantime.
+                delay = min(delay, self._retry_interval)
+                continue
+            try:
+                self.renew()
+                self.last_error = None
+            except Exception as err:
+                # Not fatal: a request bounced to weblogin still logs in as
+                #  usual.
+                self.last_error = err
+                self.failures += 1
+            else:
+                due = self.due()
+                if due is not None and due <= time.time():
+                    self.failures += 1
+                else:
+                    self.failures = 0
+            delay = self._retry_delay()
+
+    def _retry_delay(self):
+        """Return how long to wait after the last renewal."""
+        if not self.failures:
+            return self._retry_interval
+        return min(self._retry_interval * 2 ** (self.failures - 1),
+                   self._max_retry_interval)
@@ -0,0 +1,179 @@
+from http.cookiejar import CookieJar
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.sessions import merge_hooks, merge_setting
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_netrc_auth, rewind_body
+from urllib3.util.retry import Retry
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter that applies a default timeout to every request."""
+
+    def __init__(self, timeout=None, **kwargs):
+        self._timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self._timeout
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+class Transport:
+    """
+    Connection pooling, timeout and retry settings for HTTP requests.
+
+    One adapter is created per Transport, so every session it is mounted on
+    shares the same keep-alive connection pools. pool_connections is the
+    number of hosts to keep pools for (weblogin and Duo at minimum) and
+    pool_maxsize is the number of connections kept open to each host.
+    Only idempotent requests are retried after the server has received
+    them; connection failures are retried for every method.
+    """
+
+    def __init__(self, pool_connections=4, pool_maxsize=16,
+                 connect_timeout=10.0, read_timeout=30.0, retries=2,
+                 backoff_factor=0.3):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._adapter = None
+        self._async_transport = None
+
+    def timeout(self):
+        """Return the default (connect, read) timeout for requests."""
+        return (self.connect_timeout, self.read_timeout)
+
+    def retry(self):
+        """Return the urllib3 retry policy for requests."""
+        return Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,
+        )
+
+    def adapter(self):
+        """Return the adapter shared by all sessions using this transport."""
+        if self._adapter is None:
+            self._adapter = TimeoutHTTPAdapter(
+                timeout=self.timeout(),
+                pool_connections=self.pool_connections,
+                pool_maxsize=self.pool_maxsize,
+                max_retries=self.retry(),
+            )
+        return self._adapter
+
+    def async_transport(self):
+        """
+        Return the httpx transport shared by all async sessions using this.
+
+        httpx only retries requests that fail to connect, and limits the
+        connections kept alive in total rather than per host.
+        """
+        if self._async_transport is None:
+            import httpx
+
+            self._async_transport = httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(
+                    max_connections=None,
+                    max_keepalive_connections=(
+                        self.pool_connections * self.pool_maxsize
+                    ),
+                ),
+                retries=self.retries,
+            )
+        return self._async_transport
+
+    def mount(self, session):
+        """Use this transport for all HTTP(S) requests made by session."""
+        adapter = self.adapter()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+
+class JarSession(requests.Session):
+    """
+    A requests Session that shares its cookie jar with prepared requests.
+
+    requests normally copies every cookie in the session jar into each
+    prepared request, and copies that jar again on every redirect. This
+    session attaches a view of the session jar instead, so only the cookies
+    matching each URL are looked at.
+    """
+
+    def prepare_request(self, request):
+        if request.cookies:
+            return super().prepare_request(request)
+
+        auth = request.auth
+        if self.trust_env and not auth and not self.auth:
+            auth = get_netrc_auth(request.url)
+
+        prepped = requests.PreparedRequest()
+        prepped.prepare(
+            method=request.method.upper(),
+            url=request.url,
+            files=request.files,
+            data=request.data,
+            json=request.json,
+            headers=merge_setting(
+                request.headers, self.headers, dict_class=CaseInsensitiveDict
+            ),
+            params=merge_setting(request.params, self.params),
+            auth=merge_setting(auth, self.auth),
+            cookies=_JarView(self.cookies),
+            hooks=merge_hooks(request.hooks, self.hooks),
+        )
+        return prepped
+
+    def prepare_replay(self, prepped):
+        """
+        Return a copy of prepped to send again, with the current cookies.
+
+        A file body is rewound to where it started.
+        """
+        replay = prepped.copy()
+        replay.headers.pop("Cookie", None)
+        replay.prepare_cookies(_JarView(self.cookies))
+        if replay.body is not None and hasattr(replay.body, "read"):
+            rewind_body(replay)
+        return replay
+
+
+class _JarView(CookieJar):
+    """Forwards the cookie operations requests performs to another jar."""
+
+    def __init__(self, jar):
+        super().__init__()
+        self._jar = jar
+
+    def add_cookie_header(self, request):
+        self._jar.add_cookie_header(request)
+
+    def extract_cookies(self, response, request):
+        self._jar.extract_cookies(response, request)
+
+    def set_cookie(self, cookie):
+        self._jar.set_cookie(cookie)
+
+    def update(self, other):
+        if other is self._jar or other is self:
+            return
+        for cookie in other:
+            self._jar.set_cookie(cookie)
+
+    def copy(self):
+        return _JarView(self._jar)
+
+    def __iter__(self):
+        return iter(self._jar)
+
+    def __len__(self):
+        return len(self._jar)
@@ -0,0 +1,93 @@
+import json
+import os
+import time
+
+from .cookiepack import file_stamp
+from .filelock import atomic_write
+
+
+class ValidityCache:
+    """
+    Remembers when the cookies in a cookie file were last verified.
+
+    The record is kept next to the cookie file, in <cookie file>.valid. It
+    holds the time of the last successful check against weblogin, the
+    earliest expiry time of the weblogin cookies at that point and the
+    version of the cookie file holding them (see cookiepack.file_stamp).
+    The cookies are assumed to still be valid until either ttl seconds have
+    passed or one of those cookies has expired, whichever comes first, and
+    only while the cookie file is the version that was recorded.
+    """
+
+    def __init__(self, cookie_file_name, ttl=300.0):
+        self.ttl = ttl
+        self._cookie_file_name = cookie_file_name
+        self._path = f"{cookie_file_name}.valid"
+
+    def fresh(self):
+        """Return whether the last verification can still be trusted."""
+        record = self._load()
+        if record is None:
+            return False
+        try:
+            verified = float(record["verified"])
+            expires = record.get("expires")
+            stamp = file_stamp(os.stat(self._cookie_file_name))
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        if record.get("stamp") != list(stamp):
+            # Changed by something other than the session that verified it.
+            return False
+
+        now = time.time()
+        if not verified <= now < verified + self.ttl:
+            return False
+        return expires is None or now < expires
+
+    def record(self, expires=None):
+        """Record that the cookies were verified just now."""
+        self._write({
+            "verified": time.time(),
+            "expires": expires,
+        })
+
+    def saved(self):
+        """
+        Record that the cookies verified were just saved to the cookie file,
+        so that the new version of the file is trusted too.
+        """
+        record = self._load()
+        try:
+            verified = float(record["verified"])
+        except (ValueError, KeyError, TypeError):
+            return
+        if verified + self.ttl > time.time():
+            self._write(record)
+
+    def invalidate(self):
+        """Forget the last verification."""
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return record if isinstance(record, dict) else None
+
+    def _write(self, record):
+        try:
+            record["stamp"] = list(file_stamp(
+                os.stat(self._cookie_file_name)
+            ))
+        except OSError:
+            record["stamp"] = None
+        try:
+            with atomic_write(self._path) as f:
+                json.dump(record, f)
+        except OSError:
+            pass
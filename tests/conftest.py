@@ -0,0 +1,15 @@
+import pytest
+
+from benchmarks.mock_server import MockShibboleth
+
+
+@pytest.fixture
+def mock():
+    """A mock weblogin, Duo and service provider that approves pushes."""
+    with MockShibboleth(push_delay=0) as mock:
+        yield mock
+
+
+@pytest.fixture
+def cookie_file(tmp_path):
+    return str(tmp_path / "cookies.tmp")
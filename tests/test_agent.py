@@ -0,0 +1,100 @@
+import logging
+import os
+import threading
+import time
+
+import pytest
+import requests
+
+from benchmarks.mock_server import ScriptedHandler
+from src.agent import Agent, AgentClient
+from src.library import ShibbolethError, ShibbolethSession
+
+
+@pytest.fixture
+def agent(tmp_path, mock):
+    socket_path = str(tmp_path / "agent.sock")
+    agent = Agent(socket_path, refresh_interval=3600,
+                  weblogin_host=mock.url)
+    thread = threading.Thread(target=agent.serve_forever, daemon=True)
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.01)
+    yield agent, AgentClient(socket_path, timeout=10)
+    agent.shutdown()
+    thread.join()
+
+
+def log_in(mock, cookie_file):
+    session = ShibbolethSession(cookie_file, weblogin_host=mock.url)
+    session.perform(requests.Request("GET", f"{mock.url}/sp/page"),
+                    ScriptedHandler())
+    session.save_cookies()
+
+
+def test_socket_is_private(agent):
+    _, client = agent
+    assert os.stat(client._socket_path).st_mode & 0o077 == 0
+
+
+def test_perform_and_cookies(agent, mock, cookie_file):
+    _, client = agent
+    log_in(mock, cookie_file)
+    result = client.perform(cookie_file, "GET", f"{mock.url}/sp/page")
+    assert result["status"] == 200
+    assert result["body"] == mock.sp_body
+    assert client.cookies(cookie_file).startswith("# Netscape HTTP Cookie")
+    assert client.status() == {
+        os.path.realpath(cookie_file): {
+            "authenticated": None, "last_refresh": None,
+        },
+    }
+
+
+def test_perform_without_login_fails(agent, mock, cookie_file):
+    _, client = agent
+    with pytest.raises(ShibbolethError, match="not logged in"):
+        client.perform(cookie_file, "GET", f"{mock.url}/sp/page")
+
+
+def test_refresh_picks_up_new_login(agent, mock, cookie_file):
+    agent, client = agent
+    agent.session(cookie_file)
+    agent.refresh()
+    assert not client.status()[os.path.realpath(cookie_file)][
+        "authenticated"
+    ]
+
+    log_in(mock, cookie_file)
+    agent.refresh()
+    state = client.status()[os.path.realpath(cookie_file)]
+    assert state["authenticated"]
+    assert state["last_refresh"] is not None
+
+
+def test_refresh_survives_broken_sessions(agent, mock, cookie_file):
+    agent, client = agent
+
+    class Broken:
+        def check_already_authenticated(self):
+            raise RuntimeError("broken")
+
+    agent.session(cookie_file)
+    agent._sessions[os.path.realpath(cookie_file)].session = Broken()
+    log_in(mock, f"{cookie_file}.2")
+    agent.session(f"{cookie_file}.2")
+    agent.refresh()
+    status = client.status()
+    assert status[os.path.realpath(cookie_file)]["authenticated"] is False
+    assert status[os.path.realpath(f"{cookie_file}.2")]["authenticated"]
+
+
+def test_requests_are_logged_at_debug_level(agent, caplog, capfd):
+    _, client = agent
+    with caplog.at_level(logging.DEBUG, logger="src.agent"):
+        client.status()
+    assert any("GET /status" in record.getMessage()
+               for record in caplog.records)
+    assert "GET /status" not in capfd.readouterr().err
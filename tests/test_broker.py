@@ -0,0 +1,124 @@
+import requests
+
+from benchmarks.mock_server import ScriptedHandler
+from src.broker import CookieBroker
+from src.cURLCookieJar import cURLCookieJar
+from src.library import ShibbolethSession
+
+ENTRIES = {
+    ".example.com": [
+        (".example.com", "TRUE", "/", "TRUE", "2000000000", "a", "1", False),
+    ],
+}
+
+
+class NoLoginHandler(ScriptedHandler):
+    def get_credentials(self):
+        raise AssertionError("Logged in instead of using shared cookies.")
+
+
+def test_generation_counts_publishes(cookie_file):
+    broker = CookieBroker(cookie_file)
+    assert broker.generation() == 0
+    assert broker.read() == (0, None, None)
+    assert broker.publish(ENTRIES) == 1
+    assert broker.publish({}) == 2
+    assert broker.generation() == 2
+    assert CookieBroker(cookie_file).read() == (2, {}, (0, 0, 0))
+
+
+def test_read_sees_latest_publish(cookie_file):
+    reader = CookieBroker(cookie_file)
+    writer = CookieBroker(cookie_file)
+    writer.publish(ENTRIES)
+    assert reader.read()[:2] == (1, ENTRIES)
+    # Larger than the initial mapping, so the reader has to remap.
+    large = {
+        f"host{i}.example.com": [
+            (f"host{i}.example.com", "FALSE", "/", "FALSE", "0", "n",
+             "v" * 100, False),
+        ]
+        for i in range(1000)
+    }
+    writer.publish(large)
+    assert reader.read()[:2] == (2, large)
+
+
+def test_stamp_follows_the_cookie_file(cookie_file):
+    broker = CookieBroker(cookie_file)
+    generation = broker.publish(ENTRIES)
+    with open(cookie_file, "w") as f:
+        f.write("# Netscape HTTP Cookie File\n")
+    assert broker.read()[2] != broker.file_stamp()
+    broker.restamp(generation)
+    assert broker.read()[2] == broker.file_stamp()
+    # Only the latest publish is restamped.
+    broker.publish({})
+    with open(cookie_file, "a") as f:
+        f.write("\n")
+    broker.restamp(generation)
+    assert broker.read()[2] != broker.file_stamp()
+
+
+def test_adopting_twice_does_not_duplicate(cookie_file):
+    jar = cURLCookieJar(cookie_file)
+    jar.load_entries(ENTRIES, replace=True)
+    jar.load_entries(ENTRIES, replace=True)
+    assert sum(len(cookies) for cookies in jar.entries().values()) == 1
+
+
+def test_adopting_drops_unpublished_domains(cookie_file):
+    jar = cURLCookieJar(cookie_file)
+    jar.load_entries({
+        "old.example.com": [
+            ("old.example.com", "FALSE", "/", "FALSE", "2000000000", "o",
+             "1", False),
+        ],
+    })
+    jar.load_entries(ENTRIES, replace=True)
+    assert list(jar.entries()) == [".example.com"]
+
+
+def test_session_adopts_published_login(mock, cookie_file):
+    first = ShibbolethSession(cookie_file, weblogin_host=mock.url,
+                              share_cookies=True)
+    first.perform(requests.Request("GET", f"{mock.url}/sp/a"),
+                  ScriptedHandler())
+    assert first.login_count() == 1
+
+    second = ShibbolethSession(cookie_file, weblogin_host=mock.url,
+                               share_cookies=True)
+    response = second.perform(requests.Request("GET", f"{mock.url}/sp/a"),
+                              NoLoginHandler())
+    assert response.status_code == 200
+    assert response.content == mock.sp_body
+
+    # A later login by the first session is picked up too.
+    mock.expire_sessions()
+    first.perform(requests.Request("GET", f"{mock.url}/sp/b"),
+                  ScriptedHandler())
+    assert first.login_count() == 2
+    response = second.perform(requests.Request("GET", f"{mock.url}/sp/b"),
+                              NoLoginHandler())
+    assert response.status_code == 200
+
+
+def test_newer_cookie_file_wins_over_shared_cookies(mock, cookie_file):
+    shared = ShibbolethSession(cookie_file, weblogin_host=mock.url,
+                               share_cookies=True)
+    shared.perform(requests.Request("GET", f"{mock.url}/sp/a"),
+                   ScriptedHandler())
+    shared.save_cookies()
+
+    # Logged in again by a process that does not share its cookies.
+    mock.expire_sessions()
+    unshared = ShibbolethSession(cookie_file, weblogin_host=mock.url)
+    unshared.perform(requests.Request("GET", f"{mock.url}/sp/a"),
+                     ScriptedHandler())
+    unshared.save_cookies()
+
+    session = ShibbolethSession(cookie_file, weblogin_host=mock.url,
+                                share_cookies=True)
+    response = session.perform(requests.Request("GET", f"{mock.url}/sp/a"),
+                               NoLoginHandler())
+    assert response.content == mock.sp_body
@@ -0,0 +1,148 @@
+import time
+import urllib.request
+from http.cookiejar import Cookie
+
+import pytest
+
+from src.cURLCookieJar import cURLCookieJar
+
+
+def make_cookie(domain, name, value, expires=None):
+    if expires is None:
+        expires = int(time.time()) + 3600
+    return Cookie(
+        0, name, value, None, False, domain, domain.startswith("."),
+        domain.startswith("."), "/", True, True, expires, False, None, None,
+        {"HTTPOnly": None},
+    )
+
+
+def values(cookie_file):
+    jar = cURLCookieJar(cookie_file)
+    jar.load()
+    return {(c.domain, c.name): c.value for c in jar}
+
+
+def request(url):
+    return urllib.request.Request(url)
+
+
+@pytest.mark.parametrize("binary_cache", [False, True])
+def test_merge_keeps_cookies_saved_by_others(cookie_file, binary_cache):
+    first = cURLCookieJar(cookie_file, binary_cache=binary_cache)
+    second = cURLCookieJar(cookie_file, binary_cache=binary_cache)
+    first.set_cookie(make_cookie(".a.com", "a", "1"))
+    first.set_cookie(make_cookie(".b.com", "b", "1"))
+    first.save(merge=True)
+
+    second.set_cookie(make_cookie(".a.com", "a", "2"))
+    second.set_cookie(make_cookie("c.com", "c", "1"))
+    second.save(merge=True)
+
+    assert values(cookie_file) == {
+        (".a.com", "a"): "2",
+        (".b.com", "b"): "1",
+        ("c.com", "c"): "1",
+    }
+
+
+def test_merge_removes_cleared_cookies(cookie_file):
+    jar = cURLCookieJar(cookie_file)
+    jar.set_cookie(make_cookie(".a.com", "a", "1"))
+    jar.set_cookie(make_cookie(".a.com", "keep", "1"))
+    jar.save(merge=True)
+
+    jar = cURLCookieJar(cookie_file)
+    jar.load()
+    jar.clear(".a.com", "/", "a")
+    jar.save(merge=True)
+    assert values(cookie_file) == {(".a.com", "keep"): "1"}
+
+
+def test_merge_copies_other_domains_unchanged(cookie_file):
+    jar = cURLCookieJar(cookie_file)
+    jar.set_cookie(make_cookie(".a.com", "a", "1"))
+    jar.set_cookie(make_cookie(".b.com", "b", "1"))
+    jar.save()
+    with open(cookie_file) as f:
+        before = [line for line in f if ".b.com" in line]
+
+    jar.set_cookie(make_cookie(".a.com", "a", "2"))
+    jar.save(merge=True)
+    with open(cookie_file) as f:
+        after = [line for line in f if ".b.com" in line]
+    # Still marked HttpOnly.
+    assert after == before
+    assert before[0].startswith("#HttpOnly_")
+
+
+def test_domains_are_parsed_when_first_used(cookie_file):
+    jar = cURLCookieJar(cookie_file)
+    for i in range(3):
+        jar.set_cookie(make_cookie(f"host{i}.example.com", "n", str(i)))
+    jar.save()
+
+    jar = cURLCookieJar(cookie_file)
+    jar.load()
+    assert set(jar._pending) == {
+        "host0.example.com", "host1.example.com", "host2.example.com",
+    }
+    req = request("https://host1.example.com/")
+    jar.add_cookie_header(req)
+    assert req.get_header("Cookie") == "n=1"
+    assert "host1.example.com" not in jar._pending
+    assert "host0.example.com" in jar._pending
+
+    # Unused domains are saved as they were loaded.
+    jar.save()
+    assert values(cookie_file) == {
+        ("host0.example.com", "n"): "0",
+        ("host1.example.com", "n"): "1",
+        ("host2.example.com", "n"): "2",
+    }
+    assert len(list(jar)) == 3
+    assert not jar._pending
+
+
+def test_cookie_header_per_host(cookie_file):
+    jar = cURLCookieJar(cookie_file)
+    jar.set_cookie(make_cookie(".example.com", "shared", "1"))
+    jar.set_cookie(make_cookie("a.example.com", "a", "1"))
+    jar.set_cookie(make_cookie("b.example.com", "b", "1"))
+    cookie = make_cookie("a.example.com", "deep", "1")
+    cookie.path = "/deep"
+    jar.set_cookie(cookie)
+
+    def header(url):
+        req = request(url)
+        jar.add_cookie_header(req)
+        return req.get_header("Cookie")
+
+    assert header("https://a.example.com/") == "a=1; shared=1"
+    # Served from the host's cache, which still checks the paths.
+    assert header("https://a.example.com/deep/x") == "deep=1; a=1; shared=1"
+    # Every cookie here is secure.
+    assert header("http://a.example.com/") is None
+    assert header("https://b.example.com/") == "b=1; shared=1"
+
+    # Setting a cookie replaces what was kept.
+    jar.set_cookie(make_cookie("a.example.com", "a", "2"))
+    assert header("https://a.example.com/") == "a=2; shared=1"
+    jar.clear("a.example.com", "/", "a")
+    assert header("https://a.example.com/") == "shared=1"
+
+
+def test_cookie_header_drops_expired_cookies(cookie_file, monkeypatch):
+    jar = cURLCookieJar(cookie_file)
+    now = time.time()
+    jar.set_cookie(make_cookie("a.example.com", "short", "1",
+                               expires=int(now) + 10))
+    jar.set_cookie(make_cookie("a.example.com", "long", "1"))
+    req = request("https://a.example.com/")
+    jar.add_cookie_header(req)
+    assert req.get_header("Cookie") == "short=1; long=1"
+
+    monkeypatch.setattr(time, "time", lambda: now + 20)
+    req = request("https://a.example.com/")
+    jar.add_cookie_header(req)
+    assert req.get_header("Cookie") == "long=1"
@@ -0,0 +1,63 @@
+import math
+
+from src.cookiepack import (
+    file_stamp, pack_entries, read_cache, unpack_entries, write_cache,
+)
+
+ENTRIES = {
+    ".example.com": [
+        (".example.com", "TRUE", "/", "TRUE", "2000000000", "a", "1", False),
+        (".example.com", "TRUE", "/x", "FALSE", "0", "b", "two", True),
+    ],
+    "host.example.com": [
+        ("host.example.com", "FALSE", "/", "FALSE", "1900000000", "",
+         "naked", False),
+    ],
+}
+
+
+def test_round_trip():
+    assert unpack_entries(pack_entries(ENTRIES)) == ENTRIES
+
+
+def test_round_trip_empty():
+    assert unpack_entries(pack_entries({})) == {}
+
+
+def test_cache_round_trip(tmp_path):
+    cookie_file = tmp_path / "cookies.tmp"
+    cookie_file.write_text("# Netscape HTTP Cookie File\n")
+    stamp = file_stamp(cookie_file.stat())
+    cache = str(tmp_path / "cookies.tmp.bin")
+    write_cache(cache, ENTRIES, stamp)
+    assert read_cache(cache, stamp) == (ENTRIES, 1900000000.0)
+
+
+def test_cache_without_expiry_times(tmp_path):
+    cache = str(tmp_path / "cookies.bin")
+    entries = {"a.com": [("a.com", "FALSE", "/", "FALSE", "0", "n", "v",
+                          False)]}
+    write_cache(cache, entries, (1, 2, 3))
+    assert read_cache(cache, (1, 2, 3)) == (entries, math.inf)
+
+
+def test_cache_rejects_other_file_version(tmp_path):
+    cache = str(tmp_path / "cookies.bin")
+    write_cache(cache, ENTRIES, (1, 2, 3))
+    assert read_cache(cache, (1, 2, 4)) is None
+
+
+def test_cache_rejects_bad_crc(tmp_path):
+    cache = tmp_path / "cookies.bin"
+    write_cache(str(cache), ENTRIES, (1, 2, 3))
+    data = bytearray(cache.read_bytes())
+    data[-1] ^= 0xFF
+    cache.write_bytes(bytes(data))
+    assert read_cache(str(cache), (1, 2, 3)) is None
+
+
+def test_cache_rejects_truncated_file(tmp_path):
+    cache = tmp_path / "cookies.bin"
+    write_cache(str(cache), ENTRIES, (1, 2, 3))
+    cache.write_bytes(cache.read_bytes()[:10])
+    assert read_cache(str(cache), (1, 2, 3)) is None
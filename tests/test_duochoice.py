@@ -0,0 +1,55 @@
+import requests
+
+from benchmarks.mock_server import ScriptedHandler
+from src.duochoice import DuoChoiceCache
+from src.library import ShibbolethSession
+
+PUSH = {"device": "phone1", "factor": "Duo Push", "description": "Push"}
+
+
+class NoDuoChoiceHandler(ScriptedHandler):
+    def choose_duo(self, duo_choices):
+        raise AssertionError("Asked for a Duo choice that was remembered.")
+
+
+def test_remember_and_forget(cookie_file):
+    cache = DuoChoiceCache(cookie_file)
+    assert cache.get("uniqname") is None
+    cache.remember("uniqname", PUSH)
+    assert DuoChoiceCache(cookie_file).get("uniqname") == PUSH
+    assert cache.get("other") is None
+    cache.forget("uniqname")
+    assert cache.get("uniqname") is None
+
+
+def test_choices_needing_input_are_not_remembered(cookie_file):
+    cache = DuoChoiceCache(cookie_file)
+    for factor in ("Passcode", "sms"):
+        cache.remember("uniqname", dict(PUSH, factor=factor))
+    assert cache.get("uniqname") is None
+
+
+def test_login_uses_remembered_choice(mock, cookie_file):
+    session = ShibbolethSession(cookie_file, weblogin_host=mock.url,
+                                remember_duo=True)
+    request = requests.Request("GET", f"{mock.url}/sp/page")
+    session.perform(request, ScriptedHandler())
+    assert DuoChoiceCache(cookie_file).get("uniqname")["device"] == "phone1"
+
+    mock.expire_sessions()
+    response = session.perform(request, NoDuoChoiceHandler())
+    assert response.content == mock.sp_body
+    assert session.login_count() == 2
+
+
+def test_rejected_choice_is_forgotten(mock, cookie_file):
+    DuoChoiceCache(cookie_file).remember(
+        "uniqname", dict(PUSH, device="removed")
+    )
+    session = ShibbolethSession(cookie_file, weblogin_host=mock.url,
+                                remember_duo=True)
+    response = session.perform(
+        requests.Request("GET", f"{mock.url}/sp/page"), ScriptedHandler()
+    )
+    assert response.content == mock.sp_body
+    assert DuoChoiceCache(cookie_file).get("uniqname")["device"] == "phone1"
@@ -0,0 +1,71 @@
+import pytest
+
+from src.duoconfig import DuoConfig, parse_duo_config, parse_script
+
+SCRIPT = """
+    // Set by weblogin.
+    var error = "Additional authentication is required.";
+    var duo_config = {
+        'host': 'api-12345678.duosecurity.com',
+        'sig_request': 'TX|abc:APP|def',
+        'post_action': '/',
+        'post_argument': 'duo_response'
+    };
+"""
+
+
+def test_parse_duo_config():
+    error, config = parse_duo_config(SCRIPT)
+    assert error == "Additional authentication is required."
+    assert config.host == "api-12345678.duosecurity.com"
+    assert config.tx_signature == "TX|abc"
+    assert config.app_signature == "|def"
+    assert config.post_action == "/"
+    assert config.post_argument == "duo_response"
+
+
+def test_literals():
+    assert parse_script("""
+        var a = {"b": [1, 2.5, -3e2, true, null,], 'c': {'d': "x\\"}y"}};
+        let e = 'it\\'s \\u00e9\\n';
+        const f = [];
+    """) == {
+        "a": {"b": [1, 2.5, -300.0, True, None], "c": {"d": 'x"}y'}},
+        "e": "it's é\n",
+        "f": [],
+    }
+
+
+def test_non_literals_are_skipped():
+    assert parse_script("""
+        var a = f({"x": 1});
+        var b = 1 + 2
+        var c = "kept";
+    """) == {"c": "kept"}
+
+
+@pytest.mark.parametrize("statement", [
+    """var re = /['"]/;""",
+    """var re = /[/'"]+/g;""",
+    """var s = text.replace(/\\/'/g, "");""",
+])
+def test_regex_literals(statement):
+    # On one line, so that the quotes cannot be taken for a string.
+    script = statement + " " + " ".join(SCRIPT.split("\n")[2:])
+    error, config = parse_duo_config(script)
+    assert error == "Additional authentication is required."
+    assert config.host == "api-12345678.duosecurity.com"
+
+
+def test_division_is_not_a_regex():
+    assert parse_script("""
+        var half = width / 2; var s = '/';
+        var t = "kept";
+    """) == {"s": "/", "t": "kept"}
+
+
+def test_missing_fields():
+    with pytest.raises(ValueError):
+        DuoConfig.from_dict({"host": "api.duosecurity.com"})
+    with pytest.raises(ValueError):
+        DuoConfig("host", "TX|abc", "/", "duo_response")
@@ -0,0 +1,44 @@
+import re
+
+import pytest
+
+from benchmarks.pages import DEVICES, duo_prompt_page, weblogin_duo_page
+from src.extract import _parse_duo_prompt_bs4, find_script, parse_duo_prompt
+
+ERROR_REGEX = re.compile(r"[;\s](var|const|let)\s+error\s*=")
+
+INPUTS = [
+    ("factor", "Duo Push"),
+    ("factor", "Phone Call"),
+    ("factor", "Passcode"),
+    ("next-passcode", "1"),
+    ("phone-smsable", "True"),
+]
+
+
+def test_find_script():
+    script = find_script(weblogin_duo_page(error="Try again."), ERROR_REGEX)
+    assert 'var error = "Try again.";' in script
+    assert "duo_config" in script
+    assert find_script("<script>var x = 1;</script>", ERROR_REGEX) is None
+
+
+def test_find_script_ignores_case_and_attributes():
+    html = '<SCRIPT type="text/javascript">\n var error = "x";</Script >'
+    assert find_script(html, ERROR_REGEX) == '\n var error = "x";'
+
+
+def test_parse_duo_prompt():
+    assert parse_duo_prompt(duo_prompt_page()) == [
+        (device, description, INPUTS) for device, description in DEVICES
+    ]
+
+
+def test_parse_duo_prompt_without_devices():
+    assert parse_duo_prompt("<html><body>Sorry.</body></html>") == []
+
+
+def test_matches_beautiful_soup():
+    pytest.importorskip("bs4")
+    html = duo_prompt_page()
+    assert parse_duo_prompt(html) == _parse_duo_prompt_bs4(html)
@@ -0,0 +1,89 @@
+import json
+import threading
+
+import requests
+
+from benchmarks.mock_server import ScriptedHandler
+from src.hotp import HOTPToken, decode_secret, hotp
+from src.instrument import Recorder
+from src.library import ShibbolethSession
+
+# RFC 4226, appendix D.
+RFC_KEY = b"12345678901234567890"
+RFC_PASSCODES = [
+    "755224", "287082", "359152", "969429", "338314",
+    "254676", "287922", "162583", "399871", "520489",
+]
+SECRET = "GEZDGNBVGY3TQOJQGEZDGNBVGY3TQOJQ"
+
+
+def test_rfc_4226_test_vectors():
+    for counter, passcode in enumerate(RFC_PASSCODES):
+        assert hotp(RFC_KEY, counter) == passcode
+
+
+def test_decode_secret():
+    assert decode_secret(SECRET.lower()) == RFC_KEY
+    assert decode_secret("GEZD GNBV GY3T QOJQ GEZD GNBV GY3T QOJQ") == RFC_KEY
+
+
+def test_next_passcode_advances_counter(tmp_path):
+    path = str(tmp_path / "hotp.json")
+    token = HOTPToken.create(path, SECRET)
+    assert [token.next_passcode() for _ in range(3)] == RFC_PASSCODES[:3]
+    with open(path) as f:
+        assert json.load(f)["counter"] == 3
+
+
+def test_concurrent_next_passcode_never_repeats(tmp_path):
+    path = str(tmp_path / "hotp.json")
+    HOTPToken.create(path, SECRET)
+    passcodes = []
+    passcodes_lock = threading.Lock()
+
+    def generate():
+        # A token per thread, like separate processes sharing the file.
+        token = HOTPToken(path)
+        for _ in range(5):
+            passcode = token.next_passcode()
+            with passcodes_lock:
+                passcodes.append(passcode)
+
+    threads = [threading.Thread(target=generate) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    expected = [hotp(RFC_KEY, counter) for counter in range(40)]
+    assert sorted(passcodes) == sorted(expected)
+    with open(path) as f:
+        assert json.load(f)["counter"] == 40
+
+
+class NoDuoChoiceHandler(ScriptedHandler):
+    def choose_duo(self, duo_choices):
+        raise AssertionError("Asked for a Duo choice instead of using HOTP.")
+
+
+def test_login_with_hotp_token(mock, cookie_file, tmp_path):
+    path = str(tmp_path / "hotp.json")
+    HOTPToken.create(path, SECRET, device="phone1")
+    mock.add_hotp_token("uniqname", decode_secret(SECRET))
+    recorder = Recorder()
+    session = ShibbolethSession(cookie_file, weblogin_host=mock.url,
+                                hotp_file=path, instrumentation=recorder)
+    request = requests.Request("GET", f"{mock.url}/sp/page")
+    assert session.perform(request, NoDuoChoiceHandler()).content == (
+        mock.sp_body
+    )
+
+    # The next login uses the next passcode.
+    mock.expire_sessions()
+    assert session.perform(request, NoDuoChoiceHandler()).content == (
+        mock.sp_body
+    )
+    assert session.login_count() == 2
+    assert recorder.trace()["counters"]["duo.hotp"] == 2
+    with open(path) as f:
+        assert json.load(f)["counter"] == 2
@@ -0,0 +1,143 @@
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from benchmarks.mock_server import MockShibboleth, ScriptedHandler
+from src.httpcache import ResponseCache
+from src.instrument import Recorder
+from src.library import ShibbolethSession
+
+URL = "https://service.example.com/page"
+
+
+def _prepare(headers=None, url=URL):
+    return requests.Request("GET", url, headers=headers).prepare()
+
+
+def _response(prepped, headers, body=b"body", status=200):
+    response = requests.Response()
+    response.request = prepped
+    response.url = prepped.url
+    response.status_code = status
+    response.reason = "OK"
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body
+    return response
+
+
+def _store(cache, headers, identity="alice", request_headers=None):
+    prepped = _prepare(request_headers)
+    cache.store(identity, prepped, _response(prepped, headers))
+
+
+def test_fresh_within_max_age(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    _store(cache, {"Cache-Control": "max-age=60"})
+    entry = cache.lookup("alice", _prepare())
+    assert entry.fresh()
+    assert entry.response(_prepare()).content == b"body"
+
+
+def test_stale_entries_are_revalidated(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    _store(cache, {"Cache-Control": "max-age=60", "Age": "61",
+                   "ETag": '"v1"'})
+    entry = cache.lookup("alice", _prepare())
+    assert not entry.fresh()
+    prepped = _prepare()
+    entry.add_validators(prepped)
+    assert prepped.headers["If-None-Match"] == '"v1"'
+
+
+def test_request_no_cache_revalidates(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    _store(cache, {"Cache-Control": "max-age=60"})
+    entry = cache.lookup("alice", _prepare({"Cache-Control": "no-cache"}))
+    assert not entry.fresh()
+
+
+def test_uncacheable_responses_are_not_stored(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    _store(cache, {"Cache-Control": "no-store, max-age=60"})
+    _store(cache, {"Cache-Control": "max-age=60", "Vary": "*"},
+           identity="bob")
+    # Neither fresh for a while nor revalidatable.
+    _store(cache, {}, identity="carol")
+    for identity in ("alice", "bob", "carol"):
+        assert cache.lookup(identity, _prepare()) is None
+
+
+def test_refresh_after_304(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    _store(cache, {"Cache-Control": "no-cache", "ETag": '"v1"'})
+    entry = cache.lookup("alice", _prepare())
+    assert not entry.fresh()
+    prepped = _prepare()
+    not_modified = _response(prepped, {"Cache-Control": "max-age=60"},
+                             body=b"", status=304)
+    refreshed = cache.refresh(entry, prepped, not_modified)
+    assert refreshed.status_code == 200
+    assert refreshed.content == b"body"
+    assert cache.lookup("alice", _prepare()).fresh()
+
+
+def test_vary(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    _store(cache, {"Cache-Control": "max-age=60", "Vary": "Accept-Language"},
+           request_headers={"Accept-Language": "en"})
+    assert cache.lookup("alice", _prepare({"Accept-Language": "en"}))
+    assert cache.lookup("alice", _prepare({"Accept-Language": "fr"})) is None
+    assert cache.lookup("alice", _prepare()) is None
+
+
+def test_entries_are_per_identity(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    _store(cache, {"Cache-Control": "max-age=60"})
+    assert cache.lookup("bob", _prepare()) is None
+    cache.forget("alice")
+    assert cache.lookup("alice", _prepare()) is None
+
+
+def test_conditional_requests_are_not_cached(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    assert cache.accepts(_prepare())
+    assert not cache.accepts(_prepare({"If-None-Match": '"v1"'}))
+    assert not cache.accepts(_prepare({"Range": "bytes=0-10"}))
+    assert not cache.accepts(
+        requests.Request("POST", URL, data=b"x").prepare()
+    )
+
+
+def test_perform_revalidates_with_304(mock, cookie_file, tmp_path):
+    recorder = Recorder()
+    session = ShibbolethSession(
+        cookie_file, weblogin_host=mock.url, instrumentation=recorder,
+        response_cache=ResponseCache(str(tmp_path / "cache")),
+    )
+    url = f"{mock.url}/sp/page"
+    # The first request logs in, after which the uniqname is known.
+    for _ in range(3):
+        response = session.perform(requests.Request("GET", url),
+                                   ScriptedHandler())
+        assert response.content == mock.sp_body
+    counters = recorder.stats()["counters"]
+    assert counters["cache.misses"] == 1
+    assert counters["cache.revalidated"] == 1
+    assert mock.counts["sp_not_modified"] == 1
+
+
+def test_login_as_someone_else_forgets_entries(tmp_path, cookie_file):
+    cache = ResponseCache(str(tmp_path / "cache"))
+    users = {"alice": "a", "bob": "b"}
+    with MockShibboleth(users=users, push_delay=0) as mock:
+        session = ShibbolethSession(cookie_file, weblogin_host=mock.url,
+                                    response_cache=cache)
+        url = f"{mock.url}/sp/page"
+        for _ in range(2):
+            session.perform(requests.Request("GET", url),
+                            ScriptedHandler("alice", "a"))
+        assert cache.lookup("alice", _prepare(url=url)) is not None
+
+        mock.expire_sessions()
+        session.perform(requests.Request("GET", url),
+                        ScriptedHandler("bob", "b"))
+        assert cache.lookup("alice", _prepare(url=url)) is None
@@ -0,0 +1,124 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from benchmarks.mock_server import MockShibboleth, ScriptedHandler
+from src.instrument import Recorder
+from src.library import ShibbolethSession
+
+
+def test_perform_logs_in(mock, cookie_file):
+    session = ShibbolethSession(cookie_file, weblogin_host=mock.url)
+    response = session.perform(
+        requests.Request("GET", f"{mock.url}/sp/page"), ScriptedHandler()
+    )
+    assert response.status_code == 200
+    assert response.content == mock.sp_body
+    assert session.login_count() == 1
+
+
+def test_wrong_password_is_reported(mock, cookie_file):
+    errors = []
+
+    class Handler(ScriptedHandler):
+        def get_credentials(self):
+            password = "wrong" if not errors else "password"
+            return {"uniqname": "uniqname", "password": password}
+
+        def show_credentials_error(self, error):
+            errors.append(error)
+
+    session = ShibbolethSession(cookie_file, weblogin_host=mock.url)
+    session.perform(requests.Request("GET", f"{mock.url}/sp/page"),
+                    Handler())
+    assert len(errors) == 1
+    assert session.login_count() == 1
+
+
+def test_bounced_request_is_replayed_after_login(mock, cookie_file):
+    recorder = Recorder()
+    session = ShibbolethSession(cookie_file, weblogin_host=mock.url,
+                                instrumentation=recorder)
+    session.perform(requests.Request("GET", f"{mock.url}/sp/page"),
+                    ScriptedHandler())
+    mock.expire_sessions()
+
+    body = b"field=value"
+    response = session.perform(
+        requests.Request("POST", f"{mock.url}/sp/form", data=body),
+        ScriptedHandler(),
+    )
+    assert response.status_code == 200
+    assert response.content == mock.sp_body
+    assert session.login_count() == 2
+    posts = [
+        span["attributes"]
+        for span in recorder.trace()["spans"]
+        if span["name"] == "http" and span["attributes"]["method"] == "POST"
+        and span["attributes"]["path"] == "/sp/form"
+    ]
+    # Bounced to weblogin once, then sent again with the same body.
+    assert len(posts) == 2
+    assert all(post["bytes_sent"] == len(body) for post in posts)
+
+
+def test_download_resumes_after_cut(mock, cookie_file, tmp_path):
+    session = ShibbolethSession(cookie_file, weblogin_host=mock.url)
+    destination = str(tmp_path / "download")
+    mock.cut("/sp/", 300)
+    session.download(requests.Request("GET", f"{mock.url}/sp/file"),
+                     ScriptedHandler(), destination)
+    with open(destination, "rb") as f:
+        assert f.read() == mock.sp_body
+
+
+def test_download_restarts_unvalidated_part_file(mock, cookie_file,
+                                                 tmp_path):
+    session = ShibbolethSession(cookie_file, weblogin_host=mock.url)
+    destination = tmp_path / "download"
+    # Left behind by something that did not record what it downloaded.
+    (tmp_path / "download.part").write_bytes(b"x" * len(mock.sp_body))
+    session.download(requests.Request("GET", f"{mock.url}/sp/file"),
+                     ScriptedHandler(), str(destination))
+    assert destination.read_bytes() == mock.sp_body
+    assert not (tmp_path / "download.part.validator").exists()
+
+
+def test_requests_bounced_during_login_keep_the_new_session(cookie_file):
+    with MockShibboleth(push_delay=0, delays={"sp": 0.4}) as mock:
+        session = ShibbolethSession(cookie_file, weblogin_host=mock.url,
+                                    validity_ttl=300)
+        session.perform(requests.Request("GET", f"{mock.url}/sp/page"),
+                        ScriptedHandler())
+        mock.expire_sessions()
+
+        def perform(delay):
+            time.sleep(delay)
+            return session.perform(
+                requests.Request("GET", f"{mock.url}/sp/page"),
+                ScriptedHandler(),
+            )
+
+        with ThreadPoolExecutor(8) as executor:
+            responses = list(executor.map(perform,
+                                          [i * 0.1 for i in range(8)]))
+
+    assert all(r.content == mock.sp_body for r in responses)
+    assert session.login_count() == 2
+    with open(f"{cookie_file}.session") as f:
+        assert json.load(f)["started"] is not None
+    assert os.path.exists(f"{cookie_file}.valid")
+
+
+@pytest.mark.parametrize("binary_cache", [False, True])
+def test_binary_cache_option(mock, cookie_file, binary_cache):
+    session = ShibbolethSession(cookie_file, weblogin_host=mock.url,
+                                binary_cache=binary_cache)
+    session.perform(requests.Request("GET", f"{mock.url}/sp/page"),
+                    ScriptedHandler())
+    session.save_cookies()
+    assert os.path.exists(f"{cookie_file}.bin") == binary_cache
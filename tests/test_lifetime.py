@@ -0,0 +1,82 @@
+import time
+
+import pytest
+import requests
+
+from benchmarks.mock_server import ScriptedHandler
+from src.library import ShibbolethSession
+from src.lifetime import SessionLifetime
+from src.renewal import CachedCredentials, Renewer
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+def test_lifetime_is_learned(cookie_file, clock):
+    lifetime = SessionLifetime(cookie_file)
+    lifetime.logged_in("uniqname")
+    clock[0] += 3600
+    lifetime.ended()
+    assert lifetime.lifetime == 3600
+
+    # Carried over to other processes using the same cookie file.
+    lifetime = SessionLifetime(cookie_file)
+    assert lifetime.lifetime == 3600
+    assert lifetime.principal == "uniqname"
+    assert lifetime.started is None
+
+    # A single early end is an outlier...
+    lifetime.logged_in()
+    clock[0] += 600
+    lifetime.ended()
+    assert lifetime.lifetime == 3600
+    # ...but a second one in a row is believed.
+    lifetime.logged_in()
+    clock[0] += 1000
+    lifetime.ended()
+    assert lifetime.lifetime == 1000
+
+    lifetime.logged_in()
+    clock[0] += 1200
+    lifetime.alive()
+    assert lifetime.lifetime == 1200
+    assert lifetime.expiry() == clock[0]
+
+
+def test_lifetime_has_a_floor(cookie_file, clock):
+    lifetime = SessionLifetime(cookie_file)
+    lifetime.logged_in()
+    clock[0] += 10
+    lifetime.ended()
+    assert lifetime.lifetime == SessionLifetime.min_lifetime
+
+
+def test_renewal_does_not_interrupt_requests(mock, cookie_file):
+    session = ShibbolethSession(cookie_file, weblogin_host=mock.url)
+    handler = CachedCredentials(ScriptedHandler())
+    request = requests.Request("GET", f"{mock.url}/sp/page")
+    session.perform(request, handler)
+
+    renewer = Renewer(session, handler, margin=300, lifetime=3600,
+                      save=False)
+    assert renewer.due() == pytest.approx(time.time() + 3300, abs=5)
+    renewer.renew()
+    assert renewer.renewals == 1
+    assert session.login_count() == 2
+
+    # The renewed session is used without logging in again.
+    assert session.perform(request, handler).content == mock.sp_body
+    assert session.login_count() == 2
+
+
+def test_renewal_backs_off():
+    renewer = Renewer(None, None, retry_interval=60, max_retry_interval=200)
+    delays = []
+    for failures in range(4):
+        renewer.failures = failures
+        delays.append(renewer._retry_delay())
+    assert delays == [60, 60, 120, 200]
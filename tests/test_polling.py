@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import time
+
+import pytest
+import requests
+
+from benchmarks.mock_server import MockShibboleth, ScriptedHandler
+from src.library import ShibbolethError, ShibbolethSession
+from src.polling import PollSchedule
+
+
+@pytest.mark.parametrize("long_poll", [False, True])
+def test_duo_deadline(cookie_file, long_poll):
+    schedule = PollSchedule(deadline=1.0, long_poll=long_poll)
+    with MockShibboleth(push_delay=30, long_poll=long_poll) as mock:
+        session = ShibbolethSession(cookie_file, weblogin_host=mock.url,
+                                    poll_schedule=schedule)
+        started = time.monotonic()
+        with pytest.raises(ShibbolethError, match="Timed out"):
+            session.perform(requests.Request("GET", f"{mock.url}/sp/page"),
+                            ScriptedHandler())
+        assert time.monotonic() - started < 5
+
+
+@pytest.mark.parametrize("long_poll", [False, True])
+def test_async_duo_deadline(cookie_file, long_poll):
+    pytest.importorskip("httpx")
+    from src.aio import AsyncShibbolethSession
+
+    async def perform(mock):
+        session = AsyncShibbolethSession(
+            cookie_file, weblogin_host=mock.url,
+            poll_schedule=PollSchedule(deadline=1.0, long_poll=long_poll),
+        )
+        try:
+            await session.perform("GET", f"{mock.url}/sp/page",
+                                  ScriptedHandler())
+        finally:
+            await session.aclose()
+
+    with MockShibboleth(push_delay=30, long_poll=long_poll) as mock:
+        started = time.monotonic()
+        with pytest.raises(ShibbolethError, match="Timed out"):
+            asyncio.run(perform(mock))
+        assert time.monotonic() - started < 5
+
+
+def test_cancel_while_prompt_is_sent(cookie_file):
+    class Handler(ScriptedHandler):
+        def choose_duo(self, duo_choices):
+            # Lands while the (delayed) prompt request is in flight.
+            threading.Timer(0.2, session.cancel_two_factor).start()
+            return super().choose_duo(duo_choices)
+
+    with MockShibboleth(push_delay=30, delays={"duo": 0.5}) as mock:
+        session = ShibbolethSession(
+            cookie_file, weblogin_host=mock.url,
+            poll_schedule=PollSchedule(deadline=10.0),
+        )
+        started = time.monotonic()
+        with pytest.raises(ShibbolethError, match="cancelled"):
+            session.perform(requests.Request("GET", f"{mock.url}/sp/page"),
+                            Handler())
+        assert time.monotonic() - started < 5
+
+
+def test_request_timeout_keeps_connect_timeout():
+    schedule = PollSchedule(deadline=10.0)
+    schedule.start()
+    connect, read = schedule.request_timeout(3.0)
+    assert connect == 3.0
+    assert 9.0 < read <= 10.0
+
+    schedule = PollSchedule(deadline=0.0)
+    schedule.start()
+    assert schedule.request_timeout(3.0) == (
+        3.0, PollSchedule.min_request_timeout
+    )
+    assert PollSchedule(deadline=None).request_timeout(3.0) is None
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+import requests
+
+from benchmarks.mock_server import MockShibboleth, ScriptedHandler
+from src.pool import SessionPool
+
+USERS = {"alice": "alice-password", "bob": "bob-password"}
+
+
+@pytest.fixture
+def mock():
+    with MockShibboleth(users=USERS, push_delay=0) as mock:
+        yield mock
+
+
+def make_pool(mock, tmp_path, **options):
+    pool = SessionPool(weblogin_host=mock.url, **options)
+    for uniqname, password in USERS.items():
+        pool.add(uniqname, str(tmp_path / f"{uniqname}.cookies"),
+                 ScriptedHandler(uniqname, password))
+    return pool
+
+
+def test_each_identity_logs_in_once(mock, tmp_path):
+    with make_pool(mock, tmp_path) as pool:
+        work = [
+            (uniqname, requests.Request("GET", f"{mock.url}/sp/{i}"))
+            for i in range(8)
+            for uniqname in USERS
+        ]
+        responses = pool.perform_many(work)
+        assert all(r.content == mock.sp_body for r in responses)
+        assert sorted(pool.active()) == sorted(USERS)
+        for uniqname in USERS:
+            assert pool.session(uniqname).login_count() == 1
+
+
+def test_released_identity_reuses_its_cookies(mock, tmp_path):
+    with make_pool(mock, tmp_path) as pool:
+        request = requests.Request("GET", f"{mock.url}/sp/page")
+        pool.perform("alice", request)
+        pool.release("alice")
+        assert pool.active() == []
+
+        pool.perform("alice", request)
+        assert pool.session("alice").login_count() == 0
+
+
+def test_unknown_and_duplicate_identities(mock, tmp_path):
+    with make_pool(mock, tmp_path) as pool:
+        with pytest.raises(ValueError):
+            pool.add("alice", str(tmp_path / "other"), ScriptedHandler())
+        with pytest.raises(ValueError):
+            pool.session("carol")
+        pool.remove("bob")
+        assert pool.identities() == ["alice"]
+
+
+def test_scheduled_checks_log_in_again(mock, tmp_path):
+    with make_pool(mock, tmp_path, check_interval=0.2) as pool:
+        pool.perform("alice",
+                     requests.Request("GET", f"{mock.url}/sp/page"))
+        session = pool.session("alice")
+        mock.expire_sessions()
+        pool.start()
+        deadline = time.monotonic() + 5
+        while session.login_count() < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert session.login_count() == 2
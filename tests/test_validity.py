@@ -0,0 +1,62 @@
+import time
+
+import requests
+
+from benchmarks.mock_server import ScriptedHandler
+from src.library import ShibbolethSession
+from src.validity import ValidityCache
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_fresh_until_ttl(cookie_file, monkeypatch):
+    write(cookie_file, "# Netscape HTTP Cookie File\n")
+    cache = ValidityCache(cookie_file, ttl=60)
+    assert not cache.fresh()
+    cache.record()
+    assert cache.fresh()
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert not cache.fresh()
+
+
+def test_stale_once_a_cookie_expires(cookie_file):
+    write(cookie_file, "# Netscape HTTP Cookie File\n")
+    cache = ValidityCache(cookie_file, ttl=60)
+    cache.record(expires=time.time() - 1)
+    assert not cache.fresh()
+
+
+def test_stale_once_the_cookie_file_changes(cookie_file):
+    write(cookie_file, "# Netscape HTTP Cookie File\n")
+    cache = ValidityCache(cookie_file, ttl=60)
+    cache.record()
+    write(cookie_file, "# Netscape HTTP Cookie File\n\n")
+    assert not cache.fresh()
+
+    # Unless the verified cookies were what was saved.
+    cache.record()
+    write(cookie_file, "# Netscape HTTP Cookie File\n")
+    cache.saved()
+    assert cache.fresh()
+    cache.invalidate()
+    assert not cache.fresh()
+
+
+def test_session_skips_checking_recently_verified_cookies(mock,
+                                                         cookie_file):
+    session = ShibbolethSession(cookie_file, weblogin_host=mock.url,
+                                validity_ttl=60)
+    session.perform(requests.Request("GET", session.weblogin_url()),
+                    ScriptedHandler())
+    session.save_cookies()
+
+    requests_before = dict(mock.counts)
+    session = ShibbolethSession(cookie_file, weblogin_host=mock.url,
+                                validity_ttl=60)
+    assert session.check_already_authenticated()
+    assert mock.counts == requests_before
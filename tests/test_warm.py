@@ -0,0 +1,40 @@
+import requests
+
+from benchmarks.mock_server import ScriptedHandler
+from src.instrument import Recorder
+from src.library import ShibbolethSession
+
+
+def test_login_warms_services(mock, cookie_file):
+    recorder = Recorder()
+    session = ShibbolethSession(
+        cookie_file, weblogin_host=mock.url, instrumentation=recorder,
+        warm_urls=[f"{mock.url}/sp/a", f"{mock.url}/sp/b"],
+    )
+    # Nothing to warm before logging in.
+    assert session.warm() == [None, None]
+
+    session.perform(requests.Request("GET", session.weblogin_url()),
+                    ScriptedHandler())
+    spans = [span["name"] for span in recorder.trace()["spans"]]
+    assert "warm" in spans
+
+    # The services' sessions were started by the login.
+    sp_requests = mock.counts["sp"]
+    response = session.perform(
+        requests.Request("GET", f"{mock.url}/sp/a"), ScriptedHandler()
+    )
+    assert response.content == mock.sp_body
+    assert mock.counts["sp"] == sp_requests + 1
+
+
+def test_unreachable_services_are_skipped(mock, cookie_file):
+    recorder = Recorder()
+    session = ShibbolethSession(cookie_file, weblogin_host=mock.url,
+                                instrumentation=recorder)
+    session.perform(requests.Request("GET", session.weblogin_url()),
+                    ScriptedHandler())
+    assert session.warm(["http://127.0.0.1:9/", f"{mock.url}/sp/a"]) == [
+        None, 200,
+    ]
+    assert recorder.trace()["counters"]["warm.failures"] == 1